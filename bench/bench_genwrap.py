@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""Micro-benchmarks of GenWrapLSST command line construction and list handling.
+
+Generates synthetic input wcl and list files (textcsv, texttab, textsp,
+wcl) and times the wrapper phases without running any LSST code (needs
+despymisc and intgutils).  Every phase is run on fresh wrappers and the
+resulting command lines (including spilled argfiles) must be identical
+between runs and between list formats.
+
+    bench_genwrap.py --sizes 10,1000,100000 --formats textcsv,wcl --repeat 3
+"""
+
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+LIST_FORMATS = ['textcsv', 'texttab', 'textsp', 'wcl']
+DEFAULT_SIZES = '10,1000,10000,100000'
+NUM_CCDS = 104
+
+LIST_DELIMS = {'textcsv': ',', 'texttab': '\t', 'textsp': ' '}
+COLUMNS = 'img_corr.fullname,img_corr.visit,img_corr.ccd'
+
+CMDLINE_MODES = OrderedDict([
+    ('per_file_cmdline', 'list.corr.img_corr:--selectId visit=$(visit) ccd=$(ccd)'),
+    ('add_cmdline', "'^'.join(list.corr.img_corr.visit)"),
+])
+
+
+def load_wrapper_module():
+    """Import bin/genwrap_lsst.py (a script, not part of the package).
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'genwrap_lsst.py')
+    spec = importlib.util.spec_from_file_location('genwrap_lsst', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_rows(nlines):
+    """(fullname, visit, ccd) rows, visits shuffled so ordering bugs show up.
+    """
+    rows = []
+    for i in range(nlines):
+        visit = 1000 + ((i // NUM_CCDS) * 7919) % 100003
+        ccd = i % NUM_CCDS
+        rows.append(('/data/raw/HSC-%07d-%03d.fits' % (visit, ccd), str(visit), str(ccd)))
+    return rows
+
+
+def write_list(path, fmt, rows):
+    """Write rows as a list file in the given format.
+    """
+    with open(path, 'w') as outfh:
+        if fmt == 'wcl':
+            outfh.write('<list>\n    <line>\n')
+            for i, (fullname, visit, ccd) in enumerate(rows):
+                outfh.write('        <line%05d>\n            <file>\n                <img_corr>\n' % (i + 1))
+                outfh.write('                    fullname = %s\n' % fullname)
+                outfh.write('                    visit = %s\n' % visit)
+                outfh.write('                    ccd = %s\n' % ccd)
+                outfh.write('                </img_corr>\n            </file>\n        </line%05d>\n' % (i + 1))
+            outfh.write('    </line>\n</list>\n')
+        else:
+            for row in rows:
+                outfh.write(LIST_DELIMS[fmt].join(row) + '\n')
+
+
+def write_inputwcl(path, listfile, fmt, mode, argdir):
+    """Write an input wcl with a single exec using the list in the given cmdline mode.
+    """
+    with open(path, 'w') as outfh:
+        outfh.write('<wrapper>\n')
+        outfh.write('    %s = %s\n' % (mode, CMDLINE_MODES[mode]))
+        outfh.write('    argfile_dir = %s\n' % argdir)
+        outfh.write('</wrapper>\n')
+        outfh.write('<list>\n    <corr>\n')
+        outfh.write('        fullname = %s\n' % listfile)
+        outfh.write('        format = %s\n' % fmt)
+        outfh.write('        columns = %s\n' % COLUMNS)
+        outfh.write('    </corr>\n</list>\n')
+        outfh.write('<exec_1>\n    execname = processCcd.py\n')
+        outfh.write('    <cmdline>\n        _01 = jobrepo\n    </cmdline>\n</exec_1>\n')
+
+
+def run_create_command_line(module, wclfile):
+    """Build the command line on a fresh wrapper returning (cmdline, argfile contents).
+    """
+    bwrap = module.GenWrapLSST(wclfile)
+    bwrap.curr_exec = OrderedDict([('task_info', OrderedDict())])
+    bwrap.create_command_line('1', bwrap.inputwcl['exec_1'])
+    cmdline = bwrap.curr_exec['cmdline']
+    argfiles = OrderedDict()
+    for name, info in bwrap.curr_exec.get('argfiles', {}).items():
+        with open(info['path'], 'r') as argfh:
+            argfiles[name] = argfh.read()
+    return cmdline, argfiles
+
+
+def timed(func, repeat):
+    """Return (best wall time, result of last run).
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        secs = time.time() - start
+        best = secs if best is None else min(best, secs)
+    return best, result
+
+
+def bench_one(module, workdir, fmt, rows, repeat):
+    """Time the phases for one list format and size.
+
+    Returns (OrderedDict phase -> secs, OrderedDict mode -> command line result).
+    """
+    from desdmfw_lsst_plugins import genwrap_listfile
+
+    nlines = len(rows)
+    listfile = os.path.join(workdir, 'list_%s_%s.%s' % (fmt, nlines, 'wcl' if fmt == 'wcl' else 'txt'))
+    write_list(listfile, fmt, rows)
+
+    timings = OrderedDict()
+    outputs = OrderedDict()
+
+    def parse_list():
+        return sum(1 for _ in genwrap_listfile.ListFileCache().iter_files(listfile, fmt, COLUMNS))
+    timings['list_parse'], count = timed(parse_list, repeat)
+    assert count == nlines, 'parsed %s lines instead of %s' % (count, nlines)
+
+    if fmt != 'wcl':
+        wclfile = os.path.join(workdir, 'read_listfile.wcl')
+        write_inputwcl(wclfile, listfile, fmt, 'per_file_cmdline', workdir)
+        bwrap = module.GenWrapLSST(wclfile)
+        timings['read_listfile'], _ = timed(lambda: bwrap.read_listfile(listfile, fmt, COLUMNS), repeat)
+
+    patterns = ['--selectId visit=$(visit) ccd=$(ccd) id=%s' % i for i in range(nlines)]
+    timings['change_vars_parens'], _ = timed(
+        lambda: [module.GenWrapLSST._change_vars_parens(pat) for pat in patterns], repeat)
+
+    for mode in CMDLINE_MODES:
+        # same argfile path for every format so command lines can be compared
+        argdir = os.path.join(workdir, 'args_%s_%s' % (nlines, mode))
+        if not os.path.exists(argdir):
+            os.mkdir(argdir)
+        wclfile = os.path.join(workdir, 'input_%s_%s_%s.wcl' % (fmt, nlines, mode))
+        write_inputwcl(wclfile, listfile, fmt, mode, argdir)
+
+        first = run_create_command_line(module, wclfile)
+        timings[mode], last = timed(lambda: run_create_command_line(module, wclfile), repeat)
+        assert first == last, '%s command line differs between runs (%s, %s lines)' % (mode, fmt, nlines)
+        outputs[mode] = last
+
+    # add_cmdline keeps unique values in list order
+    expected = '^'.join(OrderedDict((row[1], True) for row in rows).keys())
+    (cmdline, argfiles) = outputs['add_cmdline']
+    joined = list(argfiles.values())[0] if argfiles else cmdline
+    assert expected in joined, 'add_cmdline values not in list order (%s, %s lines)' % (fmt, nlines)
+
+    return timings, outputs
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of GenWrapLSST phases')
+    parser.add_argument('--sizes', action='store', default=DEFAULT_SIZES,
+                        help='comma separated numbers of list lines')
+    parser.add_argument('--formats', action='store', default=','.join(LIST_FORMATS))
+    parser.add_argument('--repeat', action='store', type=int, default=3,
+                        help='runs per phase, best time is reported')
+    parser.add_argument('--workdir', action='store', default=None)
+    parser.add_argument('--keep', action='store_true', default=False,
+                        help="don't remove the generated files")
+    args = parser.parse_args()
+
+    module = load_wrapper_module()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_genwrap_')
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+
+    status = 0
+    try:
+        print('%-8s %8s  %-20s %10s' % ('format', 'lines', 'phase', 'secs'))
+        for nlines in [int(size) for size in args.sizes.split(',')]:
+            rows = synthetic_rows(nlines)
+            reference = None
+            for fmt in args.formats.split(','):
+                timings, outputs = bench_one(module, workdir, fmt, rows, args.repeat)
+                for phase, secs in timings.items():
+                    print('%-8s %8s  %-20s %10.4f' % (fmt, nlines, phase, secs))
+
+                # every list format must give the same command lines
+                if reference is None:
+                    reference = outputs
+                elif outputs != reference:
+                    print('ERROR: command lines from %s list differ from %s list (%s lines)' %
+                          (fmt, args.formats.split(',')[0], nlines))
+                    status = 1
+            sys.stdout.flush()
+    finally:
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
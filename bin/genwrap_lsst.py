@@ -3,116 +3,376 @@
 """Specialized wrapper to run LSST command line tasks.
 """
 
+import time
+from collections import OrderedDict
+
+# timings of the wrapper start-up reported by --profile-startup
+STARTUP_TIMINGS = OrderedDict()
+
+_t0 = time.time()
 import os
 import sys
 import re
-import tarfile
 import argparse
-import shutil
-import yaml
-
+import threading
+import traceback
+STARTUP_TIMINGS['import_stdlib'] = time.time() - _t0
+
+# Only the modules needed by every run are imported here.  Optional
+# dependencies (yaml, tarfile, shutil, queryutils, wcl, lsst Butler) and
+# the genwrap modules of optional features (node cache, memo, sharding,
+# parallel execs, output compression, ref cat staging) are imported
+# inside the code paths that use them to keep start-up cheap.
+_t0 = time.time()
 from despymisc import miscutils
 from intgutils import intgmisc
 from intgutils import basic_wrapper
 from intgutils import intgdefs
-from intgutils import queryutils
-from intgutils import wcl
 import intgutils.replace_funcs as repfunc
 
+from desdmfw_lsst_plugins import genwrap_argfile
+from desdmfw_lsst_plugins import genwrap_listfile
+from desdmfw_lsst_plugins import genwrap_procacct
+from desdmfw_lsst_plugins import genwrap_profile
+from desdmfw_lsst_plugins import genwrap_template
+STARTUP_TIMINGS['import_intgutils'] = time.time() - _t0
+
 
 class GenWrapLSST(basic_wrapper.BasicWrapper):
     """Class to run LSST command line tasks.
     """
 
     def __init__(self, wclfile, debug=1):
+        self.startup_timings = OrderedDict()
+
+        # curr_exec and curr_task are per thread so exec sections can run concurrently
+        self._local = threading.local()
+
+        # serialize writes to the job repo registry across concurrent execs
+        self._ingest_lock = threading.Lock()
+
+        phase_start = time.time()
         basic_wrapper.BasicWrapper.__init__(self, wclfile, debug)
+        self.startup_timings['basic_init'] = time.time() - phase_start
+
+        # opt-in profiling of entry points (environment variables override these)
+        if 'wrapper' in self.inputwcl and 'profile' in self.inputwcl['wrapper']:
+            genwrap_profile.configure(self.inputwcl['wrapper']['profile'],
+                                      self.inputwcl['wrapper'].get('profile_dir', None),
+                                      self.inputwcl['wrapper'].get('profile_mode', None))
+
+        # resource usage per phase (setup, repoingest, exec)
+        self.procacct = genwrap_procacct.ProcAccounting()
+
+        # parsed list files shared by per_file_cmdline and add_cmdline
+        self.listcache = genwrap_listfile.ListFileCache()
+
+        # compiled patterns and resolved variables for replacing vars in inputwcl values
+        self.templates = genwrap_template.TemplateCache(self.inputwcl)
+
+        # registry keys already ingested in the job repo, per registry table
+        self.job_repo_dir = None
+        self.registry_keys = {}
+
+        # optional node-local cache of input files
+        self.nodecache = None
+        self.input_md5sums = None
+        if 'wrapper' in self.inputwcl and 'input_cache_dir' in self.inputwcl['wrapper']:
+            from desdmfw_lsst_plugins import genwrap_cache
+            self.nodecache = genwrap_cache.NodeCache(
+                self.templates.replace(self.inputwcl['wrapper']['input_cache_dir']),
+                genwrap_cache.parse_bytes(self.inputwcl['wrapper'].get('input_cache_bytes', '100G')))
+
+        # optional store of completed exec results to skip identical reruns
+        self.execmemo = None
+        if 'wrapper' in self.inputwcl and 'exec_memo_dir' in self.inputwcl['wrapper']:
+            from desdmfw_lsst_plugins import genwrap_memo
+            self.execmemo = genwrap_memo.ExecMemo(self.templates.replace(self.inputwcl['wrapper']['exec_memo_dir']))
 
         if 'wrapper' in self.inputwcl:
             # Specialized: initialize repo directory if doesn't exist
             if 'job_repo_dir' in self.inputwcl['wrapper'] and 'mapper' in self.inputwcl['wrapper']:
-                jrdir = repfunc.replace_vars_single(self.inputwcl['wrapper']['job_repo_dir'], self.inputwcl,
-                                                    {intgdefs.REPLACE_VARS: True,
-                                                     'expand': True, 'keepvars': False})
-                which_mapper = repfunc.replace_vars_single(self.inputwcl['wrapper']['mapper'], self.inputwcl,
-                                                           {intgdefs.REPLACE_VARS: True,
-                                                            'expand': True, 'keepvars': False})
+                phase_start = time.time()
+                jrdir = self.templates.replace(self.inputwcl['wrapper']['job_repo_dir'])
+                which_mapper = self.templates.replace(self.inputwcl['wrapper']['mapper'])
 
                 #if not os.path.exists(self.inputwcl['wrapper']['job_repo_dir']):
                 if not os.path.exists(jrdir):
                     miscutils.coremakedirs(jrdir)
+                self.job_repo_dir = jrdir
+                self.startup_timings['job_repo'] = time.time() - phase_start
 
                 #MMG if 'butler_template' in self.inputwcl['wrapper'] and not os.path.exists(os.path.join(jrdir, 'repositoryCfg.yaml')):
+                phase_start = time.time()
                 if 'butler_template' in self.inputwcl['wrapper']:
-                    btwcl = wcl.WCL()
-                    btfile = repfunc.replace_vars_single(self.inputwcl['wrapper']['butler_template'], self.inputwcl,
-                                                         {intgdefs.REPLACE_VARS: True,
-                                                          'expand': True, 'keepvars': False})
-
-                    # read yaml file with directory/filename templates
-                    policy = {}
-                    with open(btfile) as infh:
-                        policy = yaml.load(infh)
-
-                    # replace framework variables like reqnum in patterns
-                    for wkey in policy:
-                        for dtype in policy[wkey]:
-                            template_str = repfunc.replace_vars_single(policy[wkey][dtype], self.inputwcl,
-                                                                       {intgdefs.REPLACE_VARS: True,
-                                                                        'expand': True, 'keepvars': False})
-                            policy[wkey][dtype] = {'template': str(template_str)}
-
-                    # the following should make a yaml config file for the Butler
-                    # must set root to empty directory for this to work
-                    from lsst.daf.persistence import Butler
-                    mapper_instance = miscutils.dynamically_load_class(which_mapper)
-                    b = Butler(outputs={'root': 'tmprepo',
-                                        'mapper': mapper_instance,
-                                        'policy': policy}
-                               )
-                    os.rename('tmprepo/repositoryCfg.yaml', os.path.join(jrdir, 'repositoryCfg.yaml'))
-                    os.rmdir('tmprepo')
+                    with self.procacct.inproc('setup'):
+                        self._init_butler_template(jrdir, which_mapper)
+                    self.startup_timings['butler_template'] = time.time() - phase_start
                 else:
                     mapperfile = os.path.join(jrdir, '_mapper')
                     if not os.path.exists(mapperfile):
                         with open(mapperfile, 'w') as mapfh:
                             mapfh.write(which_mapper)
+                    self.startup_timings['mapper_file'] = time.time() - phase_start
 
                 if 'ref_cats_root' in self.inputwcl['wrapper']:
-                    rcroot = repfunc.replace_vars_single(self.inputwcl['wrapper']['ref_cats_root'],
-                                                         self.inputwcl,
-                                                         {intgdefs.REPLACE_VARS: True,
-                                                          'expand': True, 'keepvars': False})
-                    if not os.path.exists(rcroot):
-                        raise IOError('ref_cats_root (%s) does not exist' % rcroot)
-
-                    jrrc = os.path.join(jrdir, 'ref_cats')
-                    if not os.path.exists(jrrc):
-                        os.symlink(rcroot, jrrc)
+                    phase_start = time.time()
+                    self._init_ref_cats(jrdir)
+                    self.startup_timings['ref_cats'] = time.time() - phase_start
 
             # Specialized: untar files (e.g., reference catalog)
-            # untar_files is comma-separated list of tarballs
-            #     (should be references to file entries)
-            # Code will untar tarball in same path as tarball
-            # Code does not modify any wcl (i.e., no input def or output def changes)
             if 'untar_files' in self.inputwcl['wrapper']:
-                tballs, _ = repfunc.replace_vars(self.inputwcl['wrapper']['untar_files'],
-                                                 self.inputwcl,
-                                                 {intgdefs.REPLACE_VARS: True,
-                                                  'expand': True, 'keepvars': False})
-
-                if isinstance(tballs, str):
-                    tballs = [tballs]
-                for tar_filename in tballs:
-                    miscutils.fwdebug_print("INFO: tar_filename %s " % (tar_filename),
-                                            basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-                    tardir = os.path.dirname(tar_filename)
-                    if tar_filename.endswith('.gz'):
-                        mode = 'r:gz'
-                    else:
-                        mode = 'r'
-                    with tarfile.open(tar_filename, mode) as tar:
-                        tar.extractall(tardir)
+                phase_start = time.time()
+                with self.procacct.inproc('setup'):
+                    self._untar_files()
+                self.startup_timings['untar_files'] = time.time() - phase_start
+
+    @property
+    def curr_exec(self):
+        return getattr(self._local, 'curr_exec', None)
+
+    @curr_exec.setter
+    def curr_exec(self, val):
+        self._local.curr_exec = val
+
+    @property
+    def curr_task(self):
+        return getattr(self._local, 'curr_task', None)
+
+    @curr_task.setter
+    def curr_task(self, val):
+        self._local.curr_task = val
+
+    def _init_butler_template(self, jrdir, which_mapper):
+        """Create the Butler repositoryCfg.yaml from the butler_template policy.
+        """
+        import yaml
+
+        btfile = self.templates.replace(self.inputwcl['wrapper']['butler_template'])
+
+        # read yaml file with directory/filename templates
+        policy = {}
+        with open(btfile) as infh:
+            policy = yaml.load(infh)
+
+        # replace framework variables like reqnum in patterns
+        for wkey in policy:
+            for dtype in policy[wkey]:
+                template_str = self.templates.replace(policy[wkey][dtype])
+                policy[wkey][dtype] = {'template': str(template_str)}
+
+        # the following should make a yaml config file for the Butler
+        # must set root to empty directory for this to work
+        from lsst.daf.persistence import Butler
+        mapper_instance = miscutils.dynamically_load_class(which_mapper)
+        b = Butler(outputs={'root': 'tmprepo',
+                            'mapper': mapper_instance,
+                            'policy': policy}
+                   )
+        os.rename('tmprepo/repositoryCfg.yaml', os.path.join(jrdir, 'repositoryCfg.yaml'))
+        os.rmdir('tmprepo')
+
+    def _init_ref_cats(self, jrdir):
+        """Make the reference catalogs available inside the job repo.
+
+        Normally the entire ref_cats_root is symlinked.  With ref_cats_stage = True
+        only the HTM shards overlapping the job footprint (ref_cats_radius degrees
+        around each input position) are linked.
+        """
+        rcroot = self.templates.replace(self.inputwcl['wrapper']['ref_cats_root'])
+        if not os.path.exists(rcroot):
+            raise IOError('ref_cats_root (%s) does not exist' % rcroot)
+
+        jrrc = os.path.join(jrdir, 'ref_cats')
+        if os.path.exists(jrrc):
+            return
+
+        if miscutils.convertBool(self.inputwcl['wrapper'].get('ref_cats_stage', False)):
+            positions = self._footprint_positions()
+            if positions:
+                from desdmfw_lsst_plugins import genwrap_refcats
+                radius = float(self.inputwcl['wrapper'].get('ref_cats_radius', 0.3))
+                linkfunc = os.symlink
+                if self.nodecache is not None:
+                    def linkfunc(src, dest):
+                        self.nodecache.fetch(src, dest=dest)
+                nshards = genwrap_refcats.stage_refcats(rcroot, jrrc, positions, radius, linkfunc)
+                miscutils.fwdebug_print("INFO: staged %s ref cat shards for %s positions" %
+                                        (nshards, len(positions)), basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+                return
+            miscutils.fwdebug_print("WARN: could not determine footprint, linking all of %s" % rcroot,
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
 
+        os.symlink(rcroot, jrrc)
+
+    def _footprint_positions(self):
+        """(RA, Dec, margin) of the job inputs from list columns (ra, dec) or input headers.
+
+        margin is the field of view radius for headers without a WCS (see
+        genwrap_refcats.header_position), else 0.
+        """
+        from desdmfw_lsst_plugins import genwrap_refcats
+
+        positions = []
+        if intgdefs.IW_LIST_SECT in self.inputwcl:
+            for listsect in self.inputwcl[intgdefs.IW_LIST_SECT]:
+                for fdict in self._iter_list_files(listsect):
+                    for vals in fdict.values():
+                        if 'ra' in vals and 'dec' in vals:
+                            positions.append((float(vals['ra']), float(vals['dec']), 0.0))
+
+        if not positions:
+            ins, _ = intgmisc.get_fullnames(self.inputwcl, self.inputwcl)
+            for sect in sorted(ins):
+                sectkeys = sect.lower().split('.')
+                if sectkeys[0] != intgdefs.IW_FILE_SECT or \
+                        'repoingest' not in self.inputwcl[intgdefs.IW_FILE_SECT][sectkeys[1]]:
+                    continue
+                for fname in sorted(ins[sect]):
+                    pos = genwrap_refcats.header_position(fname)
+                    if pos is not None:
+                        positions.append(pos)
+
+        # many ccds share a pointing, no need to compute the same cover repeatedly
+        return sorted(set((round(ra, 3), round(dec, 3), margin) for (ra, dec, margin) in positions))
+
+    def _untar_files(self):
+        """Untar files (e.g., reference catalog).
+
+        untar_files is comma-separated list of tarballs
+            (should be references to file entries)
+        Code will untar tarball in same path as tarball
+        Code does not modify any wcl (i.e., no input def or output def changes)
+        """
+        import tarfile
+
+        tballs, _ = repfunc.replace_vars(self.inputwcl['wrapper']['untar_files'],
+                                         self.inputwcl,
+                                         {intgdefs.REPLACE_VARS: True,
+                                          'expand': True, 'keepvars': False})
+
+        if isinstance(tballs, str):
+            tballs = [tballs]
+        for tar_filename in tballs:
+            miscutils.fwdebug_print("INFO: tar_filename %s " % (tar_filename),
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+            tardir = os.path.dirname(tar_filename)
+            if tar_filename.endswith('.gz'):
+                mode = 'r:gz'
+            else:
+                mode = 'r'
+            with tarfile.open(tar_filename, mode) as tar:
+                tar.extractall(tardir)
+
+    def report_startup_timings(self):
+        """Print the import and init-phase timings of the wrapper start-up.
+        """
+        timings = OrderedDict()
+        for name, secs in list(STARTUP_TIMINGS.items()):
+            timings[name] = secs
+        for name, secs in list(self.startup_timings.items()):
+            timings[name] = secs
+
+        for name, secs in list(timings.items()):
+            miscutils.fwdebug_print("INFO: startup %s = %0.4f secs" % (name, secs),
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+        miscutils.fwdebug_print("INFO: startup total = %0.4f secs" % sum(timings.values()),
+                                basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+        # save in output wcl so start-up regressions can be tracked across jobs
+        self.outputwcl['wrapper']['startup_timings'] = timings
+
+    def _exec_fullnames(self, exwcl):
+        """Return (inputs, outputs) fullnames of the exec section exwcl.
+        """
+        execs = intgmisc.get_exec_sections(self.inputwcl, intgdefs.IW_EXEC_PREFIX)
+        for ekey, iw_exec in execs.items():
+            if iw_exec is exwcl:
+                return intgmisc.get_fullnames(self.inputwcl, self.inputwcl, ekey)
+
+        # exwcl not one of the inputwcl exec sections, use all of them
+        return intgmisc.get_fullnames(self.inputwcl, self.inputwcl)
+
+    def run_wrapper(self):
+        """Run the exec sections, independent ones concurrently if parallel_execs.
+        """
+        wrapdict = self.inputwcl.get('wrapper', {})
+        if not miscutils.convertBool(wrapdict.get('parallel_execs', False)):
+            basic_wrapper.BasicWrapper.run_wrapper(self)
+            return
+
+        from desdmfw_lsst_plugins import genwrap_cache
+        from desdmfw_lsst_plugins import genwrap_execgraph
+        from desdmfw_lsst_plugins import genwrap_shard
+
+        execs = intgmisc.get_exec_sections(self.inputwcl, intgdefs.IW_EXEC_PREFIX)
+        deps = genwrap_execgraph.build_graph(execs, self.job_repo_dir)
+        needs = {}
+        for ekey, iw_exec in execs.items():
+            needs[ekey] = (int(iw_exec.get('exec_cores', 1)),
+                           genwrap_cache.parse_bytes(iw_exec.get('exec_memory', 0)))
+        budget = (int(wrapdict.get('exec_core_budget', genwrap_shard.available_cores())),
+                  genwrap_cache.parse_bytes(wrapdict['exec_memory_budget'])
+                  if 'exec_memory_budget' in wrapdict else None)
+
+        for ekey in deps:
+            miscutils.fwdebug_print("INFO: %s depends on %s" % (ekey, ','.join(sorted(deps[ekey])) or 'none'),
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+        statuses = genwrap_execgraph.run_graph(deps, needs, budget, self._run_exec_section)
+
+        schedule = OrderedDict()
+        for ekey, status in statuses.items():
+            ow_exec = self.outputwcl.get(ekey, {})
+            schedule[ekey] = OrderedDict([('status', status),
+                                          ('depends', ','.join(sorted(deps[ekey]))),
+                                          ('start_time', ow_exec.get('exec_start_time')),
+                                          ('end_time', ow_exec.get('exec_end_time')),
+                                          ('walltime', ow_exec.get('exec_walltime'))])
+        self.outputwcl['wrapper']['exec_schedule'] = schedule
+
+        retcode = genwrap_shard.aggregate_status(list(statuses.values()))
+        if retcode == 0:
+            self.cleanup()
+        self.outputwcl['wrapper']['status'] = retcode
+
+    def _run_exec_section(self, ekey):
+        """Run all the steps of a single exec section in the current thread.
+        """
+        iw_exec = self.inputwcl[ekey]
+        ow_exec = {'task_info': {}}
+        self.outputwcl[ekey] = ow_exec
+        self.curr_exec = ow_exec
+        self.curr_task = []
+
+        ow_exec['exec_start_time'] = time.time()
+        execnum = ekey[len(intgdefs.IW_EXEC_PREFIX):]
+        try:
+            self.transform_inputs(iw_exec)
+            inputs = self.check_inputs(ekey)
+            self.check_command_line(ekey, iw_exec)
+            self.save_exec_version(iw_exec)
+            self.create_command_line(execnum, iw_exec)
+            self.create_output_dirs(iw_exec)
+            self.run_exec()
+            self.transform_outputs(iw_exec)
+            outexist = self.check_outputs(ekey, ow_exec['status'])
+            self.save_outputs_by_section(ekey, outexist)
+            self.save_provenance(ekey, iw_exec, inputs, outexist, ow_exec['status'])
+        except Exception:
+            print("%s failed:" % ekey)
+            traceback.print_exc(file=sys.stdout)
+            while self.curr_task:
+                self.end_exec_task(1)
+            if not ow_exec.get('status'):
+                ow_exec['status'] = 1
+        sys.stdout.flush()
+
+        ow_exec['exec_end_time'] = time.time()
+        ow_exec['exec_walltime'] = ow_exec['exec_end_time'] - ow_exec['exec_start_time']
+        return ow_exec['status']
+
+    @genwrap_profile.profiled('transform_inputs')
     def transform_inputs(self, exwcl):
         """Method to prepare the inputs.
         """
@@ -120,9 +380,7 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
 
         self.start_exec_task('transform_inputs')
 
-        # HACK assuming single exec section because otherwise need exkey
-        #      to pass into get_fullnames
-        ins, _ = intgmisc.get_fullnames(self.inputwcl, self.inputwcl)
+        ins, _ = self._exec_fullnames(exwcl)
         for sect in ins:
             sectkeys = sect.lower().split('.')
 
@@ -138,12 +396,8 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
             if 'rename_file' in filesect:
                 # dst should not have path as code assumes same path as src
                 # src should be single file (hence the previous check for being in file sect)
-                src = repfunc.replace_vars_single(ins[sect].pop(), self.inputwcl,
-                                                  {intgdefs.REPLACE_VARS: True,
-                                                   'expand': True, 'keepvars': False})
-                dest = repfunc.replace_vars_single(filesect['rename_file'], self.inputwcl,
-                                                   {intgdefs.REPLACE_VARS: True,
-                                                    'expand': True, 'keepvars': False})
+                src = self.templates.replace(ins[sect].pop())
+                dest = self.templates.replace(filesect['rename_file'])
                 #if isinstance(val, list):
                 #    raise ValueError('rename_files expanded into multiple src files which is currently not supported (%s)' % src)
 
@@ -151,77 +405,252 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
 
                 miscutils.fwdebug_print("INFO: rename %s to %s " % (src, os.path.join(srcdir, dest)),
                                         basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-                shutil.copyfile(src, os.path.join(srcdir, dest))
+                if self._use_nodecache(filesect):
+                    # serve renamed copy from node-local cache instead of copying from shared fs
+                    self.nodecache.fetch(src, checksum=self._cache_checksum(src),
+                                         dest=os.path.join(srcdir, dest))
+                else:
+                    import shutil
+                    shutil.copyfile(src, os.path.join(srcdir, dest))
 
             # if need to ingest input files into butler repository
             # not all inputs are ingested (e.g., ref cats, bf kernel, etc)
             if 'repoingest' in filesect:
                 # create base repo ingest command line (minus actual filename)
-                basecmd = repfunc.replace_vars_single(filesect['repoingest'], self.inputwcl,
-                                                      {intgdefs.REPLACE_VARS: True,
-                                                       'expand': True, 'keepvars': False})
-
-                for fname in ins[sect]:
+                basecmd = self.templates.replace(filesect['repoingest'])
+
+                fnames = list(ins[sect])
+                if miscutils.convertBool(self.inputwcl['wrapper'].get('ingest_skip_existing', False)):
+                    fnames = self._filter_ingested(filesect, fnames)
+                if self._use_nodecache(filesect):
+                    stagedir = self.inputwcl['wrapper'].get('input_cache_stage_dir', 'cached_inputs')
+                    fnames = [self.nodecache.stage(fname, stagedir, checksum=self._cache_checksum(fname))
+                              for fname in fnames]
+
+                pipeline = miscutils.convertBool(self.inputwcl['wrapper'].get('pipeline_ingest', False))
+                failed = []
+                for fname in fnames:
                     # create final repo ingest command line replacing xxxfilenamexxx
                     #   with the filename
                     repocmd = re.sub("xxxfilenamexxx", fname, basecmd)
-                    miscutils.fwdebug_print("INFO: repocmd = %s" % repocmd,
-                                            basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+                    if pipeline:
+                        # ingested per visit group while the task runs (see run_exec)
+                        if 'pending_ingest' not in self.curr_exec:
+                            self.curr_exec['pending_ingest'] = []
+                        self.curr_exec['pending_ingest'].append((fname, repocmd))
+                    elif self._run_repoingest(repocmd) != 0:
+                        failed.append(repocmd)
+                self._check_ingests(failed)
+
+        self.end_exec_task(0)
+
+    def _run_repoingest(self, repocmd):
+        """Run a single repo ingest command returning its exit code.
+        """
+        miscutils.fwdebug_print("INFO: repocmd = %s" % repocmd,
+                                basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+        # run repo ingest command collecting wait4 process info
+        with self._ingest_lock:
+            (retcode, procinfo) = genwrap_procacct.run_exec(repocmd)
+        self.procacct.add_proc('repoingest', retcode, procinfo)
+        if retcode != 0:
+            miscutils.fwdebug_print("ERROR: non-zero exit code (%s) from repo ingest (%s)" %
+                                    (retcode, repocmd), basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+        return retcode
+
+    def _ingest_pending(self, pending_ingest):
+        """Run the repo ingests postponed by pipeline_ingest (list of (fullname, repocmd)).
+        """
+        self._check_ingests([repocmd for (_, repocmd) in pending_ingest
+                             if self._run_repoingest(repocmd) != 0])
 
-                    # run repo ingest command collecting wait4 process info
-                    #     in case we want to modify code to do something with it later
-                    (retcode, procinfo) = intgmisc.run_exec(repocmd)
-                    #if retcode != 0:
-                    #    raise RuntimeError('Problem ingesting file into butler repo (%s)' % repocmd)
+    @classmethod
+    def _check_ingests(cls, failed):
+        """Raise if any repo ingest command failed.
+        """
+        if failed:
+            raise RuntimeError('Problem ingesting %s file(s) into butler repo (%s)' %
+                               (len(failed), failed[0]))
+
+    def _cache_checksum(self, fullname):
+        """Framework checksum (md5sum) of input fullname to key its node cache entry, else None.
+        """
+        if self.input_md5sums is None:
+            self.input_md5sums = self._read_input_md5sums()
+        return self.input_md5sums.get(os.path.basename(fullname))
+
+    def _read_input_md5sums(self):
+        """Return dict basename -> md5sum of inputs from file sections and list columns.
+        """
+        md5sums = {}
+        for filesect in self.inputwcl.get(intgdefs.IW_FILE_SECT, {}).values():
+            if 'md5sum' in filesect and 'fullname' in filesect:
+                fullnames = miscutils.fwsplit(filesect['fullname'], ',')
+                if len(fullnames) == 1:
+                    md5sums[os.path.basename(fullnames[0])] = filesect['md5sum']
+
+        for listsect, ldict in self.inputwcl.get(intgdefs.IW_LIST_SECT, {}).items():
+            if 'md5sum' not in str(ldict.get('columns', '')).lower() or \
+                    not os.path.exists(ldict.get('fullname', '')):
+                continue
+            for fdict in self._iter_list_files(listsect):
+                for vals in fdict.values():
+                    if vals.get('md5sum') is None:
+                        continue
+                    if vals.get('fullname') is not None:
+                        basename = os.path.basename(vals['fullname'])
+                    elif vals.get('filename') is not None:
+                        basename = vals['filename'] + (vals.get('compression') or '')
+                    else:
+                        continue
+                    md5sums[basename] = vals['md5sum']
+        return md5sums
+
+    def _use_nodecache(self, filesect):
+        """Whether files in filesect should be read through the node-local cache.
+        """
+        return self.nodecache is not None and miscutils.convertBool(filesect.get('node_cache', False))
+
+    def _filter_ingested(self, filesect, fnames):
+        """Remove files already registered in the job repo (e.g., by an earlier attempt).
+
+        The registry is queried once per registry table (filesect registry_table,
+        default raw) before any ingest of that table is launched.
+        """
+        from desdmfw_lsst_plugins import genwrap_registry
+
+        table = filesect.get('registry_table', 'raw')
+        if table not in self.registry_keys:
+            registry = None
+            if 'ingest_registry' in self.inputwcl['wrapper']:
+                registry = self.templates.replace(self.inputwcl['wrapper']['ingest_registry'])
+            elif self.job_repo_dir is not None:
+                registry = os.path.join(self.job_repo_dir, genwrap_registry.REGISTRY_FILENAME)
+
+            if registry is None:
+                self.registry_keys[table] = (None, set())
+            else:
+                self.registry_keys[table] = genwrap_registry.ingested_keys(registry, table)
+
+        (keytype, keys) = self.registry_keys[table]
+        if keytype is None or not keys:
+            return fnames
+
+        missing = [fname for fname in fnames
+                   if genwrap_registry.file_key(fname, keytype) not in keys]
+        miscutils.fwdebug_print("INFO: skipping %s of %s files already in registry table %s" %
+                                (len(fnames) - len(missing), len(fnames), table),
+                                basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+        self.curr_exec['repoingest_skipped'] = (self.curr_exec.get('repoingest_skipped', 0) +
+                                                len(fnames) - len(missing))
+        return missing
+
+    def transform_outputs(self, exwcl):
+        """Method to compress outputs and precompute their checksums and metadata.
+
+        Done once per output on a worker pool so later saving of the outputs
+        (checksums, filesize, metadata) doesn't re-read the files.
+        """
+        self.start_exec_task('transform_outputs')
+
+        wrapopts = self.inputwcl.get('wrapper', {})
+        _, outs = self._exec_fullnames(exwcl)
+
+        # Specialized: tile compress outputs before they are saved/transferred
+        for sect in sorted(outs):
+            sectkeys = sect.lower().split('.')
+            if sectkeys[0] != intgdefs.IW_FILE_SECT:
+                continue
+            filesect = self.inputwcl[intgdefs.IW_FILE_SECT][sectkeys[1]]
+            if miscutils.convertBool(filesect.get('compress_output', False)):
+                outs[sect] = self._compress_outputs(filesect, outs[sect], self._output_workers())
+
+        if miscutils.convertBool(wrapopts.get('precompute_outputs', False)):
+            algorithms = miscutils.fwsplit(wrapopts.get('output_checksums', 'md5'), ',')
+
+            plugins = {}
+            jobs = []
+            for sect in sorted(outs):
+                sectkeys = sect.lower().split('.')
+                if sectkeys[0] != intgdefs.IW_FILE_SECT:
+                    continue
+                filesect = self.inputwcl[intgdefs.IW_FILE_SECT][sectkeys[1]]
+
+                plugin = None
+                if 'metadata_plugin' in filesect:
+                    if sectkeys[1] not in plugins:
+                        plugin_class = miscutils.dynamically_load_class(filesect['metadata_plugin'])
+                        plugins[sectkeys[1]] = plugin_class(filesect.get('filetype'), None, self.inputwcl)
+                    plugin = plugins[sectkeys[1]]
+
+                for fname in sorted(outs[sect]):
+                    if os.path.exists(fname):
+                        jobs.append((fname, plugin))
+                    else:
+                        miscutils.fwdebug_print("WARN: missing output %s" % fname,
+                                                basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+            from desdmfw_lsst_plugins import genwrap_outputs
+
+            phase_start = time.time()
+            self.curr_exec['file_precompute'] = genwrap_outputs.precompute_outputs(jobs, algorithms,
+                                                                                   self._output_workers())
+            miscutils.fwdebug_print("INFO: precomputed %s outputs in %0.2f secs" %
+                                    (len(jobs), time.time() - phase_start),
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
 
         self.end_exec_task(0)
 
-    #def transform_outputs(self, exwcl):
-    #    """ Method to modify outputs prior to ingestion """
-    #
-    #    self.start_exec_task('transform_outputs')
-#
-#        # HACK assuming single exec section because otherwise need exkey
-#        #      to pass into get_fullnames
-#        _, outs = intgmisc.get_fullnames(self.inputwcl, self.inputwcl)
-#        for sect in outs:
-#            print sect
-#            print outs.keys();
-#
-#            # if need to ingest input files into butler repository
-#            # not all inputs are ingested (e.g., ref cats, bf kernel, etc)
-#            fsect = self.inputwcl.get(sect)
-#            if sect.startswith(intgdefs.IW_FILE_SECT):
-#                for fname in outs[sect]:
-#                    # create final repo ingest command line replacing xxxfilenamexxx
-#                    #   with the filename
-#                    repocmd = re.sub("xxxfilenamexxx", fname, basecmd)
-#                    miscutils.fwdebug_print("INFO: repocmd = %s" % repocmd,
-#                                            basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-#
-#                if 'rename_file' in fsect:
-#                    # dst should not have path as code assumes same path as src
-#                    # src should be single file (hence the previous check for being in file sect)
-#                    print outs[sect]
-#                    print fsect['rename_file']
-#                    src = repfunc.replace_vars_single(outs[sect].pop(), self.inputwcl,
-#                                                      {intgdefs.REPLACE_VARS: True,
-#                                                      'expand': True, 'keepvars': False})
-#                    dest = repfunc.replace_vars_single(fsect['rename_file'], self.inputwcl,
-#                                                       {intgdefs.REPLACE_VARS: True,
-#                                                       'expand': True, 'keepvars': False})
-#                    #if isinstance(val, list):
-#                    #    raise ValueError('rename_files expanded into multiple src files which is currently not supported (%s)' % src)
-#
-#                    srcdir = os.path.dirname(src)
-#
-#                    miscutils.fwdebug_print("INFO: rename %s to %s " % (src, os.path.join(srcdir, dest)),
-#                                            basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-#                    shutil.copyfile(src, os.path.join(srcdir, dest))
-#
-#
-#        self.end_exec_task(0)
+    def _output_workers(self):
+        """Number of workers compressing or precomputing outputs (output_workers, default all cores).
+        """
+        from desdmfw_lsst_plugins import genwrap_shard
 
+        wrapopts = self.inputwcl.get('wrapper', {})
+        if 'output_workers' in wrapopts:
+            return int(wrapopts['output_workers'])
+        return genwrap_shard.available_cores()
+
+    def _compress_outputs(self, filesect, fullnames, nworkers):
+        """Tile compress the outputs of a file section updating its fullnames.
+
+        Returns set of the compressed fullnames.
+        """
+        from desdmfw_lsst_plugins import genwrap_compress
+
+        existing = sorted([fname for fname in fullnames if os.path.exists(fname) and
+                           not fname.endswith(genwrap_compress.COMPRESSED_SUFFIX)])
+
+        phase_start = time.time()
+        results = genwrap_compress.compress_files(
+            existing,
+            algorithm=filesect.get('compress_algorithm', genwrap_compress.DEFAULT_ALGORITHM).upper(),
+            quantize=float(filesect.get('compress_quantize', genwrap_compress.DEFAULT_QUANTIZE)),
+            tile=genwrap_compress.parse_tile(filesect.get('compress_tile', None)),
+            verify=miscutils.convertBool(filesect.get('compress_verify', True)),
+            keep_original=miscutils.convertBool(filesect.get('compress_keep_original', False)),
+            nworkers=nworkers,
+            lossy=miscutils.convertBool(filesect.get('compress_lossy', False)))
+        miscutils.fwdebug_print("INFO: compressed %s outputs in %0.2f secs" %
+                                (len(results), time.time() - phase_start),
+                                basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+        # the rest of the framework (saving outputs, provenance) reads the fullnames from the file section
+        if 'fullname' in filesect:
+            filesect['fullname'] = ','.join([results[fname]['fullname'] if fname in results else fname
+                                             for fname in miscutils.fwsplit(filesect['fullname'], ',')])
+        if results:
+            filesect['compression'] = genwrap_compress.COMPRESSED_SUFFIX
+
+        if 'compressed_outputs' not in self.curr_exec:
+            self.curr_exec['compressed_outputs'] = OrderedDict()
+        for info in results.values():
+            self.curr_exec['compressed_outputs'][os.path.basename(info['fullname'])] = info
+
+        return set([results[fname]['fullname'] if fname in results else fname for fname in fullnames])
+
+    @genwrap_profile.profiled('create_command_line')
     def create_command_line(self, execnum, exwcl):
         if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
             miscutils.fwdebug_print("execnum = '%s', exwcl = '%s'" % (execnum, exwcl),
@@ -237,7 +666,8 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
         if 'wrapper' in self.inputwcl:
             # list.corr.img_corr:--selectId visit=${visit} ccd=${ccd}
             if 'per_file_cmdline' in self.inputwcl['wrapper']:
-                tot_add_cmd = ''
+                add_cmds = []
+                shard_keys = []
 
                 (whichfiles, cmd_add_pat) = self.inputwcl['wrapper']['per_file_cmdline'].split(':')
                 sectkeys = whichfiles.split('.')
@@ -247,51 +677,25 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
                 elif sectkeys[0] == intgdefs.IW_LIST_SECT:
                     (_, listsect, filesect) = sectkeys
 
-                    ldict = self.inputwcl[intgdefs.IW_LIST_SECT][listsect]
-
-                    # check list itself exists
-                    listname = ldict['fullname']
-                    if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
-                        miscutils.fwdebug_print("\tINFO: Checking existence of '%s'" % listname,
-                                                basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-
-                    if not os.path.exists(listname):
-                        miscutils.fwdebug_print("\tError: list '%s' does not exist." % listname,
-                                                basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-                        raise IOError("List not found: %s does not exist" % listname)
-
-                    # get list format: space separated, csv, wcl, etc
-                    listfmt = intgdefs.DEFAULT_LIST_FORMAT
-                    if intgdefs.LIST_FORMAT in ldict:
-                        listfmt = ldict[intgdefs.LIST_FORMAT]
-
-                    # read list file which needs to have information needed in per_file_cmdline
-                    listwcl = self.read_listfile(listname, listfmt, ldict['columns'])
-
                     # string with normal FW vars so can use normal replace funcs
                     cmd_base_pat = self._change_vars_parens(cmd_add_pat)
+                    cmd_tmpl = self.templates.compile(cmd_base_pat)
+                    visit_key = self.inputwcl['wrapper'].get('shard_visit_key', 'visit')
 
                     # for each file (specifically: for each line, for each file)
-                    for wlname, wldict in list(listwcl['list']['line'].items()):
-                        searchobj = None
-                        if filesect in wldict['file']:
-                            searchobj = wldict['file'][filesect]
-                        elif len(wldict['file']) == 1:
-                            searchobj = list(wldict['file'].values())[0]
-                        else:
-                            raise ValueError('Cannot find file %s in put list (%s)' % (filesect, whichfiles))
-                        add_cmd_str = repfunc.replace_vars_single(cmd_base_pat, self.inputwcl,
-                                                                  {'searchobj': searchobj,
-                                                                   intgdefs.REPLACE_VARS: True,
-                                                                   'expand': True, 'keepvars': False})
-                        tot_add_cmd += ' ' + add_cmd_str
-
-                self.curr_exec['cmdline'] += tot_add_cmd
+                    for fdict in self._iter_list_files(listsect):
+                        searchobj = self._select_list_file(fdict, filesect, whichfiles)
+                        add_cmd_str = self.templates.render(cmd_tmpl, searchobj)
+                        add_cmds.append(add_cmd_str)
+                        shard_keys.append(searchobj.get(visit_key))
+                        self._save_file_visit(searchobj, visit_key)
+
+                self._setup_shards(execnum, add_cmds, shard_keys)
+                if add_cmds:
+                    self.curr_exec['cmdline'] = self._spill_cmdline(self.curr_exec['cmdline'], add_cmds,
+                                                                    'exec%s' % execnum)
             elif 'add_cmdline' in self.inputwcl['wrapper']:
-                add_cmdline = repfunc.replace_vars_single(self.inputwcl['wrapper']['add_cmdline'],
-                                                          self.inputwcl,
-                                                          {intgdefs.REPLACE_VARS: True,
-                                                           'expand': True, 'keepvars': False})
+                add_cmdline = self.templates.replace(self.inputwcl['wrapper']['add_cmdline'])
                 if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
                     miscutils.fwdebug_print("\tINFO: add_cmdline = %s" % (add_cmdline),
                                             basic_wrapper.WRAPPER_OUTPUT_PREFIX)
@@ -311,51 +715,30 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
                             miscutils.fwdebug_print("\tINFO: list %s file %s value %s" % (listsect, filesect, fileval),
                                                     basic_wrapper.WRAPPER_OUTPUT_PREFIX)
 
-                        ldict = self.inputwcl[intgdefs.IW_LIST_SECT][listsect]
-
-                        # check list itself exists
-                        listname = ldict['fullname']
-                        if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
-                            miscutils.fwdebug_print("\tINFO: Checking existence of '%s'" % listname,
-                                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-
-                        if not os.path.exists(listname):
-                            miscutils.fwdebug_print("\tError: list '%s' does not exist." % listname,
-                                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
-                            raise IOError("List not found: %s does not exist" % listname)
-
-                        # get list format: space separated, csv, wcl, etc
-                        listfmt = intgdefs.DEFAULT_LIST_FORMAT
-                        if intgdefs.LIST_FORMAT in ldict:
-                            listfmt = ldict[intgdefs.LIST_FORMAT]
-
-                        # read list file which needs to have information needed in per_file_cmdline
-                        listwcl = self.read_listfile(listname, listfmt, ldict['columns'])
-
-                        joinvals = set()
+                        # unique values in list order so command line is the same every run
+                        joinvals = OrderedDict()
                         # for each file (specifically: for each line, for each file)
-                        for wlname, wldict in list(listwcl['list']['line'].items()):
-                            searchobj = None
-                            if filesect in wldict['file']:
-                                searchobj = wldict['file'][filesect]
-                            elif len(wldict['file']) == 1:
-                                searchobj = list(wldict['file'].values())[0]
-                            else:
-                                raise ValueError('Cannot find file %s in put list (%s)' %
-                                                 (filesect, whichfiles))
+                        for fdict in self._iter_list_files(listsect):
+                            searchobj = self._select_list_file(fdict, filesect, what_vals_to_join)
 
                             if fileval in searchobj:
-                                joinvals.add(searchobj[fileval])
+                                joinvals[searchobj[fileval]] = True
                             else:
                                 raise ValueError('Cannot find value %s from file %s' %
                                                  (fileval, searchobj['filename']))
 
                         if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
-                            miscutils.fwdebug_print("\tINFO: joinvals = %s" % (joinvals),
+                            miscutils.fwdebug_print("\tINFO: joinvals = %s" % (list(joinvals.keys())),
                                                     basic_wrapper.WRAPPER_OUTPUT_PREFIX)
 
-                        newcmd = joinstr.join(list(joinvals))
-                        self.curr_exec['cmdline'] += newcmd
+                        newcmd = joinstr.join(list(joinvals.keys()))
+                        if len(self.curr_exec['cmdline']) + len(newcmd) > self._argfile_threshold():
+                            # values continue the last token (e.g., visit=) which moves with them
+                            (base_cmdline, partial) = genwrap_argfile.split_partial(self.curr_exec['cmdline'])
+                            self.curr_exec['cmdline'] = self._spill_cmdline(base_cmdline, [partial + newcmd],
+                                                                            'exec%s' % execnum)
+                        else:
+                            self.curr_exec['cmdline'] += newcmd
                     else:
                         raise ValueError('Invalid section name (%s) ' % sectkeys[0])
                 else:
@@ -364,11 +747,300 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
 
         self.end_exec_task(0)
 
+        if self.execmemo is not None and miscutils.convertBool(exwcl.get('exec_memo', True)):
+            self.start_exec_task('exec_memo_key')
+            self._memo_prepare(exwcl)
+            self.end_exec_task(0)
+
+    def _memo_prepare(self, exwcl):
+        """Compute the memo key of the exec from its final command line and inputs.
+        """
+        from desdmfw_lsst_plugins import genwrap_memo
+
+        wrapdict = self.inputwcl['wrapper']
+        (inputs, outputs) = self._exec_fullnames(exwcl)
+        argfiles = self.curr_exec.get('argfiles', {})
+        cmdlines = [genwrap_memo.normalize_cmdline(self.curr_exec['cmdline'], argfiles)]
+        for cmdline in self.curr_exec.get('shard_cmdlines', []):
+            cmdlines.append(genwrap_memo.normalize_cmdline(cmdline, argfiles))
+
+        checksums = genwrap_memo.input_checksums(inputs, wrapdict.get('exec_memo_input_hash',
+                                                                      genwrap_memo.HASH_CONTENT))
+        version = genwrap_memo.stack_version(wrapdict.get('exec_memo_stack_version',
+                                                          self.curr_exec.get('version')))
+        (key, desc) = genwrap_memo.make_key(cmdlines, checksums, outputs, version)
+        self.curr_exec['memo'] = {'key': key, 'desc': desc, 'outputs': sorted(outputs)}
+        if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+            miscutils.fwdebug_print("INFO: exec memo key %s (%s inputs)" % (key, len(checksums)),
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+    def _memo_restore(self, memo):
+        """Restore outputs of a previous identical exec returning whether there was one.
+        """
+        result = self.execmemo.lookup(memo['key'])
+        if result is None:
+            return False
+
+        restored = self.execmemo.restore(memo['key'], result, memo['outputs'])
+        miscutils.fwdebug_print("INFO: exec memo hit %s, restored %s outputs instead of running" %
+                                (memo['key'], len(restored)), basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+        self.curr_exec['status'] = 0
+        self.curr_exec['exec_memo'] = OrderedDict([('key', memo['key']), ('hit', True),
+                                                   ('saved', result['saved'])])
+        return True
+
+    def _save_file_visit(self, searchobj, visit_key):
+        """Remember which visit a listed file belongs to (for pipeline_ingest).
+        """
+        if not miscutils.convertBool(self.inputwcl['wrapper'].get('pipeline_ingest', False)):
+            return
+        if 'file_visits' not in self.curr_exec:
+            self.curr_exec['file_visits'] = {}
+        for key in ('fullname', 'filename'):
+            if key in searchobj and visit_key in searchobj:
+                self.curr_exec['file_visits'][os.path.basename(searchobj[key])] = searchobj[visit_key]
+
+    def _setup_shards(self, execnum, add_cmds, shard_keys):
+        """Split per-file command line additions into shards if requested.
+
+        shard_mode = count  splits the list into shard_count groups
+        shard_mode = visit  splits the list by visit (at most shard_count groups)
+        shard_jobs = N      instead passes -j N to a single task
+        """
+        wrapdict = self.inputwcl['wrapper']
+
+        if 'shard_jobs' in wrapdict:
+            self.curr_exec['cmdline'] += ' -j %s' % int(wrapdict['shard_jobs'])
+            return
+
+        if 'shard_mode' not in wrapdict or not add_cmds:
+            return
+
+        from desdmfw_lsst_plugins import genwrap_shard
+
+        shard_mode = wrapdict['shard_mode'].lower()
+        nshards = None
+        if 'shard_count' in wrapdict:
+            nshards = int(wrapdict['shard_count'])
+
+        if shard_mode == 'count':
+            groups = genwrap_shard.split_by_count(add_cmds,
+                                                  nshards or genwrap_shard.available_cores())
+        elif shard_mode == 'visit':
+            if None in shard_keys:
+                raise ValueError('Cannot shard by visit, missing %s in list' %
+                                 wrapdict.get('shard_visit_key', 'visit'))
+            groups, visit_groups = genwrap_shard.split_by_visit(add_cmds, shard_keys, nshards)
+            self.curr_exec['shard_visits'] = visit_groups
+        else:
+            raise ValueError('Invalid shard_mode (%s), must be one of %s' %
+                             (shard_mode, genwrap_shard.SHARD_MODES))
+
+        if len(groups) > 1:
+            base_cmdline = self.curr_exec['cmdline']
+            self.curr_exec['shard_groups'] = groups
+            self.curr_exec['shard_logprefix'] = 'shard_exec%s' % execnum
+            self.curr_exec['shard_cmdlines'] = [self._spill_cmdline(base_cmdline, grp,
+                                                                    'exec%s_shard%03d' % (execnum, i))
+                                                for i, grp in enumerate(groups)]
+            miscutils.fwdebug_print("INFO: split per_file_cmdline into %s shards (%s)" %
+                                    (len(groups), shard_mode), basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
     def run_exec(self):
-        basic_wrapper.BasicWrapper.run_exec(self)
+        self.start_exec_task('run_exec')
+
+        shard_cmdlines = self.curr_exec.pop('shard_cmdlines', None)
+        shard_groups = self.curr_exec.pop('shard_groups', None)
+        shard_logprefix = self.curr_exec.pop('shard_logprefix', None)
+        shard_visits = self.curr_exec.pop('shard_visits', None)
+        pending_ingest = self.curr_exec.pop('pending_ingest', [])
+        file_visits = self.curr_exec.pop('file_visits', {})
+        memo = self.curr_exec.pop('memo', None)
+
+        memo_hit = memo is not None and self._memo_restore(memo)
+        if memo_hit:
+            # same command line, inputs and stack as a completed exec, but
+            # later execs may need the inputs in the job repo
+            self._ingest_pending(pending_ingest)
+        elif pending_ingest and shard_cmdlines and shard_visits:
+            from desdmfw_lsst_plugins import genwrap_pipeline
+            groups = genwrap_pipeline.group_ingests([(os.path.basename(fname), repocmd)
+                                                     for (fname, repocmd) in pending_ingest],
+                                                    file_visits,
+                                                    [visit for vgrp in shard_visits for visit in vgrp])
+            self._run_shards(shard_cmdlines, shard_groups, shard_logprefix, groups, shard_visits)
+        else:
+            # not sharded by visit so nothing to overlap, ingest everything first
+            self._ingest_pending(pending_ingest)
+
+            if shard_cmdlines:
+                self._run_shards(shard_cmdlines, shard_groups, shard_logprefix)
+            else:
+                self._run_single(self.curr_exec['cmdline'])
+
+        retcode = self.curr_exec['status']
+        if memo is not None and not memo_hit and retcode == 0:
+            self.execmemo.save(memo['key'], memo['desc'], memo['outputs'])
+            self.curr_exec['exec_memo'] = OrderedDict([('key', memo['key']), ('hit', False)])
+
+        # record spilled selections as argfile path plus hash
+        argfiles = self.curr_exec.get('argfiles', {})
+        for info in list(argfiles.values()):
+            if self.curr_exec['cmdline'].endswith('@' + info['path']):
+                self.curr_exec['cmdline'] = genwrap_argfile.summarize_cmdline(self.curr_exec['cmdline'],
+                                                                              info)
+
         # database table currently holds 4000 characters.
         # long term discussion about how to handle this in future
-        self.curr_exec['cmdline'] = self.curr_exec['cmdline'][:3995]
+        self.curr_exec['cmdline'] = self.curr_exec['cmdline'][:genwrap_argfile.DB_CMDLINE_MAXLEN]
+
+        self.end_exec_task(retcode)
+
+    def _argfile_threshold(self):
+        """Number of characters past which selections are spilled to an argfile.
+        """
+        return int(self.inputwcl['wrapper'].get('argfile_threshold',
+                                                genwrap_argfile.DEFAULT_ARGFILE_THRESHOLD))
+
+    def _spill_cmdline(self, base_cmdline, fragments, name):
+        """Add fragments to the command line, via an argfile if too long.
+        """
+        argfile = os.path.join(self.inputwcl['wrapper'].get('argfile_dir', '.'), '%s.args' % name)
+        cmdline, info = genwrap_argfile.spill_cmdline(base_cmdline, fragments, argfile,
+                                                      self._argfile_threshold())
+        if info is not None:
+            miscutils.fwdebug_print("INFO: spilled %s args (%s chars) to %s" %
+                                    (info['num_args'], info['num_chars'], info['path']),
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+            if 'argfiles' not in self.curr_exec:
+                self.curr_exec['argfiles'] = OrderedDict()
+            self.curr_exec['argfiles'][name] = info
+        return cmdline
+
+    def _run_single(self, cmdline):
+        """Run the exec's command line collecting wait4 process info.
+        """
+        miscutils.fwdebug_print("INFO: cmd = %s" % cmdline, basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+        print('*' * 70)
+        sys.stdout.flush()
+
+        try:
+            (retcode, procinfo) = genwrap_procacct.run_exec(cmdline)
+        except OSError as exc:
+            print("********************")
+            print("%s - %s" % (type(exc), exc))
+            print("\tPath = %s" % os.environ['PATH'])
+            print("\tCmd = %s" % cmdline)
+            print("********************")
+            raise
+        sys.stdout.flush()
+
+        self.procacct.add_proc('exec', retcode, procinfo)
+        self.curr_exec['status'] = retcode
+        self.curr_exec['procinfo'] = procinfo
+        print('*' * 70)
+
+        if retcode != 0:
+            miscutils.fwdebug_print("\tInfo: cmd exited with non-zero exit code = %s" % retcode)
+
+    def _run_shards(self, shard_cmdlines, shard_groups, logprefix, ingest_groups=None, shard_visits=None):
+        """Run shard command lines concurrently within the core budget.
+
+        If ingest_groups is given, inputs are ingested per visit group in the
+        background and each shard starts once its visits are ingested.
+        """
+        from desdmfw_lsst_plugins import genwrap_pipeline
+        from desdmfw_lsst_plugins import genwrap_shard
+
+        ncores = genwrap_shard.available_cores()
+        if 'shard_cores' in self.inputwcl['wrapper']:
+            ncores = int(self.inputwcl['wrapper']['shard_cores'])
+
+        # first shard alone writes the output repo's config and schemas
+        warmup = miscutils.convertBool(self.inputwcl['wrapper'].get('shard_warmup', True))
+
+        for i, cmdline in enumerate(shard_cmdlines):
+            miscutils.fwdebug_print("INFO: shard %03d cmd = %s" % (i, cmdline),
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+        print('*' * 70)
+        sys.stdout.flush()
+
+        ingest_error = None
+        ingest_failed = 0
+        if ingest_groups is None:
+            results = genwrap_shard.run_shards(shard_cmdlines, ncores, logprefix, warmup)
+        else:
+            def runfunc(i, cmdline):
+                logfile = genwrap_shard.shard_logfile(logprefix, i)
+                (retcode, procinfo) = genwrap_shard.run_cmdline(cmdline, logfile)
+                return (retcode, procinfo, logfile)
+
+            results, ingester = genwrap_pipeline.run_pipelined(ingest_groups, shard_cmdlines, shard_visits,
+                                                               ncores, self._run_repoingest, runfunc, warmup)
+            ingest_error = ingester.error
+            ingest_failed = sum(ingester.num_failed.values())
+        genwrap_shard.print_shard_logs(results, basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+        for (shard_retcode, procinfo, _) in results:
+            self.procacct.add_proc('exec', shard_retcode, procinfo)
+
+        retcode = genwrap_shard.aggregate_status([res[0] for res in results])
+        self.curr_exec['shards'] = genwrap_shard.shard_summary(results, shard_groups)
+        self.curr_exec['status'] = retcode
+        self.curr_exec['procinfo'] = genwrap_procacct.combine_procinfo([res[1] for res in results])
+        print('*' * 70)
+
+        if ingest_error is not None:
+            miscutils.fwdebug_print("ERROR: pipelined repo ingest failed: %s" % ingest_error,
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+            raise ingest_error
+        if ingest_failed:
+            raise RuntimeError('Problem ingesting %s file(s) into butler repo' % ingest_failed)
+
+        if retcode != 0:
+            miscutils.fwdebug_print("\tInfo: cmd exited with non-zero exit code = %s" % retcode)
+
+    def write_outputwcl(self, outfilename=None):
+        """Add resource usage to the output wcl before writing it.
+        """
+        self.outputwcl['wrapper']['resource_usage'] = self.procacct.as_dict()
+        if 'wrapper' in self.inputwcl and 'resource_json' in self.inputwcl['wrapper']:
+            self.procacct.write_json(self.templates.replace(self.inputwcl['wrapper']['resource_json']))
+        basic_wrapper.BasicWrapper.write_outputwcl(self, outfilename)
+
+    def _iter_list_files(self, listsect):
+        """Iterate over the lines of a list as dicts of file-section -> values.
+        """
+        ldict = self.inputwcl[intgdefs.IW_LIST_SECT][listsect]
+
+        # check list itself exists
+        listname = ldict['fullname']
+        if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+            miscutils.fwdebug_print("\tINFO: Checking existence of '%s'" % listname,
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+
+        if not os.path.exists(listname):
+            miscutils.fwdebug_print("\tError: list '%s' does not exist." % listname,
+                                    basic_wrapper.WRAPPER_OUTPUT_PREFIX)
+            raise IOError("List not found: %s does not exist" % listname)
+
+        # get list format: space separated, csv, wcl, etc
+        listfmt = intgdefs.DEFAULT_LIST_FORMAT
+        if intgdefs.LIST_FORMAT in ldict:
+            listfmt = ldict[intgdefs.LIST_FORMAT]
+
+        # list file needs to have information needed in per_file_cmdline/add_cmdline
+        return self.listcache.iter_files(listname, listfmt, ldict['columns'])
+
+    @classmethod
+    def _select_list_file(cls, fdict, filesect, whichfiles):
+        """Pick the values for filesect from a single list line.
+        """
+        if filesect in fdict:
+            return fdict[filesect]
+        elif len(fdict) == 1:
+            return list(fdict.values())[0]
+        raise ValueError('Cannot find file %s in put list (%s)' % (filesect, whichfiles))
 
     @classmethod
     def _change_vars_parens(cls, string):
@@ -386,6 +1058,8 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
         if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
             miscutils.fwdebug_print('columns=%s' % columns)
 
+        from intgutils import wcl
+
         mywcl = None
         if linefmt == 'config' or linefmt == 'wcl':
             mywcl = wcl.WCL()
@@ -409,6 +1083,8 @@ class GenWrapLSST(basic_wrapper.BasicWrapper):
 
                     ldict = dict(list(zip(columns, lineinfo)))
                     mylist.append(ldict)
+
+            from intgutils import queryutils
             lines = queryutils.convert_single_files_to_lines(mylist)
             mywcl = wcl.WCL(lines)
 
@@ -420,9 +1096,13 @@ def main():
     """
     parser = argparse.ArgumentParser(description='Generic wrapper for LSST')
     parser.add_argument('inputwcl', nargs=1, action='store')
+    parser.add_argument('--profile-startup', action='store_true', default=False,
+                        help='report import and init-phase timings of the wrapper start-up')
     args = parser.parse_args(sys.argv[1:])
 
     bwrap = GenWrapLSST(args.inputwcl[0])
+    if args.profile_startup:
+        bwrap.report_startup_timings()
     bwrap.run_wrapper()
     bwrap.write_outputwcl()
     sys.exit(bwrap.get_status())
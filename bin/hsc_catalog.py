@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""Build or query the local catalog of HSC header keywords.
+"""
+
+import argparse
+import sys
+
+from desdmfw_lsst_plugins import hsc_catalog
+
+
+def parse_criterion(value):
+    """Convert lo:hi into a range tuple, a,b,c into a list, else the value.
+    """
+    def convert(val):
+        if val == '':
+            return None
+        try:
+            return int(val)
+        except ValueError:
+            return val
+
+    if ':' in value:
+        (low, high) = value.split(':', 1)
+        return (convert(low), convert(high))
+    if ',' in value:
+        return [convert(val) for val in value.split(',')]
+    return convert(value)
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Local catalog of HSC header keywords')
+    parser.add_argument('--catalog', action='store', required=True, help='sqlite catalog file')
+    subparsers = parser.add_subparsers(dest='cmd')
+
+    build = subparsers.add_parser('build', help='add new and changed files')
+    build.add_argument('--workers', action='store', type=int, default=4)
+    build.add_argument('--list', action='store', default=None, help='file with one fullname per line')
+    build.add_argument('--keywords', action='store', default=None,
+                       help='comma separated header keywords to save (default %s)' %
+                       ','.join(hsc_catalog.DEFAULT_KEYWORDS))
+    build.add_argument('--prune', action='store_true', default=False,
+                       help='remove files not given (or no longer existing)')
+    build.add_argument('paths', nargs='*', help='files or directories')
+
+    query = subparsers.add_parser('query', help='print files matching criteria')
+    for col in hsc_catalog.VALUE_COLUMNS + ['class', 'filename']:
+        query.add_argument('--%s' % col, action='store', default=None,
+                           help='value, a,b,c or lo:hi')
+    query.add_argument('--columns', action='store', default='fullname',
+                       help='comma separated columns to print')
+
+    subparsers.add_parser('stats', help='number of files per class')
+
+    args = parser.parse_args()
+
+    catalog = hsc_catalog.HeaderCatalog(args.catalog)
+    status = 0
+    if args.cmd == 'build':
+        fullnames = hsc_catalog.find_files(args.paths)
+        if args.list is not None:
+            with open(args.list, 'r') as listfh:
+                fullnames.extend([line.strip() for line in listfh if line.strip()])
+        keywords = args.keywords.split(',') if args.keywords else None
+        (nrows, errors) = catalog.update(fullnames, args.workers, keywords, args.prune)
+        for fullname, error in errors.items():
+            sys.stderr.write('%s: %s\n' % (fullname, error))
+        print('%s files, %s added or updated, %s errors' % (len(fullnames), nrows, len(errors)))
+        status = 1 if errors else 0
+    elif args.cmd == 'query':
+        criteria = {}
+        for col in hsc_catalog.VALUE_COLUMNS + ['class', 'filename']:
+            if getattr(args, col) is not None:
+                criteria[col] = parse_criterion(getattr(args, col))
+        columns = args.columns.split(',')
+        for row in catalog.query(columns=columns, **criteria):
+            print(' '.join(str(row[col]) for col in columns))
+    elif args.cmd == 'stats':
+        for fclass, count in catalog.counts().items():
+            print('%-6s %s' % (fclass, count))
+    else:
+        parser.print_help()
+        status = 1
+
+    catalog.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""Find files whose FITS headers changed since the last ingest.
+"""
+
+import argparse
+import sys
+
+from desdmfw_lsst_plugins import hsc_fingerprint
+
+
+def read_fullnames(args):
+    fullnames = list(args.fullnames)
+    if args.list is not None:
+        with open(args.list, 'r') as listfh:
+            fullnames.extend([line.strip() for line in listfh if line.strip()])
+    return fullnames
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Header fingerprints for incremental re-ingest')
+    parser.add_argument('--store', action='store', required=True, help='sqlite fingerprint store')
+    parser.add_argument('--workers', action='store', type=int, default=4)
+    parser.add_argument('--list', action='store', default=None, help='file with one fullname per line')
+    parser.add_argument('--update', action='store_true', default=False,
+                        help='save fingerprints of the new/changed files (without metadata)')
+    parser.add_argument('fullnames', nargs='*')
+    args = parser.parse_args()
+
+    store = hsc_fingerprint.FingerprintStore(args.store)
+    fullnames = read_fullnames(args)
+    changed = hsc_fingerprint.diff(fullnames, store, args.workers)
+    for fullname, (status, _) in changed.items():
+        print('%-8s %s' % (status, fullname))
+    if args.update:
+        store.put_many([(fullname, fprint, None) for fullname, (_, fprint) in changed.items()])
+    sys.stderr.write('%s of %s files new or changed\n' % (len(changed), len(fullnames)))
+    store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
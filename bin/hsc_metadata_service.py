@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Run or query the local warm-worker metadata service.
+"""
+
+import argparse
+import json
+import sys
+
+from desdmfw_lsst_plugins import hsc_metadata_service as mdsvc
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Local metadata service with warm plugin instances')
+    parser.add_argument('--socket', action='store', required=True,
+                        help='path of the Unix socket')
+    subparsers = parser.add_subparsers(dest='cmd')
+
+    serve = subparsers.add_parser('serve', help='run the service in the foreground')
+    serve.add_argument('--config', action='store', required=True,
+                       help='wcl file with filetype_metadata and file_header_info')
+    serve.add_argument('--class-map', action='store', default=None,
+                       help='filetype=module.Class,... (default %s)' % mdsvc.DEFAULT_CLASS)
+    serve.add_argument('--workers', action='store', type=int, default=mdsvc.DEFAULT_WORKERS)
+    serve.add_argument('--idle-timeout', action='store', type=float, default=mdsvc.DEFAULT_IDLE_TIMEOUT,
+                       help='seconds without requests before exiting (0 = never)')
+    serve.add_argument('--preload', action='store', default=None,
+                       help='comma separated filetypes to initialize at start-up')
+
+    query = subparsers.add_parser('query', help='print metadata of files as json lines')
+    query.add_argument('--filetype', action='store', required=True)
+    query.add_argument('--class', action='store', dest='classname', default=None)
+    query.add_argument('fullnames', nargs='+')
+
+    subparsers.add_parser('ping', help='check whether the service is running')
+    subparsers.add_parser('stop', help='shut down the service')
+
+    args = parser.parse_args()
+
+    if args.cmd == 'serve':
+        service = mdsvc.MetadataService(args.socket, mdsvc.read_config(args.config),
+                                        mdsvc.parse_class_map(args.class_map),
+                                        args.workers, args.idle_timeout)
+        if args.preload:
+            service.preload(args.preload.split(','))
+        service.serve()
+        return 0
+
+    client = mdsvc.MetadataClient(args.socket)
+    if args.cmd == 'ping':
+        running = client.is_running()
+        print('running' if running else 'not running')
+        return 0 if running else 1
+    if args.cmd == 'stop':
+        client.shutdown()
+        return 0
+    if args.cmd == 'query':
+        status = 0
+        for (fullname, metadata, error) in client.iter_metadata(args.filetype, args.fullnames,
+                                                                args.classname):
+            if error is not None:
+                status = 1
+            print(json.dumps({'fullname': fullname, 'metadata': metadata, 'error': error}))
+        return status
+
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
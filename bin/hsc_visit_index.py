@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""Query or update the HSC visit completeness index.
+"""
+
+import argparse
+import sys
+
+from desdmfw_lsst_plugins import hsc_visit_index
+
+
+def print_info(visit, info):
+    if info is None:
+        print('%s  not seen' % visit)
+    else:
+        print('%s  %-10s %3s ccds  %-8s %s%s' %
+              (info['visit'], 'complete' if info['complete'] else 'incomplete', info['nccds'],
+               info['filter'], info['dateobs'],
+               '' if info['complete'] else '  missing=%s' % ','.join(str(ccd) for ccd in info['missing'])))
+
+
+def add_files(index, fullnames):
+    """Add raw files to the index reading visit/ccd from their headers.
+    """
+    from astropy.io import fits
+    from desdmfw_lsst_plugins.ftmgmt_hsc_raw import FtMgmtHSCRaw
+
+    entries = []
+    for fullname in fullnames:
+        hdr = fits.getheader(fullname, 1 if fullname.endswith('.fz') else 0)
+        entries.append((FtMgmtHSCRaw.translate_visit(hdr['EXP-ID'], hdr['FRAMEID']),
+                        int(hdr['DET-ID']), hdr.get('DATE-OBS', None),
+                        FtMgmtHSCRaw.translate_filter(hdr.get('FILTER01', None))))
+    index.add_many(entries)
+    return len(entries)
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='HSC visit completeness index')
+    parser.add_argument('--index', action='store', required=True, help='sqlite index file')
+    parser.add_argument('--ccds', action='store', default=None,
+                        help='expected ccds, e.g. 0-103 (default 0-%s)' % (hsc_visit_index.HSC_NUM_CCDS - 1))
+    subparsers = parser.add_subparsers(dest='cmd')
+
+    status = subparsers.add_parser('status', help='completeness of given visits')
+    status.add_argument('visits', nargs='+', type=int)
+
+    for cmd in ['incomplete', 'list']:
+        sub = subparsers.add_parser(cmd, help='%s visits in a date range' %
+                                    ('incomplete' if cmd == 'incomplete' else 'all'))
+        sub.add_argument('--start', action='store', default=None, help='first date (YYYY-MM-DD)')
+        sub.add_argument('--end', action='store', default=None, help='last date (YYYY-MM-DD)')
+
+    add = subparsers.add_parser('add', help='add raw files from their headers')
+    add.add_argument('fullnames', nargs='+')
+
+    args = parser.parse_args()
+
+    expected = None
+    if args.ccds is not None:
+        expected = hsc_visit_index.parse_ccd_range(args.ccds)
+    index = hsc_visit_index.VisitIndex(args.index, expected)
+
+    status = 0
+    if args.cmd == 'status':
+        for visit, info in index.status(args.visits).items():
+            print_info(visit, info)
+            if info is None or not info['complete']:
+                status = 1
+    elif args.cmd in ('incomplete', 'list'):
+        for info in index.visits(args.start, args.end, incomplete_only=args.cmd == 'incomplete'):
+            print_info(info['visit'], info)
+    elif args.cmd == 'add':
+        print('added %s files' % add_files(index, args.fullnames))
+    else:
+        parser.print_help()
+        status = 1
+
+    index.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""Watch incoming directories and gather metadata of new HSC files in micro-batches.
+"""
+
+import argparse
+import json
+import signal
+import sys
+
+from desdmfw_lsst_plugins import hsc_dispatch
+from desdmfw_lsst_plugins import hsc_metadata_service as mdsvc
+from desdmfw_lsst_plugins import hsc_watch
+
+
+def make_sink(outfh):
+    """Return sink writing one json line per file.
+    """
+    def sink(results, errors, skipped):
+        for fullname, (fclass, filetype, metadata) in results.items():
+            outfh.write(json.dumps({'fullname': fullname, 'class': fclass, 'filetype': filetype,
+                                    'metadata': metadata}, default=str) + '\n')
+        for fullname in skipped:
+            outfh.write(json.dumps({'fullname': fullname, 'skipped': 'already ingested'}) + '\n')
+        for fullname, error in errors.items():
+            sys.stderr.write('%s: %s\n' % (fullname, error))
+        outfh.flush()
+    return sink
+
+
+def main():
+    """Entry point.
+    """
+    parser = argparse.ArgumentParser(description='Watch directories and gather metadata of new HSC files')
+    parser.add_argument('--config', action='store', required=True,
+                        help='wcl file with filetype_metadata and file_header_info')
+    for fclass in hsc_dispatch.CLASSES:
+        parser.add_argument('--filetype-%s' % fclass, action='store', dest='filetype_%s' % fclass, default=None,
+                            help='framework filetype of %s files (files of classes without one are errors)' % fclass)
+    parser.add_argument('--des_services', action='store', default=None,
+                        help='services file for existence checks (none: no checks)')
+    parser.add_argument('--section', action='store', default=None, help='section of the services file')
+    parser.add_argument('--mode', action='store', default=hsc_watch.MODE_AUTO,
+                        choices=[hsc_watch.MODE_AUTO, hsc_watch.MODE_INOTIFY, hsc_watch.MODE_POLL])
+    parser.add_argument('--interval', action='store', type=float, default=hsc_watch.DEFAULT_POLL_INTERVAL,
+                        help='seconds between scans when polling')
+    parser.add_argument('--settle', action='store', type=float, default=hsc_watch.DEFAULT_SETTLE,
+                        help='seconds size and mtime must stay the same')
+    parser.add_argument('--batch-files', action='store', type=int, default=hsc_watch.DEFAULT_BATCH_FILES)
+    parser.add_argument('--batch-wait', action='store', type=float, default=hsc_watch.DEFAULT_BATCH_WAIT,
+                        help='max seconds a settled file waits for its batch')
+    parser.add_argument('--initial', action='store_true', default=False,
+                        help='also process files already in the directories')
+    parser.add_argument('--duration', action='store', type=float, default=None,
+                        help='stop after this many seconds')
+    parser.add_argument('--output', action='store', default=None, help='json lines output (default stdout)')
+    parser.add_argument('paths', nargs='+', help='directories to watch')
+    args = parser.parse_args()
+
+    filetypes = {}
+    for fclass in hsc_dispatch.CLASSES:
+        if getattr(args, 'filetype_%s' % fclass) is not None:
+            filetypes[fclass] = getattr(args, 'filetype_%s' % fclass)
+    if not filetypes:
+        parser.error('at least one --filetype-<class> is required')
+
+    dbh = None
+    if args.des_services is not None or args.section is not None:
+        import despydmdb.desdmdbi as desdmdbi
+        dbh = desdmdbi.DesDmDbi(args.des_services, args.section)
+
+    dispatcher = hsc_dispatch.Dispatcher(mdsvc.read_config(args.config), filetypes, dbh)
+
+    outfh = sys.stdout if args.output is None else open(args.output, 'a')
+    watch = hsc_watch.WatchIngest(args.paths, hsc_watch.dispatch_handler(dispatcher, make_sink(outfh)),
+                                  args.settle, args.batch_files, args.batch_wait, args.mode, args.interval,
+                                  initial=args.initial)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watch.stop())
+    try:
+        watch.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+
+    sys.stderr.write('%s files in %s batches, %s failed batches\n' % (watch.nfiles, watch.nbatches, watch.nerrors))
+    if outfh is not sys.stdout:
+        outfh.close()
+    if dbh is not None:
+        dbh.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,9 +14,12 @@ from filemgmt.ftmgmt_genfits import FtMgmtGenFits
 from despymisc import miscutils
 from despyfitsutils import fitsutils
 import despyfitsutils.fits_special_metadata as spmeta
+from desdmfw_lsst_plugins import genwrap_profile
+from desdmfw_lsst_plugins import hsc_fingerprint
+from desdmfw_lsst_plugins import hsc_pairs
 
 
-class FtMgmtHSCCalib(FtMgmtGenFits):
+class FtMgmtHSCCalib(hsc_pairs.PairBatchMixin, FtMgmtGenFits):
     """Class for managing an HSC calib filetype.
 
     It gets metadata, update metadata, etc.
@@ -26,17 +29,19 @@ class FtMgmtHSCCalib(FtMgmtGenFits):
         # config must have filetype_metadata, file_header_info, keywords_file (OPT)
         FtMgmtGenFits.__init__(self, filetype, dbh, config, filepat)
 
+        # optional store of header fingerprints for incremental re-ingest
+        # (config hsc_fingerprint_store or env)
+        self.fingerprints = hsc_fingerprint.store_from_config(config)
+
+    @genwrap_profile.profiled('has_contents_ingested')
     def has_contents_ingested(self, listfullnames):
         """Check if exposure has row in rasicam_decam table.
         """
         assert isinstance(listfullnames, list)
 
         # assume uncompressed and compressed files have same metadata
-        # choosing either doesn't matter
-        byfilename = {}
-        for fname in listfullnames:
-            filename = miscutils.parse_fullname(fname, miscutils.CU_PARSE_FILENAME)
-            byfilename[filename] = fname
+        # so a row answers for every variant of the filename
+        byfilename = hsc_pairs.group_pairs(listfullnames)
 
         self.dbh.empty_gtt(dmdbdefs.DB_GTT_FILENAME)
         self.dbh.load_filename_gtt(list(byfilename.keys()))
@@ -48,7 +53,8 @@ class FtMgmtHSCCalib(FtMgmtGenFits):
 
         results = {}
         for row in curs:
-            results[byfilename[row[0]]] = True
+            for fname in byfilename[row[0]]:
+                results[fname] = True
         for fname in listfullnames:
             if fname not in results:
                 results[fname] = False
@@ -57,14 +63,21 @@ class FtMgmtHSCCalib(FtMgmtGenFits):
 
         return results
 
-    def perform_metadata_tasks(self, fullname, do_update, update_info):
+    @genwrap_profile.profiled('perform_metadata_tasks')
+    def perform_metadata_tasks(self, fullname, do_update, update_info, primary_hdr=None, fprint=None):
         """Read metadata from file, updating file values.
+
+        primary_hdr (and its fingerprint fprint) can be given if the header
+        was already read (e.g., by hsc_dispatch).
         """
         if miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
             miscutils.fwdebug_print("INFO: beg")
 
         # open file
-        primary_hdr = fits.getheader(fullname, 0)
+        if primary_hdr is None:
+            # header blocks are read once for both the metadata and the fingerprint
+            (headers, fprint) = hsc_fingerprint.read_headers(fullname)
+            primary_hdr = hsc_fingerprint.metadata_header(headers)
         prihdu = fits.PrimaryHDU(header=primary_hdr)
         hdulist = fits.HDUList([prihdu])
         #import lsst.afw.image as afwImage
@@ -75,6 +88,11 @@ class FtMgmtHSCCalib(FtMgmtGenFits):
         if miscutils.fwdebug_check(6, 'FTMGMT_DEBUG'):
             miscutils.fwdebug_print("INFO: file=%s" % (fullname))
 
+        if self.fingerprints is not None:
+            if fprint is None:
+                fprint = hsc_fingerprint.fingerprint(fullname)
+            self._batch_add('fingerprints', (fullname, fprint, metadata))
+
         # call function to update headers
         if do_update:
             miscutils.fwdebug_print("WARN: cannot update a raw file's metadata")
@@ -86,6 +104,14 @@ class FtMgmtHSCCalib(FtMgmtGenFits):
             miscutils.fwdebug_print("INFO: end")
         return metadata
 
+    def _write_batch(self, kind, entries):
+        """Write fingerprint entries collected by hsc_pairs.PairBatchMixin.
+        """
+        if kind == 'fingerprints':
+            self.fingerprints.put_many(entries)
+        else:
+            hsc_pairs.PairBatchMixin._write_batch(self, kind, entries)
+
     def ingest_contents(self, listfullnames, **kwargs):
         """Ingest data into non-metadata table - raw_visit.
         """
@@ -17,9 +17,12 @@ from filemgmt.ftmgmt_genfits import FtMgmtGenFits
 from despymisc import miscutils
 from despyfitsutils import fitsutils
 import despyfitsutils.fits_special_metadata as spmeta
+from desdmfw_lsst_plugins import genwrap_profile
+from desdmfw_lsst_plugins import hsc_fingerprint
+from desdmfw_lsst_plugins import hsc_pairs
 
 
-class FtMgmtHSCImg(FtMgmtGenFits):
+class FtMgmtHSCImg(hsc_pairs.PairBatchMixin, FtMgmtGenFits):
     """Class for managing an HSC image filetype.
 
     It gets metadata, update metadata, etc.
@@ -29,17 +32,15 @@ class FtMgmtHSCImg(FtMgmtGenFits):
         # config must have filetype_metadata, file_header_info, keywords_file (OPT)
         FtMgmtGenFits.__init__(self, filetype, dbh, config, filepat)
 
+    @genwrap_profile.profiled('has_contents_ingested')
     def has_contents_ingested(self, listfullnames):
         """Check if exposure has row in rasicam_decam table.
         """
         assert isinstance(listfullnames, list)
 
         # assume uncompressed and compressed files have same metadata
-        # choosing either doesn't matter
-        byfilename = {}
-        for fname in listfullnames:
-            filename = miscutils.parse_fullname(fname, miscutils.CU_PARSE_FILENAME)
-            byfilename[filename] = fname
+        # so a row answers for every variant of the filename
+        byfilename = hsc_pairs.group_pairs(listfullnames)
 
         self.dbh.empty_gtt(dmdbdefs.DB_GTT_FILENAME)
         self.dbh.load_filename_gtt(list(byfilename.keys()))
@@ -51,7 +52,8 @@ class FtMgmtHSCImg(FtMgmtGenFits):
 
         results = {}
         for row in curs:
-            results[byfilename[row[0]]] = True
+            for fname in byfilename[row[0]]:
+                results[fname] = True
         for fname in listfullnames:
             if fname not in results:
                 results[fname] = False
@@ -60,15 +62,23 @@ class FtMgmtHSCImg(FtMgmtGenFits):
 
         return results
 
-    def perform_metadata_tasks(self, fullname, do_update, update_info):
+    @genwrap_profile.profiled('perform_metadata_tasks')
+    def perform_metadata_tasks(self, fullname, do_update, update_info, primary_hdr=None, fprint=None):
         """Read metadata from file, updating file values.
+
+        primary_hdr can be given if the header was already read (e.g., by hsc_dispatch).
+        fprint (its fingerprint) is accepted like the raw and calib classes but not kept.
         """
         if miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
             miscutils.fwdebug_print("INFO: beg")
 
         # open file
         #hdulist = fits.open(fullname, 'update')
-        primary_hdr = fits.getheader(fullname, 0)
+        # tile compressed files have the image header in ext 1 (and the
+        # metadata in the primary if it has no data), reading just the
+        # header blocks doesn't decompress the data
+        if primary_hdr is None:
+            primary_hdr = hsc_fingerprint.read_metadata_header(fullname)
         prihdu = fits.PrimaryHDU(header=primary_hdr)
         hdulist = fits.HDUList([prihdu])
         #import lsst.afw.image as afwImage
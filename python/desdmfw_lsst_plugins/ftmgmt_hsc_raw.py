@@ -17,9 +17,17 @@ from filemgmt.ftmgmt_genfits import FtMgmtGenFits
 from despymisc import miscutils
 from despyfitsutils import fitsutils
 import despyfitsutils.fits_special_metadata as spmeta
+from desdmfw_lsst_plugins import genwrap_profile
+from desdmfw_lsst_plugins import hsc_filename_meta
+from desdmfw_lsst_plugins import hsc_fingerprint
+from desdmfw_lsst_plugins import hsc_pairs
+from desdmfw_lsst_plugins import hsc_visit_index
 
+# filename fast path: check 1 in this many files against the header
+DEFAULT_FASTPATH_VERIFY = 100
 
-class FtMgmtHSCRaw(FtMgmtGenFits):
+
+class FtMgmtHSCRaw(hsc_pairs.PairBatchMixin, FtMgmtGenFits):
     """Class for managing an HSC raw filetype.
 
     It gets metadata, update metadata, etc.
@@ -35,17 +43,49 @@ class FtMgmtHSCRaw(FtMgmtGenFits):
         # config must have filetype_metadata, file_header_info, keywords_file (OPT)
         FtMgmtGenFits.__init__(self, filetype, dbh, config, filepat)
 
+        # optional visit completeness index (config hsc_visit_index or env)
+        self.visit_index = hsc_visit_index.index_from_config(config)
+        # visit -> (dateobs, filter) from headers read, for fast path index rows
+        self.visit_info = {}
+
+        # optional store of header fingerprints for incremental re-ingest
+        # (config hsc_fingerprint_store or env)
+        self.fingerprints = hsc_fingerprint.store_from_config(config)
+
+        # optional fast path deriving metadata from the filename (frame ID) without
+        # opening the file, verifying 1 in hsc_fastpath_verify files against the header.
+        # Only frames up to hsc_fastpath_max_expnum (before the HSCE EXP-ID scheme) can use it.
+        self.fastpath_ccdmap = None
+        self.fastpath_max_expnum = None
+        self.fastpath_verify = DEFAULT_FASTPATH_VERIFY
+        self.fastpath_count = 0
+        if miscutils.convertBool(config.get('hsc_filename_fastpath', False)):
+            metadefs = config['filetype_metadata'][filetype]
+            if 'hsc_frame_ccd_map' not in config:
+                miscutils.fwdebug_print("WARN: hsc_filename_fastpath needs hsc_frame_ccd_map, not using it")
+            elif 'hsc_fastpath_max_expnum' not in config:
+                miscutils.fwdebug_print("WARN: hsc_filename_fastpath needs hsc_fastpath_max_expnum "
+                                        "(last exposure number before HSCE EXP-IDs), not using it")
+            elif not hsc_filename_meta.can_derive(metadefs):
+                miscutils.fwdebug_print("WARN: metadata keys %s can't come from filename, not using fast path" %
+                                        sorted(hsc_filename_meta.requested_keys(metadefs) -
+                                               set(hsc_filename_meta.DERIVED_KEYS)))
+            else:
+                self.fastpath_ccdmap = hsc_filename_meta.read_ccd_map(config['hsc_frame_ccd_map'])
+                self.fastpath_max_expnum = int(config['hsc_fastpath_max_expnum'])
+                self.fastpath_verify = int(config.get('hsc_fastpath_verify', DEFAULT_FASTPATH_VERIFY))
+                if self.fastpath_verify <= 0:
+                    miscutils.fwdebug_print("WARN: filename fast path without header verification")
+
+    @genwrap_profile.profiled('has_contents_ingested')
     def has_contents_ingested(self, listfullnames):
         """Check if exposure has row in rasicam_decam table.
         """
         assert isinstance(listfullnames, list)
 
         # assume uncompressed and compressed files have same metadata
-        # choosing either doesn't matter
-        byfilename = {}
-        for fname in listfullnames:
-            filename = miscutils.parse_fullname(fname, miscutils.CU_PARSE_FILENAME)
-            byfilename[filename] = fname
+        # so a row answers for every variant of the filename
+        byfilename = hsc_pairs.group_pairs(listfullnames)
 
         self.dbh.empty_gtt(dmdbdefs.DB_GTT_FILENAME)
         self.dbh.load_filename_gtt(list(byfilename.keys()))
@@ -57,7 +97,8 @@ class FtMgmtHSCRaw(FtMgmtGenFits):
 
         results = {}
         for row in curs:
-            results[byfilename[row[0]]] = True
+            for fname in byfilename[row[0]]:
+                results[fname] = True
         for fname in listfullnames:
             if fname not in results:
                 results[fname] = False
@@ -66,15 +107,39 @@ class FtMgmtHSCRaw(FtMgmtGenFits):
 
         return results
 
-    def perform_metadata_tasks(self, fullname, do_update, update_info):
+    @genwrap_profile.profiled('perform_metadata_tasks')
+    def perform_metadata_tasks(self, fullname, do_update, update_info, primary_hdr=None, fprint=None):
         """Read metadata from file, updating file values.
+
+        primary_hdr (and its fingerprint fprint) can be given if the header
+        was already read (e.g., by hsc_dispatch).
         """
         if miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
             miscutils.fwdebug_print("INFO: beg")
 
+        fast_metadata = None
+        if self.fastpath_ccdmap is not None and not do_update and primary_hdr is None:
+            fast_metadata = self._gather_metadata_from_name(fullname)
+            if fast_metadata is not None:
+                self.fastpath_count += 1
+                verify = self.fastpath_verify > 0 and self.fastpath_count % self.fastpath_verify == 0
+                # the first file of a visit is read to give its index row dateobs and filter
+                visit_info = None
+                if self.visit_index is not None:
+                    visit_info = self._visit_info(fast_metadata['visit'])
+                if not verify and (self.visit_index is None or visit_info is not None):
+                    if self.visit_index is not None:
+                        self._batch_add('visits', (fast_metadata['visit'], fast_metadata['ccd']) + visit_info)
+                    if miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
+                        miscutils.fwdebug_print("INFO: end (from filename)")
+                    return fast_metadata['metadata']
+
         # open file
         #hdulist = fits.open(fullname, 'update')
-        primary_hdr = fits.getheader(fullname, 0)
+        if primary_hdr is None:
+            # header blocks are read once for both the metadata and the fingerprint
+            (headers, fprint) = hsc_fingerprint.read_headers(fullname)
+            primary_hdr = hsc_fingerprint.metadata_header(headers)
         prihdu = fits.PrimaryHDU(header=primary_hdr)
         hdulist = fits.HDUList([prihdu])
         #import lsst.afw.image as afwImage
@@ -85,6 +150,17 @@ class FtMgmtHSCRaw(FtMgmtGenFits):
         if miscutils.fwdebug_check(6, 'FTMGMT_DEBUG'):
             miscutils.fwdebug_print("INFO: file=%s" % (fullname))
 
+        if self.fingerprints is not None:
+            if fprint is None:
+                fprint = hsc_fingerprint.fingerprint(fullname)
+            self._batch_add('fingerprints', (fullname, fprint, metadata))
+
+        if self.visit_index is not None:
+            self._update_visit_index(fullname, primary_hdr)
+
+        if fast_metadata is not None:
+            self._verify_fastpath(fullname, fast_metadata['metadata'], metadata)
+
         # call function to update headers
         if do_update:
             miscutils.fwdebug_print("WARN: cannot update a raw file's metadata")
@@ -96,6 +172,78 @@ class FtMgmtHSCRaw(FtMgmtGenFits):
             miscutils.fwdebug_print("INFO: end")
         return metadata
 
+    def _gather_metadata_from_name(self, fullname):
+        """Gather metadata using only the filename and config.
+
+        Returns dict with metadata, visit and ccd or None if the filename can't be used.
+        """
+        derived = hsc_filename_meta.derive_values(fullname, self.fastpath_ccdmap, self.fastpath_max_expnum)
+        if derived is None:
+            return None
+
+        metadata = OrderedDict()
+        metadefs = self.config['filetype_metadata'][self.filetype]
+        for hddict in metadefs['hdus'].values():
+            for status_sect in hddict:
+                if 'f' in hddict[status_sect]:
+                    metakeys = list(hddict[status_sect]['f'].keys())
+                    metadata.update(self._gather_metadata_from_filename(fullname, metakeys))
+                if 'w' in hddict[status_sect]:
+                    metakeys = list(hddict[status_sect]['w'].keys())
+                    metadata.update(self._gather_metadata_from_config(fullname, metakeys))
+                for kind in ('h', 'c', 'p'):
+                    if kind in hddict[status_sect]:
+                        for key in hddict[status_sect][kind].keys():
+                            metadata[key] = derived[key.lower()]
+        return {'metadata': metadata, 'visit': derived['visit'], 'ccd': derived['ccd']}
+
+    def _verify_fastpath(self, fullname, fast, metadata):
+        """Compare filename-derived metadata with header values, turning off the fast path on mismatch.
+        """
+        diffs = ['%s (%s != %s)' % (key, fast[key], metadata.get(key))
+                 for key in fast if str(fast[key]) != str(metadata.get(key))]
+        if diffs:
+            miscutils.fwdebug_print("WARN: filename metadata of %s doesn't match header: %s.  "
+                                    "Turning off filename fast path." % (fullname, ', '.join(diffs)))
+            self.fastpath_ccdmap = None
+        elif miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
+            miscutils.fwdebug_print("INFO: verified filename metadata of %s" % fullname)
+
+    def _visit_info(self, visit):
+        """(dateobs, filter) of visit from a header read earlier or the visit index, else None.
+        """
+        if visit not in self.visit_info:
+            info = self.visit_index.status([visit])[visit]
+            if info is None or info['dateobs'] is None or info['filter'] is None:
+                return None
+            self.visit_info[visit] = (info['dateobs'], info['filter'])
+        return self.visit_info[visit]
+
+    def _update_visit_index(self, fullname, primary_hdr):
+        """Add file's ccd to the visit completeness index.
+        """
+        try:
+            visit = self.translate_visit(primary_hdr['EXP-ID'], primary_hdr['FRAMEID'])
+            ccd = int(primary_hdr['DET-ID'])
+        except (KeyError, RuntimeError) as exc:
+            miscutils.fwdebug_print("WARN: cannot add %s to visit index (%s)" % (fullname, exc))
+            return
+        dateobs = primary_hdr.get('DATE-OBS', None)
+        filt = self.translate_filter(primary_hdr.get('FILTER01', None))
+        if dateobs is not None and 'FILTER01' in primary_hdr:
+            self.visit_info[visit] = (dateobs, filt)
+        self._batch_add('visits', (visit, ccd, dateobs, filt))
+
+    def _write_batch(self, kind, entries):
+        """Write visit index or fingerprint entries collected by hsc_pairs.PairBatchMixin.
+        """
+        if kind == 'visits':
+            self.visit_index.add_many(entries)
+        elif kind == 'fingerprints':
+            self.fingerprints.put_many(entries)
+        else:
+            hsc_pairs.PairBatchMixin._write_batch(self, kind, entries)
+
     def ingest_contents(self, listfullnames, **kwargs):
         """Ingest data into non-metadata table - raw_visit.
         """
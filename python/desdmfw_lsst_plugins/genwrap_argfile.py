@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""Spill long LSST command line selections into an argument file.
+
+LSST command line tasks read arguments from @file (one or more
+whitespace separated arguments per line), so the per-file selectors can
+be moved out of the command line into a file.  The executed command line
+then stays short, and the argument file plus its hash is a lossless
+record of what was run.
+"""
+
+import hashlib
+import os
+
+# database table currently holds 4000 characters
+DB_CMDLINE_MAXLEN = 3995
+
+# spill selections once the command line would not fit in the database
+DEFAULT_ARGFILE_THRESHOLD = DB_CMDLINE_MAXLEN
+
+
+def write_argfile(argfile, fragments):
+    """Write one fragment per line returning the sha1 of the contents.
+    """
+    contents = '\n'.join(fragments) + '\n'
+    with open(argfile, 'w') as argfh:
+        argfh.write(contents)
+    return hashlib.sha1(contents.encode('utf-8')).hexdigest()
+
+
+def spill_cmdline(base_cmdline, fragments, argfile, threshold=DEFAULT_ARGFILE_THRESHOLD):
+    """Return (cmdline, argfile info) adding fragments directly or via argfile.
+
+    argfile info is None if the fragments fit within threshold characters.
+    """
+    addstr = ' '.join(fragments)
+    if len(base_cmdline) + 1 + len(addstr) <= threshold:
+        return base_cmdline + ' ' + addstr, None
+
+    argfile = os.path.abspath(argfile)
+    sha1 = write_argfile(argfile, fragments)
+    info = {'path': argfile,
+            'sha1': sha1,
+            'num_args': len(fragments),
+            'num_chars': len(addstr)}
+    return '%s @%s' % (base_cmdline, argfile), info
+
+
+def split_partial(cmdline):
+    """Return (cmdline without its last token, last token) unless it ends in whitespace.
+
+    add_cmdline values are glued onto the last token (e.g., --id visit=),
+    so that token has to move into the argfile with the values.
+    """
+    if not cmdline or cmdline[-1].isspace():
+        return cmdline.rstrip(), ''
+    parts = cmdline.rsplit(None, 1)
+    if len(parts) == 1:
+        return '', parts[0]
+    return parts[0], parts[1]
+
+
+def summarize_cmdline(cmdline, info):
+    """Compact lossless summary of a spilled command line for the DB.
+    """
+    return '%s [sha1=%s]' % (cmdline, info['sha1'])
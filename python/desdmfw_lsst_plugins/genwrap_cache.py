@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""Node-local LRU cache of input files (e.g., calibs and ref cat shards).
+
+Entries are keyed by the framework filename plus the file's checksum if
+the caller knows it, otherwise its size and mtime (so a changed source
+gets a new entry).  They keep the original filename so tools that parse
+filenames still work:
+
+    <root>/<key[:2]>/<key>/<filename>
+
+Entries are populated through a temporary file and os.rename so
+concurrent jobs on the node never see partial files.  Sizes and last use
+times are kept in a small SQLite index, so keeping the cache under its
+byte budget doesn't walk the cache, and use is recorded in the index
+instead of the file's mtime (the job copies are hardlinks of the same
+inode).  Files are served to jobs by hardlink (a copy if on a different
+filesystem, never a symlink another job's eviction could dangle) while
+holding the entry lock, which eviction also takes.
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from despymisc import miscutils
+
+LOCKNAME = '.lock'
+INDEXNAME = 'index.sqlite3'
+
+INDEX_SCHEMA = """create table if not exists entries (
+    path text primary key,
+    size integer not null,
+    last_used real not null)"""
+
+
+def parse_bytes(sizestr):
+    """Convert a size like 500G, 20M or 1024 into bytes.
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', str(sizestr).upper())
+    if not match:
+        raise ValueError('Invalid byte size (%s)' % sizestr)
+    mult = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}[match.group(2)]
+    return int(float(match.group(1)) * mult)
+
+
+@contextmanager
+def locked(lockfile, wait=True):
+    """Hold an exclusive flock on lockfile, yielding whether it was acquired.
+
+    Without wait, yields False instead of blocking if another holds it.
+    """
+    with open(lockfile, 'a') as lockfh:
+        acquired = True
+        try:
+            fcntl.flock(lockfh, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(lockfh, fcntl.LOCK_UN)
+
+
+def serve(cached, dest):
+    """Make cached available at dest via hardlink, or copy if it can't be linked.
+
+    Either way dest stays valid after cached is evicted.
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(cached, dest)
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        tmpfile = '%s.tmp.%s' % (dest, os.getpid())
+        shutil.copyfile(cached, tmpfile)
+        os.rename(tmpfile, dest)
+
+
+class NodeCache(object):
+    """Node-local file cache with LRU eviction.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        if not os.path.exists(root):
+            miscutils.coremakedirs(root)
+
+        # one index connection per thread (execs may run in parallel threads)
+        self._local = threading.local()
+        indexfile = os.path.join(self.root, INDEXNAME)
+        with locked(os.path.join(self.root, LOCKNAME)):
+            rebuild = not os.path.exists(indexfile)
+            with self.conn:
+                self.conn.execute(INDEX_SCHEMA)
+                if rebuild:
+                    # cache populated before the index existed
+                    self.conn.executemany('insert or replace into entries values (?, ?, ?)',
+                                          [(path, size, last_used) for (last_used, size, path)
+                                           in self.entries()])
+
+    @property
+    def conn(self):
+        """Index connection of the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, INDEXNAME), timeout=60)
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def make_key(cls, filename, src=None, checksum=None):
+        """Cache key from framework filename and checksum (or size, mtime).
+        """
+        if checksum is None:
+            stat = os.stat(src)
+            checksum = '%s:%s' % (stat.st_size, int(stat.st_mtime))
+        return hashlib.sha1(('%s:%s' % (filename, checksum)).encode('utf-8')).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def fetch(self, src, filename=None, checksum=None, dest=None):
+        """Return path of src inside the cache, copying it in if needed.
+
+        With dest the file is also served at dest while the entry is
+        locked, so it can't be evicted in between.
+        """
+        if filename is None:
+            filename = os.path.basename(src)
+        key = self.make_key(filename, src, checksum)
+        edir = self.entry_dir(key)
+        cached = os.path.join(edir, filename)
+
+        parent = os.path.dirname(edir)
+        if not os.path.exists(parent):
+            miscutils.coremakedirs(parent)
+        with locked(edir + LOCKNAME):
+            # another job may have populated it while waiting on lock
+            added = not os.path.exists(cached)
+            if added:
+                if not os.path.exists(edir):
+                    miscutils.coremakedirs(edir)
+                tmpfile = '%s.tmp.%s' % (cached, os.getpid())
+                shutil.copyfile(src, tmpfile)
+                os.rename(tmpfile, cached)
+                miscutils.fwdebug_print("INFO: node cache added %s" % cached)
+            elif miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+                miscutils.fwdebug_print("INFO: node cache hit %s" % cached)
+            if dest is not None:
+                serve(cached, dest)
+            with self.conn:
+                self.conn.execute('insert or replace into entries values (?, ?, ?)',
+                                  (cached, os.path.getsize(cached), time.time()))
+
+        if added:
+            self.evict(keep=cached)
+        return cached
+
+    def entries(self):
+        """Return list of (last_used, size, path) for all cached files (walking the cache).
+        """
+        result = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for fname in filenames:
+                if fname.endswith(LOCKNAME) or '.tmp.' in fname or dirpath == self.root:
+                    continue
+                path = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(path)
+                except OSError:   # evicted by another job
+                    continue
+                result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def total_bytes(self):
+        """Bytes used by the cached files according to the index.
+        """
+        return self.conn.execute('select coalesce(sum(size), 0) from entries').fetchone()[0]
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until within byte budget.
+
+        Entries being fetched or served (entry lock held) are skipped.
+        """
+        with locked(os.path.join(self.root, LOCKNAME)):
+            total = self.total_bytes()
+            if total <= self.max_bytes:
+                return total
+
+            rows = self.conn.execute('select path, size from entries order by last_used').fetchall()
+            for (path, size) in rows:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                edir = os.path.dirname(path)
+                with locked(edir + LOCKNAME, wait=False) as acquired:
+                    if not acquired:
+                        continue
+                    try:
+                        os.remove(path)
+                        os.rmdir(edir)
+                    except OSError:
+                        pass
+                    with self.conn:
+                        self.conn.execute('delete from entries where path=?', (path,))
+                total -= size
+                if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+                    miscutils.fwdebug_print("INFO: node cache evicted %s" % path)
+        return total
+
+    def stage(self, src, stagedir, filename=None, checksum=None):
+        """Fetch src into the cache and serve it in stagedir returning the new path.
+        """
+        if not os.path.exists(stagedir):
+            miscutils.coremakedirs(stagedir)
+        dest = os.path.join(stagedir, filename or os.path.basename(src))
+        self.fetch(src, filename, checksum, dest)
+        return dest
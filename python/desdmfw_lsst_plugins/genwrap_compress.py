@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""Tile-compress FITS outputs (fpack style .fz files) in parallel.
+
+Every image HDU is written as a CompImageHDU (the primary HDU becomes an
+empty primary followed by the compressed image, same as fpack).  Table
+HDUs are copied unchanged.  Compression is lossless by default: float
+images are stored unquantized with gzip (RICE_1 only handles them
+quantized) and the compressed file is read back and compared pixel by
+pixel to the original before the original is removed.  Quantizing float
+images is lossy and has to be asked for (lossy=True), it is logged and
+can't be verified.
+
+Files are compressed in forkserver (or spawn) worker processes since the
+caller may run several execs in threads, which fork doesn't mix with.
+"""
+
+import inspect
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from despymisc import miscutils
+
+COMPRESSED_SUFFIX = '.fz'
+
+ALGORITHMS = ['RICE_1', 'GZIP_1', 'GZIP_2', 'PLIO_1', 'HCOMPRESS_1', 'NOCOMPRESS']
+DEFAULT_ALGORITHM = 'RICE_1'
+# quantize level of float images when lossy compression is allowed
+DEFAULT_QUANTIZE = 16.0
+
+# algorithms storing unquantized float images losslessly
+FLOAT_LOSSLESS_ALGORITHMS = ('GZIP_1', 'GZIP_2', 'NOCOMPRESS')
+FLOAT_LOSSLESS_DEFAULT = 'GZIP_2'
+
+
+def parse_tile(tilestr):
+    """Convert tile size string (e.g., '100,100' or 'row') to tuple or None (row by row).
+    """
+    if tilestr is None or str(tilestr).lower() in ('', 'row', 'none'):
+        return None
+    return tuple(int(val) for val in miscutils.fwsplit(str(tilestr), ','))
+
+
+def is_lossless(algorithm, quantize, dtype):
+    """Whether compressing data of dtype with given settings keeps every pixel value.
+    """
+    if dtype.kind in 'iub':
+        return True
+    # floats are only stored unquantized (quantize_level 0) with gzip
+    return quantize == 0 and algorithm in FLOAT_LOSSLESS_ALGORITHMS
+
+
+def hdu_settings(algorithm, quantize, dtype, lossy):
+    """Return (algorithm, quantize level) used for an image of dtype.
+
+    Unless lossy, float images are stored unquantized with gzip.
+    """
+    if lossy or dtype.kind in 'iub':
+        return algorithm, quantize
+    if algorithm not in FLOAT_LOSSLESS_ALGORITHMS:
+        algorithm = FLOAT_LOSSLESS_DEFAULT
+    return algorithm, 0.0
+
+
+def tile_kwargs(compimagehdu, tile):
+    """CompImageHDU keyword for the tile size (FITS axis order, as fpack -t).
+
+    Newer astropy takes tile_shape in numpy axis order instead of tile_size.
+    """
+    if tile is None:
+        return {}
+    if 'tile_shape' in inspect.signature(compimagehdu.__init__).parameters:
+        return {'tile_shape': tuple(reversed(tile))}
+    return {'tile_size': tile}
+
+
+def mp_context():
+    """multiprocessing context for the workers (forkserver if available, else spawn).
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def compress_file(src, dest, algorithm=DEFAULT_ALGORITHM, quantize=DEFAULT_QUANTIZE,
+                  tile=None, verify=True, lossy=False):
+    """Write tile-compressed copy of src to dest.
+
+    quantize is only used for float images if lossy.
+    Returns dict with original and compressed sizes and whether the
+    round-trip was verified.
+    """
+    import numpy
+    from astropy.io import fits
+
+    if algorithm not in ALGORITHMS:
+        raise ValueError('Invalid compression algorithm (%s)' % algorithm)
+
+    tmpdest = '%s.tmp.%s' % (dest, os.getpid())
+    lossless = True
+    with fits.open(src, memmap=True) as inhdus:
+        outhdus = fits.HDUList([fits.PrimaryHDU(header=inhdus[0].header.copy()
+                                                if inhdus[0].data is None else None)])
+        for hdu in inhdus:
+            if hdu.is_image and hdu.data is not None:
+                hdr = hdu.header.copy()
+                for key in ('SIMPLE', 'EXTEND', 'XTENSION', 'PCOUNT', 'GCOUNT'):
+                    hdr.remove(key, ignore_missing=True)
+                (hdu_algorithm, hdu_quantize) = hdu_settings(algorithm, quantize, hdu.data.dtype, lossy)
+                lossless = lossless and is_lossless(hdu_algorithm, hdu_quantize, hdu.data.dtype)
+                outhdus.append(fits.CompImageHDU(data=hdu.data, header=hdr,
+                                                 compression_type=hdu_algorithm,
+                                                 quantize_level=hdu_quantize,
+                                                 **tile_kwargs(fits.CompImageHDU, tile)))
+            elif not hdu.is_image:
+                outhdus.append(hdu.copy())
+        outhdus.writeto(tmpdest, overwrite=True)
+
+        verified = False
+        if not lossless:
+            miscutils.fwdebug_print("WARN: lossy compression of %s (%s, quantize %s), not verified" %
+                                    (src, algorithm, quantize))
+        elif verify:
+            with fits.open(tmpdest) as chkhdus:
+                orig = [hdu for hdu in inhdus if hdu.is_image and hdu.data is not None]
+                comp = [hdu for hdu in chkhdus if isinstance(hdu, fits.CompImageHDU)]
+                if len(orig) != len(comp):
+                    raise ValueError('Compressed %s has %s images instead of %s' %
+                                     (src, len(comp), len(orig)))
+                for (ohdu, chdu) in zip(orig, comp):
+                    # masked/bad pixels of float images are NaN
+                    if not numpy.array_equal(ohdu.data, chdu.data,
+                                             equal_nan=ohdu.data.dtype.kind == 'f'):
+                        raise ValueError('Round-trip check of compressed %s failed' % src)
+            verified = True
+
+    os.rename(tmpdest, dest)
+    return {'orig_size': os.path.getsize(src),
+            'size': os.path.getsize(dest),
+            'lossless': lossless,
+            'verified': verified}
+
+
+def _compress_one(args):
+    (src, algorithm, quantize, tile, verify, keep_original, lossy) = args
+    dest = src + COMPRESSED_SUFFIX
+    info = compress_file(src, dest, algorithm, quantize, tile, verify, lossy)
+    if not keep_original:
+        os.remove(src)
+    info['fullname'] = dest
+    return src, info
+
+
+def compress_files(fullnames, algorithm=DEFAULT_ALGORITHM, quantize=DEFAULT_QUANTIZE,
+                   tile=None, verify=True, keep_original=False, nworkers=1, lossy=False):
+    """Compress files on a process pool.
+
+    Returns OrderedDict of original fullname -> info (fullname of compressed file, sizes).
+    """
+    jobs = [(src, algorithm, quantize, tile, verify, keep_original, lossy) for src in fullnames]
+    results = OrderedDict()
+    if not jobs:
+        return results
+    with ProcessPoolExecutor(max_workers=max(1, min(nworkers, len(jobs))), mp_context=mp_context()) as pool:
+        for (src, info) in pool.map(_compress_one, jobs):
+            results[src] = info
+            if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+                miscutils.fwdebug_print("INFO: compressed %s (%s -> %s bytes)" %
+                                        (src, info['orig_size'], info['size']))
+    return results
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""Run independent exec sections of a wrapper concurrently.
+
+Dependencies between exec sections come from their declared inputs
+(used) and outputs (was_generated_by): a later exec waits for an earlier
+one if it reads something the earlier one writes, writes something the
+earlier one reads or writes the same outputs.  Execs using the same
+Butler job repo (which the declared inputs and outputs don't describe:
+registry, ingested inputs, configs) also run one after another, unless
+an exec lists its dependencies itself with exec_depends (empty or none
+for no extra ones).  So results are the same as running the execs one
+after another in exec order.
+
+Ready execs are started in exec order as long as their cores and memory
+fit in the budget.  An exec larger than the whole budget runs alone.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from despymisc import miscutils
+from intgutils import intgdefs
+
+# status of an exec not run because an exec failed
+SKIPPED_STATUS = -1
+
+
+def section_tokens(sectlist):
+    """Normalize used/was_generated_by entries into a set of section names.
+
+    file.X -> file.X, list.L.F -> list.L and file.F (list lines are files of section F)
+    """
+    tokens = set()
+    if not sectlist:
+        return tokens
+    for sect in miscutils.fwsplit(sectlist.lower(), ','):
+        sectkeys = sect.split('.')
+        if sectkeys[0] == intgdefs.IW_LIST_SECT and len(sectkeys) > 2:
+            tokens.add('.'.join(sectkeys[:2]))
+            tokens.add('%s.%s' % (intgdefs.IW_FILE_SECT, sectkeys[2]))
+        else:
+            tokens.add(sect)
+    return tokens
+
+
+def build_graph(execs, job_repo_dir=None):
+    """Return OrderedDict exec key -> set of exec keys it must wait for.
+
+    execs is a dict of exec key -> exec section, order is sorted exec key.
+    job_repo_dir is the wrapper's job repo, used by execs without their own.
+    """
+    order = sorted(execs.keys())
+    ios = {}
+    for ekey in order:
+        ios[ekey] = (section_tokens(execs[ekey].get(intgdefs.IW_INPUTS, '')),
+                     section_tokens(execs[ekey].get(intgdefs.IW_OUTPUTS, '')))
+
+    deps = OrderedDict()
+    for i, ekey in enumerate(order):
+        (ins, outs) = ios[ekey]
+        deps[ekey] = set()
+        for prev in order[:i]:
+            (pins, pouts) = ios[prev]
+            if pouts & ins or pins & outs or pouts & outs:
+                deps[ekey].add(prev)
+
+        if 'exec_depends' not in execs[ekey]:
+            repo = execs[ekey].get('job_repo_dir', job_repo_dir)
+            if repo is not None:
+                deps[ekey].update(prev for prev in order[:i]
+                                  if execs[prev].get('job_repo_dir', job_repo_dir) == repo)
+        elif str(execs[ekey]['exec_depends']).strip().lower() not in ('', 'none'):
+            for extra in miscutils.fwsplit(execs[ekey]['exec_depends'], ','):
+                if extra not in execs:
+                    raise ValueError('Invalid exec_depends %s in %s' % (extra, ekey))
+                deps[ekey].add(extra)
+    return deps
+
+
+def run_graph(deps, needs, budget, runfunc):
+    """Run execs respecting dependencies and the (cores, memory) budget.
+
+    needs is dict of exec key -> (cores, memory), budget is (cores, memory)
+    with memory None for no limit.  runfunc(ekey) returns the exec status.
+    Once an exec fails no new execs are started.  Returns OrderedDict of
+    exec key -> status in exec order (SKIPPED_STATUS for execs not run).
+    """
+    (free_cores, free_mem) = budget
+    pending = list(deps.keys())
+    running = {}
+    statuses = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+        while pending or running:
+            if all(status == 0 for status in statuses.values()):
+                for ekey in list(pending):
+                    if not all(statuses.get(dep) == 0 for dep in deps[ekey]):
+                        continue
+                    (cores, mem) = needs[ekey]
+                    fits = cores <= free_cores and (free_mem is None or mem <= free_mem)
+                    if fits or not running:
+                        pending.remove(ekey)
+                        free_cores -= cores
+                        if free_mem is not None:
+                            free_mem -= mem
+                        running[pool.submit(runfunc, ekey)] = ekey
+                        if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+                            miscutils.fwdebug_print("INFO: started %s (%s cores, %s bytes)" %
+                                                    (ekey, cores, mem))
+
+            if not running:
+                break
+
+            finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                ekey = running.pop(fut)
+                (cores, mem) = needs[ekey]
+                free_cores += cores
+                if free_mem is not None:
+                    free_mem += mem
+                statuses[ekey] = fut.result()
+
+    for ekey in pending:
+        statuses[ekey] = SKIPPED_STATUS
+    return OrderedDict((ekey, statuses[ekey]) for ekey in deps)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""Fast reader for the list files used by the LSST wrapper.
+
+Text lists (textcsv, texttab, textsp) are parsed straight into a compact
+columnar structure instead of a list of dicts converted into a full WCL.
+Parsed lists are cached per (path, mtime, format, columns) so that
+repeated uses of the same list inside a wrapper only read it once.
+"""
+
+import os
+import re
+
+from despymisc import miscutils
+from intgutils import intgmisc
+
+# delimiters for the text list formats
+TEXT_DELIMS = {'textcsv': ',',
+               'texttab': '\t',
+               'textsp': ' '}
+
+# characters for which miscutils.fwsplit does more than split and strip
+# (parens are deleted and n:m ranges are expanded)
+_FWSPLIT_SPECIAL = re.compile(r'[():]')
+
+
+def split_line(line, delim):
+    """Split a single list line the same way miscutils.fwsplit does.
+    """
+    if _FWSPLIT_SPECIAL.search(line):
+        return miscutils.fwsplit(line, delim)
+    return [x.strip() for x in line.split(delim)]
+
+
+class ListColumns(object):
+    """Columnar contents of a text list file.
+
+    Each row is a tuple of values in column order.
+    """
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = tuple(columns)
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        """Return the values of a single column.
+        """
+        idx = self.columns.index(name)
+        return [row[idx] if idx < len(row) else None for row in self.rows]
+
+    def iter_files(self):
+        """Iterate over lines as dicts of file-section -> values.
+
+        Text lists have a single file per line, named as
+        queryutils.convert_single_files_to_lines would name it.
+        """
+        columns = self.columns
+        count = 1
+        for row in self.rows:
+            yield {'file%05d' % count: dict(zip(columns, row))}
+            count += 1
+
+
+class WclListLines(object):
+    """Lines of a wcl/config format list file.
+    """
+    __slots__ = ('lines',)
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def iter_files(self):
+        """Iterate over lines as dicts of file-section -> values.
+        """
+        for fdict in self.lines:
+            yield fdict
+
+
+def read_text_list(listfile, linefmt, columns):
+    """Parse a text list file into a ListColumns.
+    """
+    if linefmt not in TEXT_DELIMS:
+        miscutils.fwdie('Error:  unknown linefmt (%s)' % linefmt, 1)
+    delim = TEXT_DELIMS[linefmt]
+
+    rows = []
+    with open(listfile, 'r') as listfh:
+        for line in listfh:
+            rows.append(tuple(split_line(line.strip(), delim)))
+    return ListColumns(columns, rows)
+
+
+def read_wcl_list(listfile):
+    """Read a wcl/config list file keeping only the per-line file dicts.
+    """
+    from intgutils import wcl
+
+    mywcl = wcl.WCL()
+    mywcl.read(listfile)
+    return WclListLines([wldict['file'] for wldict in list(mywcl['list']['line'].values())])
+
+
+class ListFileCache(object):
+    """Cache of parsed list files for the life of a wrapper.
+    """
+
+    def __init__(self):
+        self.cache = {}
+
+    def get(self, listfile, linefmt, colstr):
+        """Return the parsed list (ListColumns or WclListLines).
+        """
+        key = (os.path.abspath(listfile), os.stat(listfile).st_mtime, linefmt, colstr)
+        if key not in self.cache:
+            if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+                miscutils.fwdebug_print('INFO: parsing list %s (%s)' % (listfile, linefmt))
+
+            if linefmt == 'config' or linefmt == 'wcl':
+                parsed = read_wcl_list(listfile)
+            else:
+                columns = intgmisc.convert_col_string_to_list(colstr, False)
+                parsed = read_text_list(listfile, linefmt, columns)
+            self.cache[key] = parsed
+        return self.cache[key]
+
+    def iter_files(self, listfile, linefmt, colstr):
+        """Iterate over lines of the list as dicts of file-section -> values.
+        """
+        return self.get(listfile, linefmt, colstr).iter_files()
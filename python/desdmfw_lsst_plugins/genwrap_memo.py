@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""Local store of completed exec results for skipping identical reruns.
+
+The key of an exec is the sha1 of its resolved command line (made
+deterministic: the job directory and spilled argfile paths are replaced
+by placeholders and argfile content hashes), the checksums of its input
+files, the names of its outputs and the software stack version.  When a
+completed result with the same key exists its outputs are restored by
+hardlink (copy if on a different filesystem) instead of running the
+task.  Inputs and outputs are named by their path relative to the job
+directory (Gen2 repos have the same filename in many directories).  Entries are written to a temporary directory and renamed so
+concurrent jobs never see partial results:
+
+    <root>/<key[:2]>/<key>/result.json
+    <root>/<key[:2]>/<key>/outputs/<n>/<filename>
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+
+from despymisc import miscutils
+from desdmfw_lsst_plugins import genwrap_outputs
+
+RESULT_FILE = 'result.json'
+OUTPUT_DIR = 'outputs'
+
+HASH_CONTENT = 'content'
+HASH_STAT = 'stat'
+
+# environment variables identifying the LSST stack (setup by eups)
+STACK_ENV_VARS = ['SETUP_LSST_DISTRIB', 'SETUP_PIPE_TASKS', 'SETUP_OBS_SUBARU']
+
+
+def stack_version(version=None):
+    """Software stack version: given version plus eups setup of the main products.
+    """
+    parts = [str(version)] if version else []
+    for var in STACK_ENV_VARS:
+        if var in os.environ:
+            parts.append('%s=%s' % (var, os.environ[var]))
+    return ';'.join(parts)
+
+
+def normalize_cmdline(cmdline, argfiles=None, cwd=None):
+    """Return command line without run specific paths.
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    for info in (argfiles or {}).values():
+        cmdline = cmdline.replace('@' + info['path'], '@sha1:' + info['sha1'])
+    cmdline = cmdline.replace(cwd.rstrip('/') + '/', '${CWD}/')
+    return ' '.join(cmdline.split())
+
+
+def job_relpath(fullname, cwd=None):
+    """Path of a file relative to the job directory (absolute if outside it).
+    """
+    if cwd is None:
+        cwd = os.getcwd()
+    fullname = os.path.normpath(os.path.join(cwd, fullname))
+    if fullname.startswith(cwd.rstrip('/') + '/'):
+        return os.path.relpath(fullname, cwd)
+    return fullname
+
+
+def input_checksums(fullnames, method=HASH_CONTENT):
+    """Return OrderedDict job relative path -> checksum (sha1 of content, or size:mtime).
+    """
+    sums = OrderedDict()
+    for fullname in sorted(fullnames):
+        if method == HASH_STAT:
+            stat = os.stat(fullname)
+            sums[job_relpath(fullname)] = '%s:%s' % (stat.st_size, int(stat.st_mtime))
+        else:
+            info, _ = genwrap_outputs.checksum_file(fullname, ('sha1',))
+            sums[job_relpath(fullname)] = info['sha1sum']
+    return sums
+
+
+def make_key(cmdlines, checksums, outputs, version):
+    """Return (key, description used to compute it).
+    """
+    desc = OrderedDict([('cmdlines', list(cmdlines)),
+                        ('inputs', checksums),
+                        ('outputs', sorted(job_relpath(fname) for fname in outputs)),
+                        ('stack', version)])
+    key = hashlib.sha1(json.dumps(desc, sort_keys=True).encode('utf-8')).hexdigest()
+    return key, desc
+
+
+def link_or_copy(src, dest):
+    """Hardlink src to dest, copying if on a different filesystem.
+    """
+    destdir = os.path.dirname(dest)
+    if destdir and not os.path.exists(destdir):
+        miscutils.coremakedirs(destdir)
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, dest)
+
+
+class ExecMemo(object):
+    """Local store of completed exec results keyed by make_key.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.exists(root):
+            miscutils.coremakedirs(root)
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key):
+        """Return the saved result dict of key or None.
+        """
+        resfile = os.path.join(self.entry_dir(key), RESULT_FILE)
+        if not os.path.exists(resfile):
+            return None
+        with open(resfile, 'r') as resfh:
+            return json.load(resfh, object_pairs_hook=OrderedDict)
+
+    def save(self, key, desc, outputs, extra=None):
+        """Save copies of the existing outputs as the result of key.
+
+        Returns the saved result dict or None if another job saved it first.
+        """
+        edir = self.entry_dir(key)
+        if os.path.exists(edir):
+            return None
+
+        tmpdir = '%s.tmp.%s' % (edir, os.getpid())
+        if os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+        miscutils.coremakedirs(tmpdir)
+
+        saved = []
+        for i, fullname in enumerate(sorted(outputs)):
+            if not os.path.exists(fullname):
+                continue
+            relpath = os.path.join(OUTPUT_DIR, str(i), os.path.basename(fullname))
+            link_or_copy(fullname, os.path.join(tmpdir, relpath))
+            saved.append([job_relpath(fullname), relpath])
+
+        result = OrderedDict([('key', key),
+                              ('saved', time.time()),
+                              ('desc', desc),
+                              ('outputs', saved)])
+        if extra:
+            result.update(extra)
+        with open(os.path.join(tmpdir, RESULT_FILE), 'w') as resfh:
+            json.dump(result, resfh, indent=1)
+
+        try:
+            os.rename(tmpdir, edir)
+        except OSError:
+            # another job renamed its copy first
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return None
+        return result
+
+    def restore(self, key, result, outputs):
+        """Restore the saved outputs of a result to the current run's fullnames.
+
+        outputs are matched by path relative to the job directory (job
+        directories differ between runs).
+        Returns list of restored fullnames.
+        """
+        byjobpath = dict((job_relpath(fullname), fullname) for fullname in outputs)
+        edir = self.entry_dir(key)
+        restored = []
+        for (jobpath, relpath) in result['outputs']:
+            if jobpath not in byjobpath:
+                raise KeyError('Memo %s output %s is not an output of this exec' % (key, jobpath))
+            fullname = byjobpath[jobpath]
+            link_or_copy(os.path.join(edir, relpath), fullname)
+            restored.append(fullname)
+        return restored
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""Precompute checksums, sizes and metadata of wrapper outputs.
+
+Each output is read once in large blocks, feeding every requested
+checksum.  The FITS header at the start of the file is kept so a
+filetype plugin can gather metadata without re-opening the file.  Files
+are processed on a thread pool (hashlib releases the GIL on large
+buffers).
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from despymisc import miscutils
+from desdmfw_lsst_plugins import hsc_fingerprint
+
+READ_SIZE = 4 * 1024 * 1024
+FITS_BLOCK = 2880
+FITS_CARD = 80
+
+# stop looking for the END card after this many header blocks
+MAX_HEADER_BLOCKS = 1000
+
+
+def find_header_end(buf):
+    """Return byte offset just past the block containing the END card or None.
+    """
+    for offset in range(0, len(buf) - FITS_CARD + 1, FITS_CARD):
+        if buf[offset:offset + 3] == b'END' and buf[offset + 3:offset + FITS_CARD].strip() == b'':
+            return (offset // FITS_BLOCK + 1) * FITS_BLOCK
+    return None
+
+
+def checksum_file(fullname, algorithms=('md5',), keep_header=False):
+    """Compute checksums and size of a file in a single streaming read.
+
+    Returns (OrderedDict of filesize and <alg>sum values, primary header bytes or None).
+    """
+    hashes = [(alg, hashlib.new(alg)) for alg in algorithms]
+    filesize = 0
+    header = None
+    headbuf = b''
+    want_header = keep_header
+
+    with open(fullname, 'rb') as infh:
+        while True:
+            buf = infh.read(READ_SIZE)
+            if not buf:
+                break
+            filesize += len(buf)
+            for (_, hsh) in hashes:
+                hsh.update(buf)
+
+            if want_header:
+                headbuf += buf
+                end = find_header_end(headbuf)
+                if end is not None:
+                    header = headbuf[:end]
+                    want_header = False
+                elif len(headbuf) > MAX_HEADER_BLOCKS * FITS_BLOCK:
+                    want_header = False
+                if not want_header:
+                    headbuf = b''
+
+    info = OrderedDict([('filesize', filesize)])
+    for (alg, hsh) in hashes:
+        info['%ssum' % alg] = hsh.hexdigest()
+    return info, header
+
+
+def gather_metadata(plugin, fullname, header):
+    """Run a filetype plugin's metadata gathering on already read header bytes.
+
+    Tile compressed files have their image header in ext 1 (and the
+    metadata in the primary if it has no data), see
+    hsc_fingerprint.metadata_header.  Reading just the header blocks
+    doesn't decompress the data.
+    """
+    from astropy.io import fits
+
+    if header is None:
+        hdr = hsc_fingerprint.read_metadata_header(fullname)
+    else:
+        hdr = fits.Header.fromstring(header.decode('ascii', errors='replace'))
+    hdulist = fits.HDUList([fits.PrimaryHDU(header=hdr)])
+    metadata, _ = plugin._gather_metadata_file(fullname, hdulist=hdulist)
+    return metadata
+
+
+def precompute_one(fullname, algorithms, plugin):
+    """Checksums, size and (optionally) metadata for a single output.
+    """
+    compressed = fullname.endswith('.fz')
+    info, header = checksum_file(fullname, algorithms,
+                                 keep_header=plugin is not None and not compressed)
+    info['fullname'] = fullname
+    if plugin is not None:
+        if header is None and not compressed:
+            miscutils.fwdebug_print("WARN: couldn't find FITS header in %s" % fullname)
+        else:
+            info['metadata'] = gather_metadata(plugin, fullname, header)
+    return info
+
+
+def precompute_outputs(jobs, algorithms=('md5',), nworkers=1):
+    """Process list of (fullname, plugin or None) on a worker pool.
+
+    Returns OrderedDict of filename -> info in the order of jobs.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, nworkers)) as pool:
+        futures = [pool.submit(precompute_one, fullname, algorithms, plugin)
+                   for (fullname, plugin) in jobs]
+        results = OrderedDict()
+        for (fullname, _), fut in zip(jobs, futures):
+            results[os.path.basename(fullname)] = fut.result()
+    return results
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""Overlap repo ingest of inputs with execution of per-visit task shards.
+
+A background thread ingests inputs one visit group at a time (files not
+belonging to any visit first) in the order the shards will need them.
+Each shard is launched as soon as all of its visits are ingested, so
+ingest I/O overlaps with compute on the visits already ingested.
+
+Ordering is deterministic: ingest runs in a fixed order and shard
+results are returned in shard order.  Same as ingesting everything
+first, no task runs on a partly ingested repo: shards whose visits (or
+common inputs) had a failed ingest, or were not reached because the
+ingest thread itself failed, are not run.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from despymisc import miscutils
+from desdmfw_lsst_plugins import genwrap_procacct
+
+# group key for inputs that are needed by every shard
+COMMON_GROUP = None
+
+# status of a shard skipped because ingest failed
+SKIPPED_STATUS = -1
+
+
+def group_ingests(pending, file_visits, visit_order):
+    """Group pending (fname, repocmd) ingests by visit.
+
+    Returns OrderedDict visit -> list of repocmds, starting with
+    COMMON_GROUP for files without a known visit, then visits in visit_order.
+    """
+    groups = OrderedDict()
+    groups[COMMON_GROUP] = []
+    for visit in visit_order:
+        groups[visit] = []
+    for (fname, repocmd) in pending:
+        visit = file_visits.get(fname, COMMON_GROUP)
+        if visit not in groups:
+            visit = COMMON_GROUP
+        groups[visit].append(repocmd)
+    return groups
+
+
+class VisitIngester(threading.Thread):
+    """Background thread ingesting one visit group after another.
+    """
+
+    def __init__(self, groups, ingestfunc):
+        threading.Thread.__init__(self, name='visit_ingester')
+        self.daemon = True
+        self.groups = groups
+        self.ingestfunc = ingestfunc
+        self.done = dict((visit, threading.Event()) for visit in groups)
+        self.num_failed = dict((visit, 0) for visit in groups)
+        self.completed = dict((visit, False) for visit in groups)
+        self.error = None
+
+    def run(self):
+        try:
+            for visit, repocmds in self.groups.items():
+                for repocmd in repocmds:
+                    if self.ingestfunc(repocmd) != 0:
+                        self.num_failed[visit] += 1
+                self.completed[visit] = self.num_failed[visit] == 0
+                self.done[visit].set()
+                if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+                    miscutils.fwdebug_print("INFO: ingested visit group %s (%s files)" %
+                                            (visit, len(repocmds)))
+        except Exception as exc:
+            self.error = exc
+        finally:
+            # never leave shards waiting
+            for event in self.done.values():
+                event.set()
+
+    def wait_for(self, visits):
+        """Wait until visits (and the common group) are ingested.
+
+        Returns False if any of their ingests failed or ingest stopped before them.
+        """
+        visits = [COMMON_GROUP] + list(visits)
+        for visit in visits:
+            self.done[visit].wait()
+        return all(self.completed[visit] for visit in visits)
+
+
+def run_pipelined(groups, shard_cmdlines, shard_visits, ncores, ingestfunc, runfunc, warmup=True):
+    """Ingest visit groups in the background while running shards as they become ready.
+
+    ingestfunc(repocmd) returns the ingest exit code, runfunc(i, cmdline)
+    returns (retcode, procinfo, logfile).  With warmup the first shard runs
+    alone before the others (see genwrap_shard).  Returns (shard results
+    in shard order, ingester).
+    """
+    ingester = VisitIngester(groups, ingestfunc)
+    ingester.start()
+
+    def run_when_ready(i):
+        if not ingester.wait_for(shard_visits[i]):
+            return (SKIPPED_STATUS, genwrap_procacct.combine_procinfo([]), None)
+        return runfunc(i, shard_cmdlines[i])
+
+    results = []
+    first = 0
+    if warmup and len(shard_cmdlines) > 1:
+        results.append(run_when_ready(0))
+        first = 1
+    with ThreadPoolExecutor(max_workers=max(1, ncores)) as pool:
+        futures = [pool.submit(run_when_ready, i) for i in range(first, len(shard_cmdlines))]
+        results.extend(fut.result() for fut in futures)
+
+    ingester.join()
+    return results, ingester
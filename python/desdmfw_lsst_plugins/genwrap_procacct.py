@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""Resource accounting for processes launched by the LSST wrapper.
+
+Subprocesses are reaped with os.wait4 so each one has its own rusage.
+Usage is aggregated per wrapper phase (repo ingest, main exec, set-up).
+"""
+
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# same rusage fields intgmisc.run_exec reports
+PROC_FIELDS = ['ru_idrss', 'ru_inblock', 'ru_isrss', 'ru_ixrss',
+               'ru_majflt', 'ru_maxrss', 'ru_minflt', 'ru_msgrcv',
+               'ru_msgsnd', 'ru_nivcsw', 'ru_nsignals', 'ru_nswap',
+               'ru_nvcsw', 'ru_oublock', 'ru_stime', 'ru_utime']
+
+
+def _exitcode(status):
+    """Convert a wait status into a returncode like subprocess does.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def run_exec(cmd, stdout=None, stderr=None):
+    """Run an executable returning (retcode, procinfo) from wait4.
+
+    procinfo has the rusage fields of the child plus its walltime.
+    """
+    start = time.time()
+    subp = subprocess.Popen(cmd.split(), shell=False, stdout=stdout, stderr=stderr)
+    _, status, rusage = os.wait4(subp.pid, 0)
+    walltime = time.time() - start
+
+    retcode = _exitcode(status)
+    subp.returncode = retcode   # already reaped, keep Popen from waiting again
+
+    procinfo = dict((field, getattr(rusage, field)) for field in PROC_FIELDS)
+    procinfo['walltime'] = walltime
+    return retcode, procinfo
+
+
+def combine_procinfo(procinfos):
+    """Combine procinfo of concurrent processes (max of maxrss, sum of rest).
+    """
+    combined = dict((field, 0) for field in PROC_FIELDS)
+    combined['walltime'] = 0.0
+    for procinfo in procinfos:
+        for field in PROC_FIELDS:
+            if field == 'ru_maxrss':
+                combined[field] = max(combined[field], procinfo[field])
+            else:
+                combined[field] += procinfo[field]
+        combined['walltime'] = max(combined['walltime'], procinfo.get('walltime', 0.0))
+    return combined
+
+
+class ProcAccounting(object):
+    """Per-phase aggregate of process resource usage.
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _phase(self, phase):
+        if phase not in self.phases:
+            self.phases[phase] = OrderedDict([('num_procs', 0),
+                                              ('num_failed', 0),
+                                              ('walltime', 0.0),
+                                              ('utime', 0.0),
+                                              ('stime', 0.0),
+                                              ('maxrss', 0),
+                                              ('inblock', 0),
+                                              ('oublock', 0)])
+        return self.phases[phase]
+
+    def add_proc(self, phase, retcode, procinfo):
+        """Add usage of a finished subprocess to phase.
+        """
+        with self.lock:
+            info = self._phase(phase)
+            info['num_procs'] += 1
+            if retcode != 0:
+                info['num_failed'] += 1
+            info['walltime'] += procinfo.get('walltime', 0.0)
+            info['utime'] += procinfo['ru_utime']
+            info['stime'] += procinfo['ru_stime']
+            info['maxrss'] = max(info['maxrss'], procinfo['ru_maxrss'])
+            info['inblock'] += procinfo['ru_inblock']
+            info['oublock'] += procinfo['ru_oublock']
+
+    @contextmanager
+    def inproc(self, phase):
+        """Account work done inside the wrapper process itself (e.g., untar).
+        """
+        start = time.time()
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            yield
+        finally:
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            procinfo = dict((field, getattr(after, field) - getattr(before, field))
+                            for field in PROC_FIELDS)
+            # maxrss is a high water mark, not a counter
+            procinfo['ru_maxrss'] = after.ru_maxrss
+            procinfo['walltime'] = time.time() - start
+            self.add_proc(phase, 0, procinfo)
+
+    def as_dict(self):
+        """Copy of the per-phase totals suitable for the output wcl.
+        """
+        with self.lock:
+            return OrderedDict((phase, OrderedDict(info)) for phase, info in self.phases.items())
+
+    def write_json(self, filename):
+        """Write per-phase totals to a JSON sidecar file.
+        """
+        with open(filename, 'w') as jsonfh:
+            json.dump(self.as_dict(), jsonfh, indent=4)
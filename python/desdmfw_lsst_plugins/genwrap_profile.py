@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""Opt-in profiling of wrapper and plugin entry points.
+
+Entry points are decorated with profiled(name).  Nothing is profiled
+unless enabled, either with environment variables (so framework
+processes running the plugins can be profiled without code edits)
+
+    DESDMFW_LSST_PROFILE       = entry=rate,...  (e.g. perform_metadata_tasks=0.1,transform_inputs)
+                                 'all' or '*' matches every entry point, rate defaults to 1
+    DESDMFW_LSST_PROFILE_DIR   = directory for the output files (default .)
+    DESDMFW_LSST_PROFILE_MODE  = cprofile (default) or sample
+
+or by the wrapper from its wcl (wrapper profile, profile_dir,
+profile_mode), environment taking precedence.
+
+rate is the fraction of calls profiled.  Stats are aggregated per entry
+point across calls and written at exit as <name>.<pid>.pstats (cprofile)
+or <name>.<pid>.collapsed (sample, collapsed stacks for flame graphs).
+"""
+
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from despymisc import miscutils
+
+ENV_PROFILE = 'DESDMFW_LSST_PROFILE'
+ENV_PROFILE_DIR = 'DESDMFW_LSST_PROFILE_DIR'
+ENV_PROFILE_MODE = 'DESDMFW_LSST_PROFILE_MODE'
+
+PROFILE_MODES = ['cprofile', 'sample']
+ALL_ENTRIES = ('all', '*')
+
+SAMPLE_INTERVAL = 0.005
+
+
+def parse_rates(spec):
+    """Convert 'name=rate,name,...' into dict name -> rate.
+    """
+    rates = {}
+    if spec:
+        for entry in miscutils.fwsplit(spec, ','):
+            if '=' in entry:
+                (name, rate) = entry.split('=', 1)
+                rates[name.strip()] = float(rate)
+            elif entry.strip():
+                rates[entry.strip()] = 1.0
+    return rates
+
+
+class _StackSampler(object):
+    """Periodically sample the stacks of threads inside profiled calls.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.active = {}          # thread ident -> stack of entry names (nested profiled calls)
+        self.stacks = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, name):
+        with self.lock:
+            self.active.setdefault(threading.current_thread().ident, []).append(name)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='profile_sampler')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def stop(self):
+        ident = threading.current_thread().ident
+        with self.lock:
+            names = self.active.get(ident)
+            if names:
+                names.pop()
+                if not names:
+                    del self.active[ident]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    continue
+                frames = sys._current_frames()
+                for ident, names in self.active.items():
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append('%s:%s:%s' % (os.path.basename(code.co_filename),
+                                                   code.co_name, frame.f_lineno))
+                        frame = frame.f_back
+                    # a sample inside nested entry points counts for each of them
+                    for name in set(names):
+                        self.stacks[name][';'.join(reversed(stack))] += 1
+
+
+class Profiler(object):
+    """Process-wide profiling state for all entry points.
+    """
+
+    def __init__(self):
+        self.rates = None
+        self.outdir = '.'
+        self.mode = 'cprofile'
+        self.calls = defaultdict(int)
+        self.sampled = defaultdict(int)
+        self.profiles = {}
+        self.sampler = None
+        self.lock = threading.Lock()
+        self.busy = False          # cProfile can only profile one call at a time
+        self.registered = False
+
+    def configure(self, spec=None, outdir=None, mode=None):
+        """Set rates, output directory and mode (environment variables override arguments).
+        """
+        spec = os.environ.get(ENV_PROFILE, spec)
+        self.rates = parse_rates(spec)
+        self.outdir = os.environ.get(ENV_PROFILE_DIR, outdir or '.')
+        self.mode = os.environ.get(ENV_PROFILE_MODE, mode or 'cprofile').lower()
+        if self.mode not in PROFILE_MODES:
+            raise ValueError('Invalid profile mode (%s), must be one of %s' % (self.mode, PROFILE_MODES))
+        if self.rates and not self.registered:
+            atexit.register(self.dump)
+            self.registered = True
+
+    def rate(self, name):
+        if self.rates is None:
+            self.configure()
+        if name in self.rates:
+            return self.rates[name]
+        for allname in ALL_ENTRIES:
+            if allname in self.rates:
+                return self.rates[allname]
+        return 0.0
+
+    def _should_sample(self, name, rate):
+        with self.lock:
+            self.calls[name] += 1
+            # deterministic: profile a call whenever calls * rate crosses an integer
+            if int(self.calls[name] * rate) <= int((self.calls[name] - 1) * rate):
+                return False
+            if self.mode == 'cprofile':
+                if self.busy:
+                    return False
+                self.busy = True
+            self.sampled[name] += 1
+            return True
+
+    def call(self, name, func, args, kwargs):
+        rate = self.rate(name)
+        if rate <= 0 or not self._should_sample(name, rate):
+            return func(*args, **kwargs)
+
+        if self.mode == 'sample':
+            if self.sampler is None:
+                self.sampler = _StackSampler()
+            self.sampler.start(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.sampler.stop()
+
+        import cProfile
+        if name not in self.profiles:
+            self.profiles[name] = cProfile.Profile()
+        prof = self.profiles[name]
+        try:
+            prof.enable()
+        except ValueError:    # another profiler is active (e.g., run under python -m cProfile)
+            with self.lock:
+                self.busy = False
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            prof.disable()
+            with self.lock:
+                self.busy = False
+
+    def dump(self):
+        """Write aggregated stats of every entry point.
+        """
+        if not self.profiles and (self.sampler is None or not self.sampler.stacks):
+            return
+        if not os.path.exists(self.outdir):
+            miscutils.coremakedirs(self.outdir)
+
+        for name, prof in self.profiles.items():
+            outfile = os.path.join(self.outdir, '%s.%s.pstats' % (name, os.getpid()))
+            prof.dump_stats(outfile)
+            miscutils.fwdebug_print("INFO: profiled %s of %s calls of %s, stats in %s" %
+                                    (self.sampled[name], self.calls[name], name, outfile))
+
+        if self.sampler is not None:
+            with self.sampler.lock:
+                for name, stacks in self.sampler.stacks.items():
+                    outfile = os.path.join(self.outdir, '%s.%s.collapsed' % (name, os.getpid()))
+                    with open(outfile, 'w') as outfh:
+                        for stack, count in sorted(stacks.items()):
+                            outfh.write('%s %s\n' % (stack, count))
+                    miscutils.fwdebug_print("INFO: sampled %s of %s calls of %s, stacks in %s" %
+                                            (self.sampled[name], self.calls[name], name, outfile))
+
+
+PROFILER = Profiler()
+
+
+def configure(spec=None, outdir=None, mode=None):
+    """Configure the process-wide profiler (see module docstring).
+    """
+    PROFILER.configure(spec, outdir, mode)
+
+
+def profiled(name):
+    """Decorator making func an entry point that can be profiled as name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return PROFILER.call(name, func, args, kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""Stage only the reference catalog shards a job needs.
+
+LSST indexed reference catalogs are stored as one file per HTM trixel
+(<htm id>.fits) plus config/schema files per catalog directory.  Given
+the job footprint (list of RA/Dec centers plus a radius), compute the
+trixels overlapping it and build a per-job ref_cats directory that only
+links those shards.
+
+The HTM numbering follows lsst.sphgeom.HtmPixelization: root trixels
+S0-S3 are 8-11, N0-N3 are 12-15 and child i of trixel t is 4*t + i.
+Overlap is tested with the bounding circle of each trixel, so the result
+can contain a few extra shards but never misses one.  Positions known
+only as the telescope boresight (RA2000/DEC2000, no WCS) are widened by
+the field of view radius so the outer CCDs are covered.
+"""
+
+import math
+import os
+import re
+
+from despymisc import miscutils
+
+DEFAULT_HTM_DEPTH = 7
+
+# HSC field of view radius (degrees) added around a boresight position
+HSC_FOV_RADIUS = 0.75
+
+SHARD_PAT = re.compile(r'^(\d+)\.fits$')
+DEPTH_PAT = re.compile(r'depth\s*=\s*(\d+)')
+
+_X = (1.0, 0.0, 0.0)
+_Y = (0.0, 1.0, 0.0)
+_Z = (0.0, 0.0, 1.0)
+_NX = (-1.0, 0.0, 0.0)
+_NY = (0.0, -1.0, 0.0)
+_NZ = (0.0, 0.0, -1.0)
+
+ROOT_TRIXELS = [(8, (_X, _NZ, _Y)),     # S0
+                (9, (_Y, _NZ, _NX)),    # S1
+                (10, (_NX, _NZ, _NY)),  # S2
+                (11, (_NY, _NZ, _X)),   # S3
+                (12, (_X, _Z, _NY)),    # N0
+                (13, (_NY, _Z, _NX)),   # N1
+                (14, (_NX, _Z, _Y)),    # N2
+                (15, (_Y, _Z, _X))]     # N3
+
+
+def radec_to_vector(ra, dec):
+    """Unit vector for RA, Dec in degrees.
+    """
+    rar = math.radians(ra)
+    decr = math.radians(dec)
+    return (math.cos(decr) * math.cos(rar), math.cos(decr) * math.sin(rar), math.sin(decr))
+
+
+def _normalize(vec):
+    norm = math.sqrt(vec[0] * vec[0] + vec[1] * vec[1] + vec[2] * vec[2])
+    return (vec[0] / norm, vec[1] / norm, vec[2] / norm)
+
+
+def _midpoint(va, vb):
+    return _normalize((va[0] + vb[0], va[1] + vb[1], va[2] + vb[2]))
+
+
+def _angle(va, vb):
+    dot = va[0] * vb[0] + va[1] * vb[1] + va[2] * vb[2]
+    return math.acos(max(-1.0, min(1.0, dot)))
+
+
+def _children(verts):
+    (v0, v1, v2) = verts
+    w0 = _midpoint(v1, v2)
+    w1 = _midpoint(v0, v2)
+    w2 = _midpoint(v0, v1)
+    return [(v0, w2, w1), (v1, w0, w2), (v2, w1, w0), (w0, w1, w2)]
+
+
+def _bounding_circle(verts):
+    center = _normalize((verts[0][0] + verts[1][0] + verts[2][0],
+                         verts[0][1] + verts[1][1] + verts[2][1],
+                         verts[0][2] + verts[1][2] + verts[2][2]))
+    return center, max(_angle(center, vert) for vert in verts)
+
+
+def htm_ids_in_circle(ra, dec, radius, depth=DEFAULT_HTM_DEPTH):
+    """Return set of HTM ids at depth overlapping the circle (degrees).
+    """
+    center = radec_to_vector(ra, dec)
+    radius = math.radians(radius)
+
+    ids = set()
+    todo = [(htmid, verts, 0) for (htmid, verts) in ROOT_TRIXELS]
+    while todo:
+        (htmid, verts, level) = todo.pop()
+        tcenter, tradius = _bounding_circle(verts)
+        if _angle(center, tcenter) > radius + tradius:
+            continue
+        if level == depth:
+            ids.add(htmid)
+        else:
+            for i, child in enumerate(_children(verts)):
+                todo.append((htmid * 4 + i, child, level + 1))
+    return ids
+
+
+def catalog_depth(catdir):
+    """HTM depth from the catalog's config.py (default 7).
+    """
+    configfile = os.path.join(catdir, 'config.py')
+    if os.path.exists(configfile):
+        with open(configfile, 'r') as cfgfh:
+            match = DEPTH_PAT.search(cfgfh.read())
+            if match:
+                return int(match.group(1))
+    return DEFAULT_HTM_DEPTH
+
+
+def parse_sexagesimal(val, is_ra):
+    """Convert 'hh:mm:ss' (RA) or 'dd:mm:ss' (Dec) strings to degrees.
+    """
+    if not isinstance(val, str) or ':' not in val:
+        return float(val)
+    parts = val.strip().split(':')
+    sign = -1.0 if parts[0].startswith('-') else 1.0
+    degs = abs(float(parts[0])) + float(parts[1]) / 60.0 + float(parts[2]) / 3600.0
+    if is_ra:
+        degs *= 15.0
+    return sign * degs
+
+
+def header_position(fullname):
+    """Return (RA, Dec, margin) in degrees of a file from its header, or None.
+
+    margin is the radius to add to the ccd's own radius: 0 for the WCS
+    reference point, the field of view radius for the boresight.
+    """
+    from astropy.io import fits
+
+    hdunum = 1 if fullname.endswith('.fz') else 0
+    hdr = fits.getheader(fullname, hdunum)
+    if 'CRVAL1' in hdr and 'CRVAL2' in hdr:
+        return float(hdr['CRVAL1']), float(hdr['CRVAL2']), 0.0
+    if 'RA2000' in hdr and 'DEC2000' in hdr:
+        return (parse_sexagesimal(hdr['RA2000'], True), parse_sexagesimal(hdr['DEC2000'], False),
+                HSC_FOV_RADIUS)
+    return None
+
+
+def stage_refcats(rcroot, destroot, positions, radius, linkfunc=os.symlink):
+    """Build destroot with only the shards overlapping positions.
+
+    positions is a list of (ra, dec) or (ra, dec, margin) in degrees,
+    radius (plus margin) in degrees around each.
+    linkfunc(src, dest) makes src available at dest.
+    Returns number of shards staged.
+    """
+    if not os.path.exists(destroot):
+        miscutils.coremakedirs(destroot)
+
+    nshards = 0
+    for catname in sorted(os.listdir(rcroot)):
+        catdir = os.path.join(rcroot, catname)
+        if not os.path.isdir(catdir):
+            continue
+        destcat = os.path.join(destroot, catname)
+        if not os.path.exists(destcat):
+            os.mkdir(destcat)
+
+        # config, schema, etc
+        for fname in os.listdir(catdir):
+            if not SHARD_PAT.match(fname) and not os.path.exists(os.path.join(destcat, fname)):
+                os.symlink(os.path.join(catdir, fname), os.path.join(destcat, fname))
+
+        depth = catalog_depth(catdir)
+        ids = set()
+        for pos in positions:
+            margin = pos[2] if len(pos) > 2 else 0.0
+            ids.update(htm_ids_in_circle(pos[0], pos[1], radius + margin, depth))
+
+        for htmid in sorted(ids):
+            shard = os.path.join(catdir, '%d.fits' % htmid)
+            dest = os.path.join(destcat, '%d.fits' % htmid)
+            if os.path.exists(shard) and not os.path.lexists(dest):
+                linkfunc(shard, dest)
+                nshards += 1
+
+        if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+            miscutils.fwdebug_print("INFO: %s depth %s: %s trixels" % (catname, depth, len(ids)))
+    return nshards
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Read-only queries of a Butler (gen2) job repo registry.
+
+Used to skip re-ingesting inputs that an earlier attempt of the same job
+already registered.
+"""
+
+import os
+import sqlite3
+
+from despymisc import miscutils
+
+REGISTRY_FILENAME = 'registry.sqlite3'
+
+# key types returned by ingested_keys
+KEY_FILENAME = 'filename'
+KEY_VISIT_CCD = 'visit_ccd'
+
+
+def table_columns(conn, table):
+    """Return lowercased column names of table ([] if table doesn't exist).
+    """
+    curs = conn.cursor()
+    curs.execute("select name from sqlite_master where type='table' and name=?", (table,))
+    if curs.fetchone() is None:
+        return []
+    curs.execute('pragma table_info(%s)' % table)
+    return [row[1].lower() for row in curs.fetchall()]
+
+
+def ingested_keys(registry, table='raw'):
+    """Return (keytype, set of keys) already registered in table.
+
+    Keys are filenames if the table has a filename column, otherwise
+    (visit, ccd) tuples.  Returns (None, set()) if nothing can be used.
+    """
+    if not os.path.exists(registry):
+        return None, set()
+
+    conn = sqlite3.connect('file:%s?mode=ro' % registry, uri=True)
+    try:
+        columns = table_columns(conn, table)
+        curs = conn.cursor()
+        if 'filename' in columns:
+            curs.execute('select filename from %s' % table)
+            return KEY_FILENAME, set(os.path.basename(row[0]) for row in curs)
+        elif 'visit' in columns and 'ccd' in columns:
+            curs.execute('select visit, ccd from %s' % table)
+            return KEY_VISIT_CCD, set((int(row[0]), int(row[1])) for row in curs)
+    finally:
+        conn.close()
+
+    if miscutils.fwdebug_check(1, 'GENWRAP_LSST_DEBUG'):
+        miscutils.fwdebug_print("INFO: registry table %s has no usable key columns" % table)
+    return None, set()
+
+
+def hsc_visit_ccd(fullname):
+    """Get (visit, ccd) of an HSC file from its header.
+    """
+    from astropy.io import fits
+    from desdmfw_lsst_plugins.ftmgmt_hsc_raw import FtMgmtHSCRaw
+
+    hdunum = 1 if fullname.endswith('.fz') else 0
+    hdr = fits.getheader(fullname, hdunum)
+    visit = FtMgmtHSCRaw.translate_visit(hdr['EXP-ID'], hdr['FRAMEID'])
+    return visit, int(hdr['DET-ID'])
+
+
+def file_key(fullname, keytype):
+    """Key of a file to compare against ingested_keys.
+    """
+    if keytype == KEY_FILENAME:
+        return os.path.basename(fullname)
+    return hsc_visit_ccd(fullname)
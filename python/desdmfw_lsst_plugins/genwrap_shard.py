@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""Split per_file_cmdline selections into shards and run them concurrently.
+
+All shards write to the same Gen2 output repo, and a task writes the
+repo's config and schema files (and creates the repo) on its first run.
+Concurrent first runs race on those files, so by default the first
+shard runs alone and the others start once it finished.
+"""
+
+import os
+import sys
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from despymisc import miscutils
+from desdmfw_lsst_plugins import genwrap_procacct
+
+SHARD_MODES = ['count', 'visit']
+
+
+def available_cores():
+    """Return number of cores this process is allowed to use.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def split_by_count(fragments, nshards):
+    """Split fragments into at most nshards contiguous groups of near equal size.
+    """
+    nshards = max(1, min(nshards, len(fragments)))
+    base, extra = divmod(len(fragments), nshards)
+
+    groups = []
+    start = 0
+    for i in range(nshards):
+        end = start + base + (1 if i < extra else 0)
+        groups.append(fragments[start:end])
+        start = end
+    return [grp for grp in groups if grp]
+
+
+def group_visits(visits, nshards=None):
+    """Group visits (in order of first appearance) into at most nshards groups.
+
+    Without nshards there is one group per visit.
+    """
+    ordered = list(OrderedDict.fromkeys(visits))
+    if nshards is None or nshards >= len(ordered):
+        return [[visit] for visit in ordered]
+    # near equal number of visits per group, keeping visit order
+    return split_by_count(ordered, nshards)
+
+
+def split_by_visit(fragments, visits, nshards=None):
+    """Split fragments into groups that never split a visit.
+
+    Returns (groups of fragments, groups of visits).
+    """
+    byvisit = OrderedDict()
+    for frag, visit in zip(fragments, visits):
+        byvisit.setdefault(visit, []).append(frag)
+
+    visit_groups = group_visits(visits, nshards)
+    groups = [[frag for visit in vgrp for frag in byvisit[visit]] for vgrp in visit_groups]
+    return groups, visit_groups
+
+
+def run_cmdline(cmdline, logfile):
+    """Run a single shard command line sending stdout/stderr to logfile.
+
+    Returns (retcode, procinfo).
+    """
+    with open(logfile, 'w') as logfh:
+        return genwrap_procacct.run_exec(cmdline, stdout=logfh, stderr=subprocess.STDOUT)
+
+
+def shard_logfile(logprefix, i):
+    """Name of the log file of shard i.
+    """
+    return '%s_%03d.log' % (logprefix, i)
+
+
+def run_shards(cmdlines, ncores, logprefix, warmup=True):
+    """Run shard command lines concurrently using at most ncores processes.
+
+    With warmup the first shard runs alone before the others (see module docstring).
+    Returns list of (retcode, procinfo, logfile) in the same order as cmdlines.
+    """
+    logfiles = [shard_logfile(logprefix, i) for i in range(len(cmdlines))]
+    results = []
+    first = 0
+    if warmup and len(cmdlines) > 1:
+        retcode, procinfo = run_cmdline(cmdlines[0], logfiles[0])
+        results.append((retcode, procinfo, logfiles[0]))
+        first = 1
+    with ThreadPoolExecutor(max_workers=max(1, ncores)) as pool:
+        futures = [pool.submit(run_cmdline, cmd, logf) for cmd, logf in zip(cmdlines[first:], logfiles[first:])]
+        for fut, logf in zip(futures, logfiles[first:]):
+            retcode, procinfo = fut.result()
+            results.append((retcode, procinfo, logf))
+    return results
+
+
+def print_shard_logs(results, prefix):
+    """Copy shard logs to stdout in shard order so output is deterministic.
+    """
+    for i, (retcode, procinfo, logfile) in enumerate(results):
+        print('%s shard %03d (exit %s, %0.2f secs) %s' % (prefix, i, retcode, procinfo['walltime'],
+                                                          '*' * 30))
+        if logfile is None:   # shard was never run
+            continue
+        with open(logfile, 'r') as logfh:
+            for line in logfh:
+                sys.stdout.write(line)
+    sys.stdout.flush()
+
+
+def aggregate_status(retcodes):
+    """Return first non-zero exit code or 0 if all shards succeeded.
+    """
+    for retcode in retcodes:
+        if retcode != 0:
+            return retcode
+    return 0
+
+
+def shard_summary(results, groups):
+    """Per-shard status for the output wcl.
+    """
+    summary = OrderedDict()
+    for i, ((retcode, procinfo, logfile), grp) in enumerate(zip(results, groups)):
+        summary['shard%03d' % i] = {'status': retcode,
+                                    'walltime': procinfo['walltime'],
+                                    'maxrss': procinfo['ru_maxrss'],
+                                    'num_selects': len(grp),
+                                    'log': logfile}
+        if miscutils.fwdebug_check(3, 'GENWRAP_LSST_DEBUG'):
+            miscutils.fwdebug_print('INFO: shard%03d = %s' % (i, summary['shard%03d' % i]))
+    return summary
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Compiled variable substitution for the LSST wrapper.
+
+Patterns are parsed once into literal and variable segments.  Variables
+that come from the wrapper's WCL are resolved once with the normal
+replace functions and cached.  Only values from a per-line searchobj are
+looked up when a pattern is rendered, so building command lines for
+large lists costs about the same as a string join.
+
+Anything the fast path cannot reproduce exactly (variables with
+modifiers, searchobj or WCL values that themselves contain variables or
+would expand into multiple values) falls back to
+repfunc.replace_vars_single.
+"""
+
+import re
+
+from despymisc import miscutils
+from intgutils import intgdefs
+import intgutils.replace_funcs as repfunc
+
+VAR_PAT = re.compile(r'\$\{([^}]+)\}')
+
+# variable names the fast path can handle (no padding/format modifiers)
+SIMPLE_VAR_PAT = re.compile(r'^[\w.]+$')
+
+# characters in a value that replace_vars would treat specially
+SPECIAL_VALUE_PAT = re.compile(r'[$,:]')
+
+
+class CompiledTemplate(object):
+    """Pattern split into literal strings and variable names.
+
+    segments alternates literal, variable, literal, ... starting and
+    ending with a (possibly empty) literal.
+    """
+    __slots__ = ('pattern', 'segments', 'varnames', 'simple')
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.segments = VAR_PAT.split(pattern)
+        self.varnames = self.segments[1::2]
+
+        # other replace syntax ($opt{}, $HEAD{}, $FUNC{}, $LOOP{}, ...) goes to the slow path
+        self.simple = (all(SIMPLE_VAR_PAT.match(name) for name in self.varnames) and
+                       not any('$' in lit for lit in self.segments[0::2]))
+
+
+class TemplateCache(object):
+    """Cache of compiled patterns and resolved WCL variables.
+    """
+
+    def __init__(self, wcl):
+        self.wcl = wcl
+        self.opts = {intgdefs.REPLACE_VARS: True, 'expand': True, 'keepvars': False}
+        self.compiled = {}
+        self.static_vals = {}
+        self.static_results = {}
+
+    def compile(self, pattern):
+        """Return the CompiledTemplate for pattern.
+        """
+        if pattern not in self.compiled:
+            self.compiled[pattern] = CompiledTemplate(pattern)
+        return self.compiled[pattern]
+
+    def static(self, name):
+        """Return value of a variable resolved against the WCL only.
+        """
+        if name not in self.static_vals:
+            self.static_vals[name] = str(repfunc.replace_vars_single('${%s}' % name, self.wcl,
+                                                                     dict(self.opts)))
+        return self.static_vals[name]
+
+    def _slow(self, pattern, searchobj):
+        opts = dict(self.opts)
+        if searchobj is not None:
+            opts['searchobj'] = searchobj
+        return repfunc.replace_vars_single(pattern, self.wcl, opts)
+
+    def replace(self, pattern, searchobj=None):
+        """Equivalent of repfunc.replace_vars_single on the wrapper's WCL.
+        """
+        if not isinstance(pattern, str):
+            return self._slow(pattern, searchobj)
+        if searchobj is None:
+            if pattern not in self.static_results:
+                self.static_results[pattern] = self.render(self.compile(pattern))
+            return self.static_results[pattern]
+        return self.render(self.compile(pattern), searchobj)
+
+    def render(self, tmpl, searchobj=None):
+        """Substitute variables in a compiled template.
+        """
+        if not tmpl.simple:
+            return self._slow(tmpl.pattern, searchobj)
+        if not tmpl.varnames:
+            return tmpl.pattern
+
+        parts = list(tmpl.segments)
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            val = None
+            if searchobj is not None:
+                if name in searchobj:
+                    val = searchobj[name]
+                elif name.lower() in searchobj:
+                    val = searchobj[name.lower()]
+
+            if val is None:
+                # WCL values are resolved without the searchobj, which a
+                # reference left in them (e.g., ${ccd}) may need
+                val = self.static(name)
+            else:
+                val = str(val)
+            if SPECIAL_VALUE_PAT.search(val):
+                if miscutils.fwdebug_check(6, 'GENWRAP_LSST_DEBUG'):
+                    miscutils.fwdebug_print("INFO: slow replace for %s=%s" % (name, val))
+                return self._slow(tmpl.pattern, searchobj)
+            parts[i] = val
+        return ''.join(parts)
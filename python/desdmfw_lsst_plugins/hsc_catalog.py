@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+"""Local catalog of HSC header keywords and derived values for selecting inputs.
+
+Each file's header is read once, classified (see hsc_dispatch) and the
+values are derived with the plugins' own translations (_override_vals of
+the raw, img and calib classes): visit, ccd, field, filter, pointing,
+dateobs and calibdate, plus any other header keywords asked for.  Rows
+are kept in an indexed SQLite file so selecting inputs (e.g., all
+HSC-R raws of a field in a pointing range) is a query instead of a
+filesystem scan.  Headers are read in parallel worker processes and
+files whose mtime and size didn't change since the last build are
+skipped.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from despymisc import miscutils
+from desdmfw_lsst_plugins import hsc_dispatch
+
+# derived value columns (raw/img: visit..dateobs, calib: filter, calibdate, ccd)
+VALUE_COLUMNS = ['visit', 'ccd', 'field', 'filter', 'pointing', 'dateobs', 'calibdate']
+
+COLUMNS = ['fullname', 'filename', 'class', 'mtime', 'filesize'] + VALUE_COLUMNS + ['keywords', 'updated']
+
+# extra header keywords saved by default (json in keywords column)
+DEFAULT_KEYWORDS = ['EXPTIME', 'DATA-TYP', 'OBJECT']
+
+SCHEMA = ["""create table if not exists files (
+    fullname text primary key,
+    filename text not null,
+    class text not null,
+    mtime real not null,
+    filesize integer not null,
+    visit integer,
+    ccd integer,
+    field text,
+    filter text,
+    pointing integer,
+    dateobs text,
+    calibdate text,
+    keywords text,
+    updated real)""",
+          "create index if not exists files_visit on files (visit, ccd)",
+          "create index if not exists files_select on files (class, filter, field, pointing)",
+          "create index if not exists files_calibdate on files (class, calibdate)",
+          "create index if not exists files_filename on files (filename)"]
+
+FITS_SUFFIXES = ('.fits', '.fits.fz')
+
+
+def derive_values(fullname, hdr, fclass):
+    """Return dict of VALUE_COLUMNS values using the class's plugin translations.
+    """
+    from astropy.io import fits
+
+    plugin_class = miscutils.dynamically_load_class(hsc_dispatch.DEFAULT_CLASSNAMES[fclass])
+    hdulist = fits.HDUList([fits.PrimaryHDU(header=hdr)])
+    if fclass == hsc_dispatch.CLASS_CALIB:
+        myvals = plugin_class._override_vals(hdulist, 'Primary', fullname)
+    else:
+        myvals = plugin_class._override_vals(fullname, hdulist, 'Primary')
+
+    values = dict((col, myvals.get(col)) for col in VALUE_COLUMNS)
+    values['dateobs'] = myvals.get('taiobs', hdr.get('DATE-OBS'))
+    if values['ccd'] is not None:
+        values['ccd'] = int(values['ccd'])
+    return values
+
+
+def extract(fullname, keywords=None):
+    """Return (catalog row dict, None) for a file or (None, error message).
+    """
+    try:
+        stat = os.stat(fullname)
+        hdr = hsc_dispatch.read_header(fullname)
+        fclass = hsc_dispatch.classify(hdr)
+        if fclass is None:
+            return None, 'unclassified'
+        row = derive_values(fullname, hdr, fclass)
+    except Exception as exc:
+        return None, '%s: %s' % (type(exc).__name__, exc)
+
+    row.update({'fullname': fullname,
+                'filename': os.path.basename(fullname),
+                'class': fclass,
+                'mtime': stat.st_mtime,
+                'filesize': stat.st_size,
+                'keywords': json.dumps(dict((key, hdr[key]) for key in keywords or DEFAULT_KEYWORDS
+                                            if key in hdr), default=str)})
+    return row, None
+
+
+def _extract_star(args):
+    return extract(*args)
+
+
+def find_files(paths):
+    """Return sorted list of fits files in (or named by) paths.
+    """
+    fullnames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                fullnames.extend(os.path.join(dirpath, fname) for fname in filenames
+                                 if fname.endswith(FITS_SUFFIXES))
+        else:
+            fullnames.append(path)
+    return sorted(fullnames)
+
+
+class HeaderCatalog(object):
+    """SQLite catalog of header keywords and derived values.
+    """
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        dbdir = os.path.dirname(dbfile)
+        if dbdir and not os.path.exists(dbdir):
+            miscutils.coremakedirs(dbdir)
+        self.conn = sqlite3.connect(dbfile, timeout=60)
+        self.conn.row_factory = sqlite3.Row
+        for sql in SCHEMA:
+            self.conn.execute(sql)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def stale(self, fullnames):
+        """Return files that are new or whose mtime or size changed.
+        """
+        known = {}
+        for row in self.conn.execute('select fullname, mtime, filesize from files'):
+            known[row['fullname']] = (row['mtime'], row['filesize'])
+
+        stale = []
+        for fullname in fullnames:
+            try:
+                stat = os.stat(fullname)
+            except OSError:
+                continue
+            if known.get(fullname) != (stat.st_mtime, stat.st_size):
+                stale.append(fullname)
+        return stale
+
+    def update(self, fullnames, nworkers=4, keywords=None, prune=False):
+        """Add new and changed files reading headers in worker processes.
+
+        With prune, rows of files not in fullnames (or no longer existing) are removed.
+        Returns (number of rows written, OrderedDict fullname -> error).
+        """
+        fullnames = list(fullnames)
+        todo = self.stale(fullnames)
+        errors = OrderedDict()
+        rows = []
+        if todo:
+            with ProcessPoolExecutor(max_workers=max(1, nworkers)) as pool:
+                chunksize = max(1, len(todo) // (nworkers * 8))
+                for fullname, (row, error) in zip(todo, pool.map(_extract_star, [(fullname, keywords)
+                                                                                  for fullname in todo],
+                                                                 chunksize=chunksize)):
+                    if row is None:
+                        errors[fullname] = error
+                    else:
+                        rows.append(row)
+
+        now = time.time()
+        with self.conn:
+            self.conn.executemany('insert or replace into files (%s) values (%s)' %
+                                  (','.join(COLUMNS), ','.join('?' * len(COLUMNS))),
+                                  [tuple(row.get(col, now) if col == 'updated' else row.get(col)
+                                         for col in COLUMNS) for row in rows])
+            if prune:
+                keep = set(fullnames)
+                gone = [(row['fullname'],) for row in self.conn.execute('select fullname from files')
+                        if row['fullname'] not in keep or not os.path.exists(row['fullname'])]
+                self.conn.executemany('delete from files where fullname=?', gone)
+
+        if miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
+            miscutils.fwdebug_print("INFO: %s files, %s new or changed, %s errors" %
+                                    (len(fullnames), len(todo), len(errors)))
+        return len(rows), errors
+
+    def query(self, columns=None, order=None, **criteria):
+        """Return list of rows (dicts) matching criteria.
+
+        Each criterion (column=value) is a single value, a list of values
+        or a (low, high) tuple for an inclusive range (None for open ended).
+        """
+        where = []
+        params = []
+        for col, val in sorted(criteria.items()):
+            if col not in COLUMNS:
+                raise ValueError('Invalid catalog column (%s)' % col)
+            if isinstance(val, tuple):
+                (low, high) = val
+                if low is not None:
+                    where.append('"%s" >= ?' % col)
+                    params.append(low)
+                if high is not None:
+                    where.append('"%s" <= ?' % col)
+                    params.append(high)
+            elif isinstance(val, list):
+                where.append('"%s" in (%s)' % (col, ','.join('?' * len(val))))
+                params.extend(val)
+            else:
+                where.append('"%s" = ?' % col)
+                params.append(val)
+
+        columns = columns or COLUMNS
+        for col in list(columns) + list(order or []):
+            if col not in COLUMNS:
+                raise ValueError('Invalid catalog column (%s)' % col)
+        sql = 'select %s from files' % ','.join('"%s"' % col for col in columns)
+        if where:
+            sql += ' where ' + ' and '.join(where)
+        sql += ' order by %s' % ','.join('"%s"' % col for col in (order or ['fullname']))
+
+        results = []
+        for row in self.conn.execute(sql, params):
+            rowdict = OrderedDict(zip(columns, row))
+            if 'keywords' in rowdict and rowdict['keywords'] is not None:
+                rowdict['keywords'] = json.loads(rowdict['keywords'])
+            results.append(rowdict)
+        return results
+
+    def fullnames(self, **criteria):
+        """Return list of fullnames matching criteria (see query).
+        """
+        return [row['fullname'] for row in self.query(columns=['fullname'], **criteria)]
+
+    def counts(self):
+        """Return OrderedDict class -> number of files.
+        """
+        return OrderedDict((row[0], row[1]) for row in
+                           self.conn.execute('select class, count(*) from files group by class order by class'))
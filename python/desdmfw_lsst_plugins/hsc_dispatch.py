@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+"""Classify mixed HSC files from a single header read and route them to their plugin.
+
+Each file's header is read once (ext 1 for tile compressed files),
+classified from its keywords and handed, already parsed, to the
+perform_metadata_tasks of the matching filetype management class:
+
+    calib  CALIB_ID present
+    img    image-product keywords (e.g., FLUXMAG0) present
+    raw    EXP-ID and FRAMEID look like HSC exposure/frame ids
+
+Existence checks are batched: one UNION query over the image and
+calibration tables for all files (see hsc_existence) or, with
+combined_check=False, one has_contents_ingested call per class.  Compressed/uncompressed variants of a
+file are read once (see hsc_pairs).
+"""
+
+import re
+from collections import OrderedDict
+
+from despymisc import miscutils
+from desdmfw_lsst_plugins import hsc_existence
+from desdmfw_lsst_plugins import hsc_fingerprint
+from desdmfw_lsst_plugins import hsc_pairs
+
+CLASS_RAW = 'raw'
+CLASS_IMG = 'img'
+CLASS_CALIB = 'calib'
+CLASSES = [CLASS_CALIB, CLASS_IMG, CLASS_RAW]
+
+DEFAULT_CLASSNAMES = {CLASS_RAW: 'desdmfw_lsst_plugins.ftmgmt_hsc_raw.FtMgmtHSCRaw',
+                      CLASS_IMG: 'desdmfw_lsst_plugins.ftmgmt_hsc_img.FtMgmtHSCImg',
+                      CLASS_CALIB: 'desdmfw_lsst_plugins.ftmgmt_hsc_calib.FtMgmtHSCCalib'}
+
+# keywords written by the LSST stack into processed images but not in raws
+IMG_KEYWORDS = ['FLUXMAG0', 'FLUXMAG0ERR', 'MAGZERO', 'AR_HDU', 'SKYLEVEL']
+
+EXPID_PAT = re.compile(r'^HSC[A-Z]\d{8}$')
+FRAMEID_PAT = re.compile(r'^HSC[A-Z]\d{8}$')
+
+
+def classify(hdr, img_keywords=None):
+    """Return class (calib, img, raw) of a file from its header or None.
+    """
+    if 'CALIB_ID' in hdr:
+        return CLASS_CALIB
+    for keyword in img_keywords or IMG_KEYWORDS:
+        if keyword in hdr:
+            return CLASS_IMG
+    if EXPID_PAT.match(str(hdr.get('EXP-ID', '')).strip()) and \
+       FRAMEID_PAT.match(str(hdr.get('FRAMEID', '')).strip()):
+        return CLASS_RAW
+    return None
+
+
+def read_header_fingerprint(fullname):
+    """Read the header used for classification and metadata plus the file's header fingerprint.
+    """
+    (headers, fprint) = hsc_fingerprint.read_headers(fullname)
+    return hsc_fingerprint.metadata_header(headers), fprint
+
+
+def read_header(fullname):
+    """Read the header used for classification and metadata.
+    """
+    return read_header_fingerprint(fullname)[0]
+
+
+def by_class(classified):
+    """Return OrderedDict class -> list of fullnames.
+    """
+    byclass = OrderedDict()
+    for fullname, entry in classified.items():
+        byclass.setdefault(entry[0], []).append(fullname)
+    return byclass
+
+
+class Dispatcher(object):
+    """Route files to the raw, img or calib plugin after a single header read.
+
+    filetypes is dict class -> framework filetype (classes without a
+    filetype are reported as unclassified).
+    """
+
+    def __init__(self, config, filetypes, dbh=None, classnames=None, img_keywords=None,
+                 combined_check=True):
+        self.config = config
+        self.filetypes = filetypes
+        self.dbh = dbh
+        self.classnames = dict(DEFAULT_CLASSNAMES)
+        if classnames:
+            self.classnames.update(classnames)
+        self.img_keywords = img_keywords
+        self.combined_check = combined_check
+        self.plugins = {}
+
+        # filename -> (source fullname, fullnames) of the last process call
+        self.pair_report = OrderedDict()
+
+    def plugin(self, fclass):
+        """Return (creating once) the plugin instance of a class.
+        """
+        if fclass not in self.plugins:
+            plugin_class = miscutils.dynamically_load_class(self.classnames[fclass])
+            self.plugins[fclass] = plugin_class(self.filetypes[fclass], self.dbh, self.config)
+        return self.plugins[fclass]
+
+    def classify_files(self, fullnames):
+        """Read headers once per compressed/uncompressed group and classify.
+
+        Returns (OrderedDict fullname -> (class, header, fingerprint), OrderedDict fullname -> error).
+        Only the group's source (see hsc_pairs.choose_source) gets a header and fingerprint,
+        others get None.
+        """
+        classified = OrderedDict()
+        errors = OrderedDict()
+        for group in hsc_pairs.group_pairs(fullnames).values():
+            source = hsc_pairs.choose_source(group)
+            try:
+                (hdr, fprint) = read_header_fingerprint(source)
+            except (IOError, OSError, ValueError) as exc:
+                for fullname in group:
+                    errors[fullname] = 'cannot read header: %s' % exc
+                continue
+            fclass = classify(hdr, self.img_keywords)
+            for fullname in group:
+                if fclass is None or fclass not in self.filetypes:
+                    errors[fullname] = 'unclassified (%s)' % fclass
+                else:
+                    if fullname == source:
+                        classified[fullname] = (fclass, hdr, fprint)
+                    else:
+                        classified[fullname] = (fclass, None, None)
+        return classified, errors
+
+    def gather(self, fullnames):
+        """Gather metadata of mixed files.
+
+        Returns (OrderedDict fullname -> (class, filetype, metadata), OrderedDict fullname -> error).
+        """
+        results, errors, _ = self.process(fullnames)
+        return results, errors
+
+    def check_ingested(self, byclass):
+        """Batch existence checks: one query for all classes or one has_contents_ingested per class.
+
+        byclass is dict class -> list of fullnames.  Returns dict fullname -> bool.
+        """
+        if self.combined_check:
+            return hsc_existence.check_classes(self.dbh, byclass)
+
+        ingested = {}
+        for fclass in CLASSES:
+            if byclass.get(fclass):
+                ingested.update(self.plugin(fclass).has_contents_ingested(list(byclass[fclass])))
+        return ingested
+
+    def process(self, fullnames, skip_ingested=False):
+        """Classify, optionally drop already ingested files, and gather metadata.
+
+        Returns (OrderedDict fullname -> (class, filetype, metadata),
+                 OrderedDict fullname -> error, list of skipped fullnames).
+        """
+        classified, errors = self.classify_files(fullnames)
+
+        skipped = []
+        if skip_ingested:
+            ingested = self.check_ingested(by_class(classified))
+            skipped = [fullname for fullname in classified if ingested.get(fullname)]
+            for fullname in skipped:
+                del classified[fullname]
+
+        gathered = {}
+        self.pair_report = OrderedDict()
+        for fclass, classnames in by_class(classified).items():
+            # one call per class so the plugin writes its index/store entries in one batch
+            try:
+                metadata = self._gather_class(fclass, classnames, classified)
+            except Exception:
+                # redo group by group to report which files failed
+                metadata = {}
+                for group in hsc_pairs.group_pairs(classnames).values():
+                    try:
+                        metadata.update(self._gather_class(fclass, group, classified))
+                    except Exception as exc:
+                        for fullname in group:
+                            errors[fullname] = '%s: %s' % (type(exc).__name__, exc)
+            for fullname in classnames:
+                if fullname in metadata:
+                    gathered[fullname] = (fclass, self.filetypes[fclass], metadata[fullname])
+
+        results = OrderedDict((fullname, gathered[fullname]) for fullname in classified if fullname in gathered)
+        return results, errors, skipped
+
+    def _gather_class(self, fclass, fullnames, classified):
+        """gather_pairs of the class plugin with the headers and fingerprints already read.
+        """
+        headers = dict((fullname, classified[fullname][1]) for fullname in fullnames
+                       if classified[fullname][1] is not None)
+        fprints = dict((fullname, classified[fullname][2]) for fullname in fullnames
+                       if classified[fullname][2] is not None)
+        metadata, report = self.plugin(fclass).gather_pairs(fullnames, False, None, headers=headers,
+                                                            fingerprints=fprints)
+        self.pair_report.update(report)
+        return metadata
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""Existence check of HSC files against several tables in one database round trip.
+
+The has_contents_ingested of each plugin loads the filename GTT, joins
+against its own table (image for raw and img, calibration for calib)
+and empties the GTT again.  For a mixed batch check_tables loads the GTT
+once with every filename and answers against all tables with a single
+UNION query, returning the tables each file is in.
+
+SqliteDbh is a small stand-in for the DESDM database handle (only what
+the check uses) for testing without a database.
+"""
+
+import sqlite3
+from collections import OrderedDict
+
+import despydmdb.dmdb_defs as dmdbdefs
+from desdmfw_lsst_plugins import hsc_pairs
+
+TABLE_IMAGE = 'image'
+TABLE_CALIBRATION = 'calibration'
+
+# table holding the ingested contents of each hsc_dispatch class
+CLASS_TABLES = OrderedDict([('calib', TABLE_CALIBRATION),
+                            ('img', TABLE_IMAGE),
+                            ('raw', TABLE_IMAGE)])
+
+
+def check_tables(dbh, listfullnames, tables=None):
+    """Return OrderedDict fullname -> list of tables having a row for the file.
+
+    Compressed and uncompressed variants share their filename's answer.
+    """
+    assert isinstance(listfullnames, list)
+    if tables is None:
+        tables = sorted(set(CLASS_TABLES.values()))
+
+    byfilename = hsc_pairs.group_pairs(listfullnames)
+    results = OrderedDict((fname, []) for fname in listfullnames)
+    if not byfilename or not tables:
+        return results
+
+    dbh.empty_gtt(dmdbdefs.DB_GTT_FILENAME)
+    dbh.load_filename_gtt(list(byfilename.keys()))
+
+    dbq = ' union '.join(["select '%s', r.filename from %s r, %s g where r.filename=g.filename" %
+                          (table, table, dmdbdefs.DB_GTT_FILENAME) for table in tables])
+    curs = dbh.cursor()
+    curs.execute(dbq)
+    for (table, filename) in curs:
+        for fname in byfilename[filename]:
+            if table not in results[fname]:
+                results[fname].append(table)
+
+    dbh.empty_gtt(dmdbdefs.DB_GTT_FILENAME)
+
+    for tablelist in results.values():
+        tablelist.sort()
+    return results
+
+
+def check_classes(dbh, byclass):
+    """Combined has_contents_ingested for files of several classes.
+
+    byclass is dict class -> list of fullnames.  Returns dict fullname -> bool.
+    """
+    allnames = []
+    for fclass in byclass:
+        allnames.extend(byclass[fclass])
+    tables = sorted(set(CLASS_TABLES[fclass] for fclass in byclass if byclass[fclass]))
+    membership = check_tables(dbh, allnames, tables)
+
+    ingested = {}
+    for fclass in byclass:
+        for fname in byclass[fclass]:
+            ingested[fname] = CLASS_TABLES[fclass] in membership[fname]
+    return ingested
+
+
+class SqliteDbh(object):
+    """SQLite stand-in for the DESDM database handle (GTT methods and cursor only).
+    """
+
+    def __init__(self, dbfile=':memory:'):
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.execute('create temp table if not exists %s (filename text, compression text)' %
+                          dmdbdefs.DB_GTT_FILENAME)
+        # count of empty_gtt/load_filename_gtt/execute calls
+        self.round_trips = 0
+
+    def create_tables(self, tables=None):
+        """Create minimal (filename only) tables to load test rows into.
+        """
+        for table in tables or sorted(set(CLASS_TABLES.values())):
+            self.conn.execute('create table if not exists %s (filename text primary key)' % table)
+
+    def insert_filenames(self, table, filenames):
+        with self.conn:
+            self.conn.executemany('insert or replace into %s (filename) values (?)' % table,
+                                  [(filename,) for filename in filenames])
+
+    def cursor(self):
+        return _CountingCursor(self)
+
+    def empty_gtt(self, tablename):
+        self.round_trips += 1
+        self.conn.execute('delete from %s' % tablename)
+
+    def load_filename_gtt(self, filelist):
+        """Load list of filenames (or dicts with filename and compression) into the GTT.
+        """
+        self.round_trips += 1
+        rows = []
+        for fname in filelist:
+            if isinstance(fname, dict):
+                rows.append((fname['filename'], fname.get('compression', None)))
+            else:
+                rows.append((fname, None))
+        self.conn.executemany('insert into %s (filename, compression) values (?, ?)' %
+                              dmdbdefs.DB_GTT_FILENAME, rows)
+        return dmdbdefs.DB_GTT_FILENAME
+
+    def close(self):
+        self.conn.close()
+
+
+class _CountingCursor(object):
+    def __init__(self, dbh):
+        self.dbh = dbh
+        self.curs = dbh.conn.cursor()
+
+    def execute(self, sql, params=()):
+        self.dbh.round_trips += 1
+        self.curs.execute(sql, params)
+        return self
+
+    def __iter__(self):
+        return iter(self.curs)
+
+    def fetchall(self):
+        return self.curs.fetchall()
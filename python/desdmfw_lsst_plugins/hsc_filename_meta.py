@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""Derive HSC raw metadata from the filename (frame ID) without opening the file.
+
+HSC raw files are named after their FRAMEID, e.g. HSCA90333412.fits:
+letter A, 6 digit exposure number 903334 and 2 digit frame index 12.  The
+CCDs of one visit are spread over an even and the following odd
+exposure number, so visit comes from the exposure number the same way
+translate_visit does (odd numbers belong to the previous even one).  The
+CCD needs a map from (exposure parity, frame index) to DET-ID given in
+a text file with one "<parity*100 + frame index> <ccd>" pair per line.
+
+Since 2016-06-14 EXP-ID is HSCE<8 digits> and translate_visit uses those
+digits as visit, which can't be derived from the frame ID.  Callers give
+the last exposure number of the old scheme (max_expnum), later frames
+are left to the header.
+"""
+
+import os
+import re
+from collections import OrderedDict
+
+FRAME_PAT = re.compile(r'^(HSC([A-Z])(\d{6})(\d{2}))\.fits(\.fz)?$')
+
+# metadata keys (lowercase) that can be derived from the filename
+DERIVED_KEYS = ('visit', 'ccd', 'frameid')
+
+
+def read_ccd_map(mapfile):
+    """Read frame index -> ccd map file.
+    """
+    ccdmap = {}
+    with open(mapfile, 'r') as mapfh:
+        for line in mapfh:
+            line = line.split('#')[0].strip()
+            if line:
+                (frameidx, ccd) = line.split()[:2]
+                ccdmap[int(frameidx)] = int(ccd)
+    return ccdmap
+
+
+def parse_frame(filename):
+    """Return (frameid, letter, expnum, frame index) from a raw filename or None.
+    """
+    match = FRAME_PAT.match(os.path.basename(filename))
+    if not match:
+        return None
+    return match.group(1), match.group(2), int(match.group(3)), int(match.group(4))
+
+
+def derive_values(filename, ccdmap, max_expnum):
+    """Return dict of DERIVED_KEYS values or None if filename can't be used.
+
+    Frames with exposure numbers above max_expnum (HSCE EXP-ID scheme) can't be used.
+    """
+    frame = parse_frame(filename)
+    if frame is None:
+        return None
+    (frameid, letter, expnum, frameidx) = frame
+    if expnum > max_expnum:
+        return None
+    ccd = ccdmap.get((expnum % 2) * 100 + frameidx)
+    if ccd is None:
+        return None
+
+    visit = expnum - (expnum % 2)
+    return {'visit': visit + 1000000 * (ord(letter) - ord('A')),
+            'ccd': ccd,
+            'frameid': frameid}
+
+
+def requested_keys(metadefs):
+    """Return set of lowercase header-derived (h, c, p) keys in a filetype metadata definition.
+    """
+    keys = set()
+    for hddict in metadefs['hdus'].values():
+        for status_sect in hddict.values():
+            for kind in ('h', 'c', 'p'):
+                if kind in status_sect:
+                    keys.update(key.lower() for key in status_sect[kind].keys())
+    return keys
+
+
+def can_derive(metadefs):
+    """Whether every header-derived key of the filetype can come from the filename.
+    """
+    return requested_keys(metadefs) <= set(DERIVED_KEYS)
+
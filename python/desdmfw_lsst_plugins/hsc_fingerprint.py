@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""Fingerprints of FITS header blocks for incremental re-ingest.
+
+A fingerprint is the sha1 of the raw header blocks of a file: the
+primary header and, for tile compressed (.fz) files, the header of the
+compressed image.  Only the 2880 byte header blocks are read (the data
+is skipped with a seek), so fingerprinting is much cheaper than
+gathering metadata.  Fingerprints are kept with the gathered metadata in
+a local SQLite store so a later campaign can find the files whose
+headers changed since the last ingest.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from despymisc import miscutils
+
+# store used by the raw and calib plugins (also config key hsc_fingerprint_store)
+ENV_FINGERPRINT_STORE = 'DESDMFW_LSST_FINGERPRINT_STORE'
+
+FITS_BLOCK = 2880
+FITS_CARD = 80
+
+# stop looking for END after this many blocks
+MAX_HEADER_BLOCKS = 1000
+
+# structural (or per HDU) primary cards not copied by metadata_header
+PRIMARY_ONLY_KEYS = ('SIMPLE', 'BITPIX', 'NAXIS', 'EXTEND', 'PCOUNT', 'GCOUNT', 'CHECKSUM', 'DATASUM',
+                     'COMMENT', 'HISTORY', '', 'END')
+
+STATUS_NEW = 'new'
+STATUS_CHANGED = 'changed'
+
+SCHEMA = """create table if not exists fingerprints (
+    filename text primary key,
+    fullname text,
+    fingerprint text not null,
+    metadata text,
+    updated real)"""
+
+
+def _card_int(card):
+    return int(card[10:].split(b'/')[0].strip())
+
+
+def read_header_blocks(infh):
+    """Read header blocks at the current position.
+
+    Returns (header bytes, size in bytes of the data that follows).
+    """
+    header = b''
+    values = {}
+    while True:
+        block = infh.read(FITS_BLOCK)
+        if len(block) < FITS_BLOCK:
+            raise ValueError('Truncated FITS header')
+        header += block
+        for offset in range(0, FITS_BLOCK, FITS_CARD):
+            card = block[offset:offset + FITS_CARD]
+            keyword = card[:8].strip()
+            if keyword in (b'BITPIX', b'NAXIS', b'PCOUNT', b'GCOUNT') or \
+               (keyword.startswith(b'NAXIS') and keyword[5:].isdigit()):
+                values[keyword] = _card_int(card)
+            elif keyword == b'END':
+                naxis = values.get(b'NAXIS', 0)
+                datasize = 0
+                if naxis > 0:
+                    datasize = 1
+                    for axis in range(1, naxis + 1):
+                        datasize *= values.get(b'NAXIS%d' % axis, 0)
+                    datasize = abs(values.get(b'BITPIX', 8)) // 8 * values.get(b'GCOUNT', 1) * \
+                        (datasize + values.get(b'PCOUNT', 0))
+                return header, datasize
+        if len(header) > MAX_HEADER_BLOCKS * FITS_BLOCK:
+            raise ValueError('No END card in FITS header')
+
+
+def read_headers(fullname):
+    """Read the primary header blocks (plus ext 1 header blocks of .fz files).
+
+    Returns (list of header bytes, fingerprint) so callers parsing the
+    headers don't need to read the file again for the fingerprint.
+    """
+    headers = []
+    sha = hashlib.sha1()
+    with open(fullname, 'rb') as infh:
+        header, datasize = read_header_blocks(infh)
+        headers.append(header)
+        sha.update(header)
+        if fullname.endswith('.fz'):
+            # data is padded to a whole number of blocks
+            infh.seek((datasize + FITS_BLOCK - 1) // FITS_BLOCK * FITS_BLOCK, os.SEEK_CUR)
+            header, _ = read_header_blocks(infh)
+            headers.append(header)
+            sha.update(header)
+    return headers, sha.hexdigest()
+
+
+def fingerprint(fullname):
+    """sha1 of the primary header blocks (plus ext 1 header blocks of .fz files).
+    """
+    return read_headers(fullname)[1]
+
+
+def parse_header(header):
+    """Convert header bytes from read_headers into an astropy Header.
+    """
+    from astropy.io import fits
+
+    return fits.Header.fromstring(header.decode('ascii', 'replace'))
+
+
+def metadata_header(headers):
+    """Parse header bytes from read_headers into the header carrying the file's metadata.
+
+    For .fz files that is the compressed image header plus the cards only
+    in the primary (a primary without data keeps the metadata, e.g., Gen2
+    calexps compressed by genwrap_compress).
+    """
+    hdr = parse_header(headers[-1])
+    if len(headers) > 1:
+        for card in parse_header(headers[0]).cards:
+            if card.keyword in PRIMARY_ONLY_KEYS or card.keyword.startswith('NAXIS') or \
+               card.keyword in hdr:
+                continue
+            hdr.append(card)
+    return hdr
+
+
+def read_metadata_header(fullname):
+    """Read the header carrying the file's metadata (see metadata_header).
+    """
+    return metadata_header(read_headers(fullname)[0])
+
+
+def store_key(fullname):
+    """Key of a file in the store (filename without path).
+    """
+    return os.path.basename(fullname)
+
+
+class FingerprintStore(object):
+    """Local SQLite store of filename -> fingerprint and metadata.
+    """
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        dbdir = os.path.dirname(dbfile)
+        if dbdir and not os.path.exists(dbdir):
+            miscutils.coremakedirs(dbdir)
+
+        # one connection per thread (a store may be used by several threads),
+        # sqlite's file locking serializes the writes
+        self._local = threading.local()
+        self.conn.execute(SCHEMA)
+        self.conn.commit()
+
+    @property
+    def conn(self):
+        """Connection of the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.dbfile, timeout=60)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close the connection of the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def put_many(self, entries):
+        """Save list of (fullname, fingerprint, metadata or None) in one transaction.
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.executemany('insert or replace into fingerprints values (?, ?, ?, ?, ?)',
+                                  [(store_key(fullname), fullname, fprint,
+                                    None if metadata is None else json.dumps(metadata, default=str), now)
+                                   for (fullname, fprint, metadata) in entries])
+
+    def put(self, fullname, fprint, metadata=None):
+        self.put_many([(fullname, fprint, metadata)])
+
+    def get_many(self, fullnames):
+        """Return dict fullname -> stored fingerprint for the files in the store.
+        """
+        bykey = OrderedDict((store_key(fullname), fullname) for fullname in fullnames)
+        keys = list(bykey.keys())
+        results = {}
+        # chunk to stay below sqlite's limit on bound variables
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            curs = self.conn.execute('select filename, fingerprint from fingerprints where filename in (%s)' %
+                                     ','.join('?' * len(chunk)), chunk)
+            for (filename, fprint) in curs:
+                results[bykey[filename]] = fprint
+        return results
+
+    def get_metadata(self, fullname):
+        """Return metadata saved with the fingerprint or None.
+        """
+        row = self.conn.execute('select metadata from fingerprints where filename=?',
+                                (store_key(fullname),)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0], object_pairs_hook=OrderedDict)
+
+
+def fingerprint_files(fullnames, nworkers=4):
+    """Return list of fingerprints (same order as fullnames) computed in parallel.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, nworkers)) as pool:
+        return list(pool.map(fingerprint, fullnames))
+
+
+def diff(fullnames, store, nworkers=4):
+    """Return OrderedDict fullname -> (status, fingerprint) of new or changed files only.
+    """
+    fullnames = list(fullnames)
+    stored = store.get_many(fullnames)
+    changed = OrderedDict()
+    for fullname, fprint in zip(fullnames, fingerprint_files(fullnames, nworkers)):
+        if fullname not in stored:
+            changed[fullname] = (STATUS_NEW, fprint)
+        elif stored[fullname] != fprint:
+            changed[fullname] = (STATUS_CHANGED, fprint)
+    return changed
+
+
+def store_from_config(config):
+    """FingerprintStore named by environment or config (hsc_fingerprint_store), or None.
+    """
+    dbfile = os.environ.get(ENV_FINGERPRINT_STORE, None)
+    if dbfile is None and config is not None and 'hsc_fingerprint_store' in config:
+        dbfile = config['hsc_fingerprint_store']
+    if not dbfile:
+        return None
+    return FingerprintStore(dbfile)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+"""Long-lived local service gathering file metadata with warm plugin instances.
+
+The service loads the filetype config and imports astropy and the
+filetype management classes once, then answers batch requests over a
+Unix socket so short-lived framework processes don't pay that start-up
+cost for every call.
+
+Protocol (JSON, one object per line):
+
+    request:   {"filetype": "raw_hsc", "fullnames": ["/path/a.fits", ...]}
+               optionally "class": "desdmfw_lsst_plugins.ftmgmt_hsc_raw.FtMgmtHSCRaw"
+    responses: {"fullname": "/path/a.fits", "metadata": {...}}
+               {"fullname": "/path/b.fits", "error": "..."}
+               ...
+               {"done": true, "count": 2}
+
+    {"cmd": "ping"} -> {"pong": true, "pid": ...}
+    {"cmd": "shutdown"} -> {"shutdown": true}
+
+Results of a request are streamed in request order.  A request is split
+into chunks gathered on a shared worker pool with gather_pairs (one
+header read per compressed/uncompressed pair, local index writes batched
+per chunk).  Every worker thread has its own plugin instances, so
+plugins and their local SQLite stores are never shared between threads.
+Preloaded filetypes get their instances in every worker thread before
+the first request is served.  The service exits after idle_timeout
+seconds without requests.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from despymisc import miscutils
+
+DEFAULT_IDLE_TIMEOUT = 600
+DEFAULT_WORKERS = 4
+
+# max files of a request gathered together by one worker
+MAX_CHUNK = 50
+
+# filetype management class used for a filetype if none in request or class map
+DEFAULT_CLASS = 'desdmfw_lsst_plugins.ftmgmt_hsc_raw.FtMgmtHSCRaw'
+
+
+def parse_class_map(mapstr):
+    """Convert 'filetype=module.Class,...' into dict.
+    """
+    classmap = {}
+    if mapstr:
+        for entry in miscutils.fwsplit(mapstr, ','):
+            (filetype, classname) = entry.split('=', 1)
+            classmap[filetype.strip()] = classname.strip()
+    return classmap
+
+
+def read_config(configfile):
+    """Read filetype config (filetype_metadata, file_header_info) from a wcl file.
+    """
+    from intgutils.wcl import WCL
+
+    config = WCL()
+    with open(configfile, 'r') as cfgfh:
+        config.read(cfgfh, filename=configfile)
+    return config
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Handle JSON-lines requests on one client connection.
+    """
+
+    def handle(self):
+        try:
+            self._handle_lines()
+        except (BrokenPipeError, ConnectionResetError):
+            # client went away (e.g., stopped reading after an error)
+            pass
+
+    def _handle_lines(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            self.server.service.touch()
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError as exc:
+                self._send({'error': 'invalid request: %s' % exc})
+                continue
+
+            cmd = request.get('cmd', 'metadata')
+            if cmd == 'ping':
+                self._send({'pong': True, 'pid': os.getpid()})
+            elif cmd == 'shutdown':
+                self._send({'shutdown': True})
+                self.server.service.stop()
+                return
+            elif cmd == 'metadata':
+                self._send_metadata(request)
+            else:
+                self._send({'error': 'unknown cmd %s' % cmd})
+
+    def _send(self, obj):
+        self.wfile.write((json.dumps(obj, default=str) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_metadata(self, request):
+        service = self.server.service
+        filetype = request.get('filetype')
+        try:
+            classname = service.plugin_classname(filetype, request.get('class'))
+        except Exception as exc:
+            self._send({'error': 'cannot load plugin class for %s: %s' % (filetype, exc)})
+            self._send({'done': True, 'count': 0})
+            return
+
+        fullnames = request.get('fullnames', [])
+        futures = [service.pool.submit(service.gather_chunk, filetype, classname, chunk)
+                   for chunk in service.chunks(fullnames)]
+        for fut in futures:
+            for (fullname, metadata, error) in fut.result():
+                if error is None:
+                    self._send({'fullname': fullname, 'metadata': metadata})
+                else:
+                    self._send({'fullname': fullname, 'error': error})
+            service.touch()
+        self._send({'done': True, 'count': len(fullnames)})
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetadataService(object):
+    """Unix socket server owning preinitialized filetype plugin instances.
+    """
+
+    def __init__(self, socket_path, config, classmap=None, workers=DEFAULT_WORKERS,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.socket_path = socket_path
+        self.config = config
+        self.classmap = classmap or {}
+        self.idle_timeout = idle_timeout
+        self.workers = max(1, workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        # plugin instances of the current (worker) thread
+        self._local = threading.local()
+        self.classes = {}
+        self.class_lock = threading.Lock()
+        self.last_used = time.time()
+        self.server = None
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def plugin_classname(self, filetype, classname=None):
+        """Return class name used for filetype, importing the class once.
+        """
+        if classname is None:
+            classname = self.classmap.get(filetype, DEFAULT_CLASS)
+        with self.class_lock:
+            if classname not in self.classes:
+                self.classes[classname] = miscutils.dynamically_load_class(classname)
+        return classname
+
+    def get_plugin(self, filetype, classname=None):
+        """Return (creating once per thread) the calling thread's plugin instance for filetype.
+        """
+        classname = self.plugin_classname(filetype, classname)
+        plugins = self._local.__dict__.setdefault('plugins', {})
+        if (filetype, classname) not in plugins:
+            plugins[(filetype, classname)] = self.classes[classname](filetype, None, self.config)
+            miscutils.fwdebug_print("INFO: initialized %s for %s" % (classname, filetype))
+        return plugins[(filetype, classname)]
+
+    def chunks(self, fullnames):
+        """Split a request's files into chunks for the workers (at most MAX_CHUNK files each).
+        """
+        size = min(MAX_CHUNK, max(1, (len(fullnames) + self.workers - 1) // self.workers))
+        return [fullnames[i:i + size] for i in range(0, len(fullnames), size)]
+
+    def gather_chunk(self, filetype, classname, fullnames):
+        """Metadata of files as list of (fullname, plain dict or None, error or None).
+
+        Runs in a worker thread with that thread's plugin instance.
+        """
+        try:
+            plugin = self.get_plugin(filetype, classname)
+        except Exception as exc:
+            error = 'cannot initialize plugin for %s: %s' % (filetype, exc)
+            return [(fullname, None, error) for fullname in fullnames]
+
+        if hasattr(plugin, 'gather_pairs'):
+            try:
+                results, _ = plugin.gather_pairs(list(fullnames))
+                return [(fullname, OrderedDict(results[fullname]), None) for fullname in fullnames]
+            except Exception:
+                # redo file by file to report which files failed
+                pass
+
+        gathered = []
+        for fullname in fullnames:
+            try:
+                gathered.append((fullname, self.gather(plugin, fullname), None))
+            except Exception as exc:
+                gathered.append((fullname, None, '%s: %s' % (type(exc).__name__, exc)))
+        return gathered
+
+    @classmethod
+    def gather(cls, plugin, fullname):
+        """Metadata of a single file as a plain dict.
+        """
+        return OrderedDict(plugin.perform_metadata_tasks(fullname, False, None))
+
+    def preload(self, filetypes):
+        """Create the plugin instances for filetypes in every worker thread before serving.
+
+        Raises the first error initializing a plugin.
+        """
+        # every task waits for the others, so each runs in its own worker thread
+        barrier = threading.Barrier(self.workers)
+
+        def init_worker():
+            try:
+                for filetype in filetypes:
+                    self.get_plugin(filetype)
+            finally:
+                barrier.wait()
+
+        for fut in [self.pool.submit(init_worker) for _ in range(self.workers)]:
+            fut.result()
+
+    def _watch_idle(self):
+        while self.server is not None:
+            time.sleep(min(5.0, max(0.1, self.idle_timeout / 10.0)))
+            if self.idle_timeout > 0 and time.time() - self.last_used > self.idle_timeout:
+                miscutils.fwdebug_print("INFO: idle for %s secs, shutting down" % self.idle_timeout)
+                self.stop()
+                return
+
+    def serve(self):
+        """Serve requests until shutdown or idle timeout.
+        """
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)   # stale socket from an earlier service
+        self.server = _UnixServer(self.socket_path, _RequestHandler)
+        self.server.service = self
+        os.chmod(self.socket_path, 0o600)
+        self.touch()
+
+        watcher = threading.Thread(target=self._watch_idle, name='idle_watcher')
+        watcher.daemon = True
+        watcher.start()
+
+        miscutils.fwdebug_print("INFO: metadata service listening on %s" % self.socket_path)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.server = None
+            self.pool.shutdown(wait=False)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def stop(self):
+        """Stop serving (can be called from a handler or the idle watcher).
+        """
+        server = self.server
+        if server is not None:
+            threading.Thread(target=server.shutdown).start()
+
+
+class MetadataClient(object):
+    """Client shim for the metadata service.
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, request):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        try:
+            sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+            for line in sock.makefile('rb'):
+                yield json.loads(line.decode('utf-8'))
+        finally:
+            sock.close()
+
+    def is_running(self):
+        """Whether a service is answering on the socket.
+        """
+        try:
+            return any(resp.get('pong') for resp in self._request({'cmd': 'ping'}))
+        except (OSError, ValueError):
+            return False
+
+    def shutdown(self):
+        for _ in self._request({'cmd': 'shutdown'}):
+            break
+
+    def iter_metadata(self, filetype, fullnames, classname=None):
+        """Yield (fullname, metadata, error) in the order of fullnames.
+        """
+        request = {'filetype': filetype, 'fullnames': list(fullnames)}
+        if classname is not None:
+            request['class'] = classname
+        for resp in self._request(request):
+            if resp.get('done'):
+                return
+            if 'fullname' not in resp:
+                raise RuntimeError(resp.get('error', 'invalid response %s' % resp))
+            yield resp['fullname'], resp.get('metadata'), resp.get('error')
+
+    def get_metadata(self, filetype, fullnames, classname=None):
+        """Return OrderedDict fullname -> metadata, raising on the first error.
+        """
+        results = OrderedDict()
+        for (fullname, metadata, error) in self.iter_metadata(filetype, fullnames, classname):
+            if error is not None:
+                raise RuntimeError('Metadata service failed on %s: %s' % (fullname, error))
+            results[fullname] = metadata
+        return results
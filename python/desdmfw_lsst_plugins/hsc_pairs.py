@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""Compressed/uncompressed pair awareness for batch metadata gathering.
+
+Archive areas often hold both variants of a file (e.g., HSCA90333412.fits
+and HSCA90333412.fits.fz in mirrored directories).  They have the same
+metadata, so files are grouped by filename (without compression
+extension), metadata is gathered once from the cheaper variant (the
+uncompressed file whose primary header comes first, otherwise the .fz
+whose image header follows an empty primary) and fanned out to every
+name in the group.
+"""
+
+import threading
+from collections import OrderedDict
+
+from despymisc import miscutils
+
+
+def split_fullname(fullname):
+    """Return (filename without compression extension, compression or None).
+    """
+    (filename, compression) = miscutils.parse_fullname(fullname, miscutils.CU_PARSE_FILENAME |
+                                                       miscutils.CU_PARSE_COMPRESSION)
+    return filename, compression
+
+
+def group_pairs(fullnames):
+    """Return OrderedDict filename -> list of fullnames (first seen order).
+    """
+    groups = OrderedDict()
+    for fullname in fullnames:
+        groups.setdefault(split_fullname(fullname)[0], []).append(fullname)
+    return groups
+
+
+def choose_source(fullnames):
+    """Return the fullname to read metadata from (first uncompressed, else first).
+    """
+    for fullname in fullnames:
+        if split_fullname(fullname)[1] is None:
+            return fullname
+    return fullnames[0]
+
+
+def fan_out(metadata, fullname):
+    """Return copy of metadata with per-name values set for fullname.
+    """
+    newmeta = OrderedDict(metadata)
+    (filename, compression) = split_fullname(fullname)
+    if 'filename' in newmeta:
+        newmeta['filename'] = filename
+    if 'compression' in newmeta:
+        newmeta['compression'] = compression
+    if 'fullname' in newmeta:
+        newmeta['fullname'] = fullname
+    return newmeta
+
+
+class PairBatchMixin(object):
+    """Batch metadata gathering for filetype management classes (mixed in before FtMgmtGenFits).
+    """
+
+    def gather_pairs(self, listfullnames, do_update=False, update_info=None, headers=None,
+                     fingerprints=None):
+        """Gather metadata once per compressed/uncompressed group.
+
+        headers is optional dict fullname -> already read header (see hsc_dispatch)
+        and fingerprints dict fullname -> header fingerprint of those files.
+        Headers are updated per file, so with do_update every name is read.
+        Returns (OrderedDict fullname -> metadata,
+                 OrderedDict filename -> (source fullname, list of fullnames)).
+        """
+        assert isinstance(listfullnames, list)
+        headers = headers or {}
+        fingerprints = fingerprints or {}
+
+        self._begin_batch()
+        try:
+            results, report = self._gather_groups(listfullnames, do_update, update_info, headers,
+                                                  fingerprints)
+        finally:
+            self._end_batch()
+
+        if miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
+            npaired = sum(1 for (_, fullnames) in report.values() if len(fullnames) > 1)
+            miscutils.fwdebug_print("INFO: %s files, %s metadata reads, %s groups with multiple variants" %
+                                    (len(listfullnames), len(report) if not do_update else len(listfullnames),
+                                     npaired))
+        return results, report
+
+    def _batch_state(self):
+        # per thread, in case a plugin instance is used by several threads
+        return self.__dict__.setdefault('_batch_local', threading.local())
+
+    def _begin_batch(self):
+        """Start collecting index/store writes until _end_batch.
+        """
+        self._batch_state().entries = OrderedDict()
+
+    def _end_batch(self):
+        """Write the collected entries, one _write_batch call per kind.
+        """
+        state = self._batch_state()
+        entries = getattr(state, 'entries', None)
+        state.entries = None
+        for kind, kind_entries in (entries or {}).items():
+            self._write_batch(kind, kind_entries)
+
+    def _batch_add(self, kind, entry):
+        """Write entry of kind now or, inside gather_pairs, with the rest of the batch.
+        """
+        entries = getattr(self._batch_state(), 'entries', None)
+        if entries is None:
+            self._write_batch(kind, [entry])
+        else:
+            entries.setdefault(kind, []).append(entry)
+
+    def _write_batch(self, kind, entries):
+        """Write list of entries of kind (e.g., to a local index), implemented by the plugin.
+        """
+        raise NotImplementedError('No writer for %s entries' % kind)
+
+    def _gather_groups(self, listfullnames, do_update, update_info, headers, fingerprints):
+        results = OrderedDict()
+        report = OrderedDict()
+        for filename, fullnames in group_pairs(listfullnames).items():
+            source = choose_source(fullnames)
+            report[filename] = (source, fullnames)
+            if do_update:
+                for fullname in fullnames:
+                    results[fullname] = self.perform_metadata_tasks(fullname, do_update, update_info,
+                                                                    primary_hdr=headers.get(fullname),
+                                                                    fprint=fingerprints.get(fullname))
+                continue
+
+            metadata = self.perform_metadata_tasks(source, do_update, update_info,
+                                                   primary_hdr=headers.get(source),
+                                                   fprint=fingerprints.get(source))
+            for fullname in fullnames:
+                results[fullname] = metadata if fullname == source else fan_out(metadata, fullname)
+        return results, report
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""Visit-level completeness index of HSC raw files.
+
+Stored in a small local SQLite file.  There is one row per visit with a
+bitmap of the CCDs seen so far, so "is visit N complete?" or "which
+visits of a night are incomplete?" is a single cheap query instead of a
+filename join over every CCD.  The raw filetype plugin adds CCDs as it
+gathers their metadata (see FtMgmtHSCRaw.perform_metadata_tasks).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from despymisc import miscutils
+
+# index file used by the raw plugin (also config key hsc_visit_index)
+ENV_VISIT_INDEX = 'DESDMFW_LSST_VISIT_INDEX'
+
+# HSC has 104 science + 8 focus/guide CCDs
+HSC_NUM_CCDS = 112
+
+BITMAP_BYTES = (HSC_NUM_CCDS + 7) // 8
+
+SCHEMA = """create table if not exists visit_ccds (
+    visit integer primary key,
+    ccd_bits blob not null,
+    nccds integer not null,
+    dateobs text,
+    filter text,
+    updated real)"""
+
+
+def ccds_to_bits(ccds):
+    """Convert iterable of ccd numbers into an int bitmap.
+    """
+    bits = 0
+    for ccd in ccds:
+        bits |= 1 << int(ccd)
+    return bits
+
+
+def bits_to_ccds(bits):
+    """Convert int bitmap into a sorted list of ccd numbers.
+    """
+    ccds = []
+    ccd = 0
+    while bits:
+        if bits & 1:
+            ccds.append(ccd)
+        bits >>= 1
+        ccd += 1
+    return ccds
+
+
+def _to_blob(bits):
+    return sqlite3.Binary(bits.to_bytes(max(BITMAP_BYTES, (bits.bit_length() + 7) // 8), 'little'))
+
+
+def _from_blob(blob):
+    return int.from_bytes(bytes(blob), 'little')
+
+
+def parse_ccd_range(ccdstr):
+    """Convert '0-103,105' into list of ccd numbers.
+    """
+    ccds = []
+    for part in miscutils.fwsplit(ccdstr, ','):
+        if '-' in part:
+            (beg, end) = part.split('-')
+            ccds.extend(range(int(beg), int(end) + 1))
+        else:
+            ccds.append(int(part))
+    return ccds
+
+
+class VisitIndex(object):
+    """Visit -> bitmap of ccds stored in SQLite.
+    """
+
+    def __init__(self, dbfile, expected_ccds=None):
+        self.dbfile = dbfile
+        if expected_ccds is None:
+            expected_ccds = range(HSC_NUM_CCDS)
+        self.expected_bits = ccds_to_bits(expected_ccds)
+
+        dbdir = os.path.dirname(dbfile)
+        if dbdir and not os.path.exists(dbdir):
+            miscutils.coremakedirs(dbdir)
+
+        # one connection per thread (plugins are shared by the metadata service's
+        # worker threads), sqlite's file locking serializes the writes
+        self._local = threading.local()
+        self.conn.execute(SCHEMA)
+        self.conn.execute('create index if not exists visit_ccds_dateobs on visit_ccds (dateobs)')
+
+    @property
+    def conn(self):
+        """Connection of the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.dbfile, timeout=60, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close the connection of the calling thread.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+    def add(self, visit, ccd, dateobs=None, filt=None):
+        """Record a single ccd of a visit.
+        """
+        self.add_many([(visit, ccd, dateobs, filt)])
+
+    def add_many(self, entries):
+        """Record list of (visit, ccd, dateobs, filter) in a single transaction.
+        """
+        byvisit = OrderedDict()
+        for (visit, ccd, dateobs, filt) in entries:
+            if visit not in byvisit:
+                byvisit[visit] = [0, dateobs, filt]
+            byvisit[visit][0] |= 1 << int(ccd)
+            byvisit[visit][1] = byvisit[visit][1] or dateobs
+            byvisit[visit][2] = byvisit[visit][2] or filt
+
+        curs = self.conn.cursor()
+        curs.execute('begin immediate')
+        try:
+            for visit, (bits, dateobs, filt) in byvisit.items():
+                curs.execute('select ccd_bits, dateobs, filter from visit_ccds where visit=?', (visit,))
+                row = curs.fetchone()
+                if row is not None:
+                    bits |= _from_blob(row[0])
+                    dateobs = dateobs or row[1]
+                    filt = filt or row[2]
+                curs.execute('insert or replace into visit_ccds values (?, ?, ?, ?, ?, ?)',
+                             (visit, _to_blob(bits), len(bits_to_ccds(bits)), dateobs, filt, time.time()))
+            curs.execute('commit')
+        except Exception:
+            curs.execute('rollback')
+            raise
+
+    def _row_info(self, row):
+        (visit, blob, nccds, dateobs, filt) = row
+        bits = _from_blob(blob)
+        missing = self.expected_bits & ~bits
+        return OrderedDict([('visit', visit),
+                            ('nccds', nccds),
+                            ('dateobs', dateobs),
+                            ('filter', filt),
+                            ('complete', missing == 0),
+                            ('missing', bits_to_ccds(missing))])
+
+    def status(self, visits):
+        """Return OrderedDict visit -> info (None if visit never seen) in one query.
+        """
+        visits = [int(visit) for visit in visits]
+        results = OrderedDict((visit, None) for visit in visits)
+        curs = self.conn.cursor()
+        # chunk to stay below sqlite's limit on bound variables
+        for i in range(0, len(visits), 500):
+            chunk = visits[i:i + 500]
+            curs.execute('select visit, ccd_bits, nccds, dateobs, filter from visit_ccds '
+                         'where visit in (%s)' % ','.join('?' * len(chunk)), chunk)
+            for row in curs:
+                results[row[0]] = self._row_info(row)
+        return results
+
+    def is_complete(self, visit):
+        info = self.status([visit])[int(visit)]
+        return info is not None and info['complete']
+
+    def visits(self, date_start=None, date_end=None, incomplete_only=False):
+        """Return list of visit infos with dateobs in [date_start, date_end].
+
+        Dates are compared as strings so 'YYYY-MM-DD' works for whole nights.
+        """
+        query = 'select visit, ccd_bits, nccds, dateobs, filter from visit_ccds'
+        where = []
+        args = []
+        if date_start is not None:
+            where.append('dateobs >= ?')
+            args.append(date_start)
+        if date_end is not None:
+            where.append('dateobs <= ?')
+            # whole day given, include any time of that day
+            args.append(date_end + '~' if len(date_end) == 10 else date_end)
+        if where:
+            query += ' where ' + ' and '.join(where)
+        query += ' order by visit'
+
+        results = []
+        for row in self.conn.execute(query, args):
+            info = self._row_info(row)
+            if not incomplete_only or not info['complete']:
+                results.append(info)
+        return results
+
+    def incomplete_visits(self, date_start=None, date_end=None):
+        return self.visits(date_start, date_end, incomplete_only=True)
+
+
+def index_from_config(config):
+    """VisitIndex named by environment or config (hsc_visit_index, hsc_visit_ccds), or None.
+    """
+    dbfile = os.environ.get(ENV_VISIT_INDEX, None)
+    if dbfile is None and config is not None and 'hsc_visit_index' in config:
+        dbfile = config['hsc_visit_index']
+    if not dbfile:
+        return None
+
+    expected = None
+    if config is not None and 'hsc_visit_ccds' in config:
+        expected = parse_ccd_range(config['hsc_visit_ccds'])
+    return VisitIndex(dbfile, expected)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+"""Watch incoming directories and push new HSC files through the plugins in micro-batches.
+
+New files are noticed with inotify (through ctypes, Linux only) or, for
+network filesystems where inotify doesn't see remote writes, by
+periodically scanning the directories.  A file is only used once its
+size and mtime stayed the same for settle seconds (so partially written
+or still copying files are skipped), then it joins the current batch.
+A batch is handed to the handler when it has batch_files files or its
+oldest file waited batch_wait seconds.  Files are only marked done once
+the handler returned; if it raises, the error is logged and the batch's
+files go back to settling, up to max_retries times.  The done files are
+remembered (up to max_done, oldest forgotten first) so unchanged files
+aren't handed over again.  dispatch_handler runs each batch
+through hsc_dispatch (one header read per file, batched existence
+check, metadata gathering by the matching plugin).
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+from despymisc import miscutils
+from desdmfw_lsst_plugins import hsc_catalog
+
+MODE_AUTO = 'auto'
+MODE_INOTIFY = 'inotify'
+MODE_POLL = 'poll'
+
+DEFAULT_SETTLE = 2.0
+DEFAULT_BATCH_FILES = 100
+DEFAULT_BATCH_WAIT = 5.0
+DEFAULT_POLL_INTERVAL = 10.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_MAX_DONE = 100000
+
+# from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def is_candidate(fullname):
+    """Whether a path looks like a finished fits file (not hidden or temporary).
+    """
+    fname = os.path.basename(fullname)
+    return fname.endswith(hsc_catalog.FITS_SUFFIXES) and not fname.startswith('.')
+
+
+def file_state(fullname):
+    """Return (size, mtime) of a file or None if it doesn't exist.
+    """
+    try:
+        stat = os.stat(fullname)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+
+def scan(paths, recursive=True):
+    """Return dict fullname -> (size, mtime) of candidate files in directories.
+    """
+    states = {}
+    for path in paths:
+        for dirpath, dirnames, filenames in os.walk(path):
+            for fname in filenames:
+                fullname = os.path.join(dirpath, fname)
+                if is_candidate(fullname):
+                    state = file_state(fullname)
+                    if state is not None:
+                        states[fullname] = state
+            if not recursive:
+                del dirnames[:]
+    return states
+
+
+class InotifyWatcher(object):
+    """Report files written or moved into watched directories using inotify.
+    """
+
+    def __init__(self, paths, recursive=True):
+        libname = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, 'inotify_init1: %s' % os.strerror(err))
+
+        self.paths = list(paths)
+        self.recursive = recursive
+        self.watches = {}
+        self.overflowed = False
+        for path in self.paths:
+            self.add_watch(path)
+
+    def add_watch(self, path):
+        """Watch path (and, if recursive, its subdirectories).
+        """
+        for dirpath, dirnames, _ in os.walk(path):
+            wdesc = self.libc.inotify_add_watch(self.fd, dirpath.encode('utf-8'), WATCH_MASK)
+            if wdesc < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, 'inotify_add_watch %s: %s' % (dirpath, os.strerror(err)))
+            self.watches[wdesc] = dirpath
+            if not self.recursive:
+                break
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, timeout):
+        """Wait up to timeout seconds and return list of changed fullnames.
+        """
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, READ_SIZE)
+        except OSError as exc:
+            if exc.errno == errno.EAGAIN:
+                return []
+            raise
+
+        changed = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buf):
+            (wdesc, mask, _, namelen) = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + namelen].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += namelen
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, caller rescans
+                self.overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wdesc, None)
+                continue
+            if wdesc not in self.watches or not name:
+                continue
+
+            fullname = os.path.join(self.watches[wdesc], name)
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_watch(fullname)
+                    # files may have landed before the watch existed
+                    changed.extend(scan([fullname]).keys())
+            elif is_candidate(fullname):
+                changed.append(fullname)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher(object):
+    """Report new or changed files by scanning directories every interval seconds.
+    """
+
+    def __init__(self, paths, interval=DEFAULT_POLL_INTERVAL, recursive=True):
+        self.paths = list(paths)
+        self.interval = interval
+        self.recursive = recursive
+        self.overflowed = False
+        self.states = scan(self.paths, recursive)
+        self.next_scan = time.time() + interval
+
+    def read(self, timeout):
+        """Wait up to timeout seconds and return list of changed fullnames.
+        """
+        now = time.time()
+        if now < self.next_scan:
+            time.sleep(min(timeout, self.next_scan - now))
+            if time.time() < self.next_scan:
+                return []
+
+        states = scan(self.paths, self.recursive)
+        changed = [fullname for fullname, state in states.items() if self.states.get(fullname) != state]
+        self.states = states
+        self.next_scan = time.time() + self.interval
+        return sorted(changed)
+
+    def close(self):
+        pass
+
+
+def make_watcher(paths, mode=MODE_AUTO, interval=DEFAULT_POLL_INTERVAL, recursive=True):
+    """Return an inotify watcher (if mode allows and it works) else a polling one.
+    """
+    if mode in (MODE_AUTO, MODE_INOTIFY):
+        try:
+            return InotifyWatcher(paths, recursive)
+        except (OSError, AttributeError) as exc:
+            if mode == MODE_INOTIFY:
+                raise
+            miscutils.fwdebug_print("WARN: inotify not usable (%s), polling every %s seconds" %
+                                    (exc, interval))
+    elif mode != MODE_POLL:
+        raise ValueError('Invalid watch mode (%s)' % mode)
+    return PollingWatcher(paths, interval, recursive)
+
+
+class WatchIngest(object):
+    """Debounce new files, group them into micro-batches and hand batches to handler.
+
+    handler is called with a list of fullnames.
+    """
+
+    def __init__(self, paths, handler, settle=DEFAULT_SETTLE, batch_files=DEFAULT_BATCH_FILES,
+                 batch_wait=DEFAULT_BATCH_WAIT, mode=MODE_AUTO, interval=DEFAULT_POLL_INTERVAL,
+                 recursive=True, initial=False, max_retries=DEFAULT_MAX_RETRIES,
+                 max_done=DEFAULT_MAX_DONE):
+        self.paths = list(paths)
+        self.handler = handler
+        self.settle = settle
+        self.batch_files = batch_files
+        self.batch_wait = batch_wait
+        self.recursive = recursive
+        self.max_retries = max_retries
+        self.max_done = max_done
+        self.watcher = make_watcher(self.paths, mode, interval, recursive)
+
+        # fullname -> (size, mtime, time state last changed) of files not yet settled
+        self.pending = OrderedDict()
+        # settled fullname -> (size, mtime) waiting to be handled and when the oldest joined
+        self.batch = OrderedDict()
+        self.batch_start = None
+        # fullname -> (size, mtime) when handled (or given up on), oldest first
+        self.done = OrderedDict()
+        # fullname -> number of failed handler calls
+        self.failures = {}
+        self.stopped = False
+        self.nbatches = 0
+        self.nfiles = 0
+        self.nerrors = 0
+
+        if initial:
+            self.notice(sorted(scan(self.paths, recursive).keys()))
+
+    def notice(self, fullnames, now=None):
+        """Add changed files to pending.
+        """
+        now = time.time() if now is None else now
+        for fullname in fullnames:
+            state = file_state(fullname)
+            if state is None or self.done.get(fullname) == state or self.batch.get(fullname) == state:
+                continue
+            if fullname not in self.pending or self.pending[fullname][:2] != state:
+                self.pending[fullname] = state + (now,)
+
+    def settled(self, now=None):
+        """Move files whose size and mtime didn't change for settle seconds to the batch.
+        """
+        now = time.time() if now is None else now
+        for fullname, (size, mtime, changed) in list(self.pending.items()):
+            state = file_state(fullname)
+            if state is None:
+                del self.pending[fullname]
+            elif state != (size, mtime):
+                self.pending[fullname] = state + (now,)
+            elif now - changed >= self.settle:
+                del self.pending[fullname]
+                if not self.batch:
+                    self.batch_start = now
+                self.batch[fullname] = state
+
+    def flush(self, force=False, now=None):
+        """Hand the batch to the handler if it is full or old enough (or force).
+
+        Returns the number of files handled (handler returned).
+        """
+        now = time.time() if now is None else now
+        nfiles = 0
+        # once the oldest file waited long enough everything goes (in batch_files chunks)
+        expired = bool(self.batch) and now - self.batch_start >= self.batch_wait
+        while self.batch and (force or expired or len(self.batch) >= self.batch_files):
+            batch = list(self.batch.items())[:self.batch_files]
+            for (fullname, _) in batch:
+                del self.batch[fullname]
+            if miscutils.fwdebug_check(3, 'FTMGMT_DEBUG'):
+                miscutils.fwdebug_print("INFO: batch of %s files (%s waiting to settle)" %
+                                        (len(batch), len(self.pending)))
+            try:
+                self.handler([fullname for (fullname, _) in batch])
+            except Exception as exc:
+                self._failed(batch, exc, now)
+                continue
+            for (fullname, state) in batch:
+                self._mark_done(fullname, state)
+            self.nbatches += 1
+            self.nfiles += len(batch)
+            nfiles += len(batch)
+
+        if nfiles:
+            # remaining files start a new batch
+            self.batch_start = now if self.batch else None
+        return nfiles
+
+    def _mark_done(self, fullname, state):
+        self.failures.pop(fullname, None)
+        self.done.pop(fullname, None)
+        self.done[fullname] = state
+        while len(self.done) > self.max_done:
+            self.done.popitem(last=False)
+
+    def _failed(self, batch, exc, now):
+        """Log a failed batch and put its files back to settle (or give up on them).
+        """
+        self.nerrors += 1
+        miscutils.fwdebug_print("ERROR: handling batch of %s files failed: %s: %s" %
+                                (len(batch), type(exc).__name__, exc))
+        traceback.print_exc(file=sys.stdout)
+        for (fullname, state) in batch:
+            self.failures[fullname] = self.failures.get(fullname, 0) + 1
+            if self.failures[fullname] > self.max_retries:
+                miscutils.fwdebug_print("ERROR: giving up on %s after %s failures" %
+                                        (fullname, self.failures[fullname]))
+                self._mark_done(fullname, state)
+            elif fullname not in self.pending:
+                self.pending[fullname] = state + (now,)
+
+    def step(self, timeout=None):
+        """Wait for events up to timeout seconds, then settle and flush.
+
+        Returns the number of files handed to the handler.
+        """
+        if timeout is None:
+            timeout = min(1.0, self.settle / 2.0, self.batch_wait / 2.0) or 0.1
+        self.notice(self.watcher.read(timeout))
+        if self.watcher.overflowed:
+            miscutils.fwdebug_print("WARN: watch events lost, rescanning %s" % ','.join(self.paths))
+            self.watcher.overflowed = False
+            self.notice(sorted(scan(self.paths, self.recursive).keys()))
+        self.settled()
+        return self.flush()
+
+    def run(self, duration=None, max_files=None):
+        """Loop until stop(), duration seconds or max_files files handled.
+        """
+        endtime = None if duration is None else time.time() + duration
+        try:
+            while not self.stopped:
+                self.step()
+                if max_files is not None and self.nfiles >= max_files:
+                    break
+                if endtime is not None and time.time() >= endtime:
+                    break
+        finally:
+            self.flush(force=True)
+            self.watcher.close()
+
+    def stop(self):
+        self.stopped = True
+
+
+def dispatch_handler(dispatcher, sink, skip_ingested=True):
+    """Return a batch handler running batches through hsc_dispatch.Dispatcher.process.
+
+    sink is called with (results, errors, skipped) of every batch (see Dispatcher.process).
+    Existence checks need the dispatcher to have a database handle.
+    """
+    skip_ingested = skip_ingested and dispatcher.dbh is not None
+
+    def handler(fullnames):
+        (results, errors, skipped) = dispatcher.process(fullnames, skip_ingested)
+        sink(results, errors, skipped)
+    return handler
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+"""Test set-up: import the package from python/ and stand in for missing DESDM modules.
+
+tests/stubs only provides what the tested modules call (debug printing,
+fullname parsing, directory creation, class loading, the GTT table name
+and plain ${} replacement), so the pure Python, SQLite, socket and watcher tests run without
+the framework.  Installed DESDM modules are always used instead.  The
+stand-ins are plain modules on sys.path so worker processes import them
+too.
+"""
+
+import importlib
+import os
+import sys
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(os.path.dirname(TESTDIR), 'python'))
+
+for _modname in ('despymisc.miscutils', 'despydmdb.dmdb_defs', 'intgutils.replace_funcs'):
+    try:
+        importlib.import_module(_modname)
+    except ImportError:
+        sys.path.append(os.path.join(TESTDIR, 'stubs'))
+        break
@@ -0,0 +1,4 @@
+"""Stand-in for despydmdb.dmdb_defs (see tests/conftest.py).
+"""
+
+DB_GTT_FILENAME = 'GTT_FILENAME'
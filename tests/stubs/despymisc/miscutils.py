@@ -0,0 +1,59 @@
+"""Stand-in for the despymisc.miscutils calls used by the tested modules (see tests/conftest.py).
+"""
+
+import importlib
+import os
+import re
+
+CU_PARSE_PATH = 2
+CU_PARSE_FILENAME = 4
+CU_PARSE_COMPRESSION = 8
+
+
+def fwdebug_check(msglvl, envdbgvar):
+    return int(os.environ.get(envdbgvar, os.environ.get('DESDM_DEBUG', 0))) >= msglvl
+
+
+def fwdebug_print(msg, mprefix=''):
+    print('%s%s' % (mprefix, msg))
+
+
+def fwsplit(fullstr, delim=','):
+    items = []
+    for item in [x.strip() for x in re.sub('[()]', '', str(fullstr)).split(delim)]:
+        match = re.match(r'(\d+):(\d+)$', item)
+        if match:
+            items.extend([str(x) for x in range(int(match.group(1)), int(match.group(2)) + 1)])
+        elif item:
+            items.append(item)
+    return items
+
+
+def parse_fullname(fullname, retmask=CU_PARSE_FILENAME):
+    (path, filename) = os.path.split(fullname)
+    compression = None
+    for ext in ('.fz', '.gz'):
+        if filename.endswith(ext):
+            (filename, compression) = (filename[:-len(ext)], ext)
+    retval = []
+    if retmask & CU_PARSE_PATH:
+        retval.append(path)
+    if retmask & CU_PARSE_FILENAME:
+        retval.append(filename)
+    if retmask & CU_PARSE_COMPRESSION:
+        retval.append(compression)
+    return retval[0] if len(retval) == 1 else tuple(retval)
+
+
+def coremakedirs(thedir):
+    if thedir and not os.path.exists(thedir):
+        os.makedirs(thedir, exist_ok=True)
+
+
+def dynamically_load_class(classname):
+    (modname, clsname) = classname.rsplit('.', 1)
+    return getattr(importlib.import_module(modname), clsname)
+
+
+def convertBool(value):
+    return str(value).lower() in ('true', 't', 'yes', 'y', '1')
@@ -0,0 +1,4 @@
+"""Stand-in for intgutils.intgdefs (see tests/conftest.py).
+"""
+
+REPLACE_VARS = 'replace_vars'
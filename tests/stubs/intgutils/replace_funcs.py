@@ -0,0 +1,29 @@
+"""Stand-in for intgutils.replace_funcs.replace_vars_single (see tests/conftest.py).
+
+Only ${name} variables are replaced, searchobj values before WCL ones,
+repeatedly until no known variable is left.  Unknown variables are kept.
+"""
+
+import re
+
+VAR_PAT = re.compile(r'\$\{([^}]+)\}')
+
+
+def replace_vars_single(value, wcl, opts=None):
+    searchobj = (opts or {}).get('searchobj') or {}
+
+    def lookup(match):
+        name = match.group(1)
+        for source in (searchobj, wcl):
+            for key in (name, name.lower()):
+                if key in source:
+                    return str(source[key])
+        return match.group(0)
+
+    value = str(value)
+    for _ in range(100):
+        newvalue = VAR_PAT.sub(lookup, value)
+        if newvalue == value:
+            break
+        value = newvalue
+    return value
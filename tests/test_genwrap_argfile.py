@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""Tests of spilling command line selections into an argfile.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desdmfw_lsst_plugins import genwrap_argfile
+
+
+class TestSpill(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.argfile = os.path.join(self.tmpdir, 'exec1.args')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_fits(self):
+        (cmdline, info) = genwrap_argfile.spill_cmdline('processCcd.py repo', ['--id visit=1'], self.argfile)
+        self.assertEqual(cmdline, 'processCcd.py repo --id visit=1')
+        self.assertIsNone(info)
+        self.assertFalse(os.path.exists(self.argfile))
+
+    def test_spill(self):
+        fragments = ['--id visit=%s ccd=%s' % (visit, ccd) for visit in range(100) for ccd in range(10)]
+        (cmdline, info) = genwrap_argfile.spill_cmdline('processCcd.py repo', fragments, self.argfile)
+        self.assertEqual(cmdline, 'processCcd.py repo @%s' % self.argfile)
+        self.assertEqual(info['num_args'], len(fragments))
+        with open(self.argfile) as argfh:
+            self.assertEqual(argfh.read().splitlines(), fragments)
+
+    def test_split_partial(self):
+        self.assertEqual(genwrap_argfile.split_partial('makeCoadd.py repo --id visit='),
+                         ('makeCoadd.py repo --id', 'visit='))
+        self.assertEqual(genwrap_argfile.split_partial('makeCoadd.py repo --id '),
+                         ('makeCoadd.py repo --id', ''))
+        self.assertEqual(genwrap_argfile.split_partial('makeCoadd.py'), ('', 'makeCoadd.py'))
+
+    def test_spill_partial(self):
+        # add_cmdline values glued onto visit= must not be separated from it
+        values = '^'.join(str(visit) for visit in range(2000))
+        (base, partial) = genwrap_argfile.split_partial('makeCoadd.py repo --id visit=')
+        (cmdline, _) = genwrap_argfile.spill_cmdline(base, [partial + values], self.argfile)
+        self.assertEqual(cmdline, 'makeCoadd.py repo --id @%s' % self.argfile)
+        with open(self.argfile) as argfh:
+            self.assertEqual(argfh.read(), 'visit=%s\n' % values)
+
+
+if __name__ == '__main__':
+    unittest.main()
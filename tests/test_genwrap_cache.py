@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""Tests of the node-local input cache.
+"""
+
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from desdmfw_lsst_plugins import genwrap_cache
+
+
+class TestNodeCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        os.makedirs(self.srcdir)
+        self.srcs = []
+        for i in range(6):
+            src = os.path.join(self.srcdir, 'calib%s.fits' % i)
+            with open(src, 'wb') as srcfh:
+                srcfh.write(b'x' * 1000)
+            self.srcs.append(src)
+        self.root = os.path.join(self.tmpdir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_fetch_and_evict(self):
+        cache = genwrap_cache.NodeCache(self.root, 3500)
+        cached = [cache.fetch(src) for src in self.srcs]
+        self.assertLessEqual(cache.total_bytes(), 3500)
+        # least recently used gone, newest kept
+        self.assertFalse(os.path.exists(cached[0]))
+        self.assertTrue(os.path.exists(cached[-1]))
+        self.assertEqual(cache.total_bytes(), sum(ent[1] for ent in cache.entries()))
+
+    def test_hit_does_not_touch_served_copies(self):
+        cache = genwrap_cache.NodeCache(self.root, 10000)
+        dest = cache.stage(self.srcs[0], os.path.join(self.tmpdir, 'job'))
+        os.utime(dest, (1000000, 1000000))
+        self.assertEqual(cache.fetch(self.srcs[0]), cache.fetch(self.srcs[0]))
+        self.assertEqual(os.stat(dest).st_mtime, 1000000)
+
+    def test_checksum_key(self):
+        cache = genwrap_cache.NodeCache(self.root, 10000)
+        cached = cache.fetch(self.srcs[0], checksum='abc123')
+        # same framework checksum still hits after the source is touched
+        os.utime(self.srcs[0], (1000000, 1000000))
+        self.assertEqual(cache.fetch(self.srcs[0], checksum='abc123'), cached)
+        self.assertNotEqual(cache.fetch(self.srcs[0], checksum='def456'), cached)
+
+    def test_copy_across_filesystems_survives_eviction(self):
+        cache = genwrap_cache.NodeCache(self.root, 1500)
+
+        def nolink(src, dest):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        with mock.patch('os.link', nolink):
+            dest = cache.stage(self.srcs[0], os.path.join(self.tmpdir, 'job'))
+        self.assertFalse(os.path.islink(dest))
+        cache.fetch(self.srcs[1])
+        self.assertEqual(len(cache.entries()), 1)
+        with open(dest, 'rb') as destfh:
+            self.assertEqual(destfh.read(), b'x' * 1000)
+
+    def test_index_rebuilt(self):
+        cache = genwrap_cache.NodeCache(self.root, 10000)
+        for src in self.srcs[:3]:
+            cache.fetch(src)
+        os.remove(os.path.join(self.root, genwrap_cache.INDEXNAME))
+        cache = genwrap_cache.NodeCache(self.root, 10000)
+        self.assertEqual(cache.total_bytes(), 3000)
+
+    def test_concurrent_stage(self):
+        cache = genwrap_cache.NodeCache(self.root, 2500)
+        errors = []
+
+        def stage(i):
+            try:
+                for j in range(20):
+                    src = self.srcs[(i + j) % len(self.srcs)]
+                    dest = cache.stage(src, os.path.join(self.tmpdir, 'job%s' % i, str(j)))
+                    self.assertTrue(os.path.exists(dest))
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=stage, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""Tests of the lossless tile compression round trip.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+fits = pytest.importorskip('astropy.io.fits')
+
+from desdmfw_lsst_plugins import genwrap_compress
+
+
+class TestCompress(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_image(self, name, data):
+        fullname = os.path.join(self.tmpdir, name)
+        hdr = fits.Header()
+        hdr['FILTER'] = 'HSC-I'
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=data, header=hdr)]).writeto(fullname)
+        return fullname
+
+    def test_float_with_nans_verifies(self):
+        data = numpy.arange(64 * 64, dtype=numpy.float32).reshape(64, 64) / 7.0
+        data[3, 5] = numpy.nan
+        data[10:12, :] = numpy.nan
+        src = self.write_image('calexp.fits', data)
+
+        info = genwrap_compress.compress_file(src, src + '.fz')
+        self.assertTrue(info['lossless'])
+        self.assertTrue(info['verified'])
+        with fits.open(src + '.fz') as hdus:
+            self.assertIsInstance(hdus[1], fits.CompImageHDU)
+            self.assertEqual(hdus[1].header['FILTER'], 'HSC-I')
+            self.assertTrue(numpy.array_equal(hdus[1].data, data, equal_nan=True))
+
+    def test_integer_rice(self):
+        data = (numpy.arange(32 * 32, dtype=numpy.int32).reshape(32, 32) % 1000)
+        src = self.write_image('mask.fits', data)
+        info = genwrap_compress.compress_file(src, src + '.fz', tile=(32, 1))
+        self.assertTrue(info['verified'])
+        with fits.open(src + '.fz') as hdus:
+            self.assertTrue(numpy.array_equal(hdus[1].data, data))
+
+    def test_lossy_not_verified(self):
+        data = numpy.linspace(0, 1, 32 * 32, dtype=numpy.float32).reshape(32, 32)
+        src = self.write_image('lossy.fits', data)
+        info = genwrap_compress.compress_file(src, src + '.fz', lossy=True)
+        self.assertFalse(info['lossless'])
+        self.assertFalse(info['verified'])
+
+    def test_settings(self):
+        self.assertEqual(genwrap_compress.hdu_settings('RICE_1', 16.0, numpy.dtype('f4'), False),
+                         (genwrap_compress.FLOAT_LOSSLESS_DEFAULT, 0.0))
+        self.assertEqual(genwrap_compress.hdu_settings('RICE_1', 16.0, numpy.dtype('i2'), False),
+                         ('RICE_1', 16.0))
+        self.assertIsNone(genwrap_compress.parse_tile('row'))
+        self.assertEqual(genwrap_compress.parse_tile('100,50'), (100, 50))
+
+    def test_compress_files_removes_originals(self):
+        srcs = [self.write_image('img%s.fits' % i, numpy.full((8, 8), i, dtype=numpy.int16))
+                for i in range(2)]
+        results = genwrap_compress.compress_files(srcs, nworkers=2)
+        self.assertEqual(list(results.keys()), srcs)
+        for src in srcs:
+            self.assertFalse(os.path.exists(src))
+            self.assertTrue(os.path.exists(results[src]['fullname']))
+
+
+if __name__ == '__main__':
+    unittest.main()
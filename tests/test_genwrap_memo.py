@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Tests of exec memo keys and restoring saved outputs in another job directory.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desdmfw_lsst_plugins import genwrap_memo
+
+
+class TestExecMemo(unittest.TestCase):
+    def setUp(self):
+        self.origdir = os.getcwd()
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        self.memo = genwrap_memo.ExecMemo(os.path.join(self.tmpdir, 'memo'))
+
+    def tearDown(self):
+        os.chdir(self.origdir)
+        shutil.rmtree(self.tmpdir)
+
+    def make_job(self, name, inputs):
+        """Create and enter job directory with inputs (dict relative path -> contents).
+        """
+        jobdir = os.path.join(self.tmpdir, name)
+        os.makedirs(jobdir)
+        for relpath, contents in inputs.items():
+            fullname = os.path.join(jobdir, relpath)
+            if not os.path.exists(os.path.dirname(fullname)):
+                os.makedirs(os.path.dirname(fullname))
+            with open(fullname, 'w') as outfh:
+                outfh.write(contents)
+        os.chdir(jobdir)
+        return jobdir
+
+    def key(self, jobdir, cmdline, outputs, version='w.2018.10'):
+        inputs = [os.path.join(jobdir, 'inputs/raw/HSCA90333412.fits'), 'inputs/calib/bias.fits']
+        checksums = genwrap_memo.input_checksums(inputs)
+        return genwrap_memo.make_key([genwrap_memo.normalize_cmdline(cmdline)], checksums, outputs, version)
+
+    def test_normalize_cmdline(self):
+        argfiles = {'exec1': {'path': '/job1/exec1.args', 'sha1': 'abc'}}
+        self.assertEqual(genwrap_memo.normalize_cmdline('processCcd.py  /job1/repo  @/job1/exec1.args',
+                                                        argfiles, cwd='/job1'),
+                         'processCcd.py ${CWD}/repo @sha1:abc')
+
+    def test_job_relpath(self):
+        self.assertEqual(genwrap_memo.job_relpath('/job1/repo/a.fits', cwd='/job1'), 'repo/a.fits')
+        self.assertEqual(genwrap_memo.job_relpath('repo/a.fits', cwd='/job1'), 'repo/a.fits')
+        self.assertEqual(genwrap_memo.job_relpath('/other/a.fits', cwd='/job1'), '/other/a.fits')
+
+    def test_key_independent_of_job_dir(self):
+        inputs = {'inputs/raw/HSCA90333412.fits': 'raw', 'inputs/calib/bias.fits': 'bias'}
+        job1 = self.make_job('job1', inputs)
+        (key1, desc1) = self.key(job1, 'processCcd.py %s/repo' % job1, [os.path.join(job1, 'out/calexp.fits')])
+        job2 = self.make_job('job2', inputs)
+        (key2, _) = self.key(job2, 'processCcd.py %s/repo' % job2, ['out/calexp.fits'])
+        self.assertEqual(key1, key2)
+        self.assertEqual(sorted(desc1['inputs'].keys()), ['inputs/calib/bias.fits', 'inputs/raw/HSCA90333412.fits'])
+
+        self.assertNotEqual(self.key(job2, 'processCcd.py %s/repo' % job2, ['out/calexp.fits'], 'w.2018.12')[0],
+                            key1)
+        with open('inputs/calib/bias.fits', 'w') as outfh:
+            outfh.write('new bias')
+        self.assertNotEqual(self.key(job2, 'processCcd.py %s/repo' % job2, ['out/calexp.fits'])[0], key1)
+
+    def test_stat_checksums(self):
+        self.make_job('job1', {'a.fits': 'abc'})
+        sums = genwrap_memo.input_checksums(['a.fits'], genwrap_memo.HASH_STAT)
+        self.assertEqual(sums['a.fits'].split(':')[0], '3')
+
+    def test_save_and_restore(self):
+        job1 = self.make_job('job1', {'out/0903334/calexp-050.fits': 'calexp 50',
+                                      'out/0903336/calexp-050.fits': 'calexp 50 other visit'})
+        outputs = [os.path.join(job1, 'out/0903334/calexp-050.fits'), os.path.join(job1, 'out/0903336/calexp-050.fits')]
+        self.assertIsNone(self.memo.lookup('abcd1234'))
+        result = self.memo.save('abcd1234', {'cmdlines': []}, outputs, {'status': 0})
+        self.assertEqual(self.memo.lookup('abcd1234')['outputs'], result['outputs'])
+        self.assertEqual(self.memo.lookup('abcd1234')['status'], 0)
+        # saved by an earlier job
+        self.assertIsNone(self.memo.save('abcd1234', {'cmdlines': []}, outputs))
+
+        job2 = self.make_job('job2', {})
+        outputs2 = [os.path.join(job2, 'out/0903336/calexp-050.fits'), 'out/0903334/calexp-050.fits']
+        restored = self.memo.restore('abcd1234', self.memo.lookup('abcd1234'), outputs2)
+        self.assertEqual(sorted(restored), sorted(outputs2))
+        # same filename in different directories goes to the right place
+        with open('out/0903336/calexp-050.fits') as infh:
+            self.assertEqual(infh.read(), 'calexp 50 other visit')
+        with open('out/0903334/calexp-050.fits') as infh:
+            self.assertEqual(infh.read(), 'calexp 50')
+
+        self.assertRaises(KeyError, self.memo.restore, 'abcd1234', self.memo.lookup('abcd1234'),
+                          ['out/0903334/calexp-050.fits'])
+
+
+if __name__ == '__main__':
+    unittest.main()
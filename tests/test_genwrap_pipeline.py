@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""Tests of overlapping per-visit repo ingest with shard execution.
+"""
+
+import threading
+import unittest
+from collections import OrderedDict
+
+from desdmfw_lsst_plugins import genwrap_pipeline
+
+
+class TestGroupIngests(unittest.TestCase):
+    def test_groups(self):
+        pending = [('a.fits', 'ingest a'), ('b.fits', 'ingest b'), ('bias.fits', 'ingest bias'),
+                   ('c.fits', 'ingest c')]
+        file_visits = {'a.fits': 10, 'b.fits': 12, 'c.fits': 99}
+        groups = genwrap_pipeline.group_ingests(pending, file_visits, [12, 10])
+        self.assertEqual(list(groups.keys()), [genwrap_pipeline.COMMON_GROUP, 12, 10])
+        # files of visits no shard uses are needed by all
+        self.assertEqual(groups[genwrap_pipeline.COMMON_GROUP], ['ingest bias', 'ingest c'])
+        self.assertEqual(groups[12], ['ingest b'])
+        self.assertEqual(groups[10], ['ingest a'])
+
+
+class TestRunPipelined(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.ingested = []
+        self.ran = []
+
+    def ingestfunc(self, repocmd):
+        with self.lock:
+            self.ingested.append(repocmd)
+        return 1 if 'bad' in repocmd else 0
+
+    def runfunc(self, i, cmdline):
+        with self.lock:
+            self.ran.append(i)
+        return (0, {}, 'shard%03d.log' % i)
+
+    def run_groups(self, groups, shard_visits):
+        cmdlines = ['task shard%s' % i for i in range(len(shard_visits))]
+        return genwrap_pipeline.run_pipelined(groups, cmdlines, shard_visits, 2,
+                                              self.ingestfunc, self.runfunc)
+
+    def test_all_ingested(self):
+        groups = OrderedDict([(None, ['bias']), (10, ['a']), (12, ['b'])])
+        results, ingester = self.run_groups(groups, [[10], [12]])
+        self.assertEqual([res[0] for res in results], [0, 0])
+        self.assertEqual(self.ingested, ['bias', 'a', 'b'])
+        self.assertEqual(sorted(self.ran), [0, 1])
+        self.assertIsNone(ingester.error)
+
+    def test_failed_visit_skips_its_shard(self):
+        groups = OrderedDict([(None, ['bias']), (10, ['a', 'bad a2']), (12, ['b'])])
+        results, ingester = self.run_groups(groups, [[12], [10], [10, 12]])
+        self.assertEqual([res[0] for res in results],
+                         [0, genwrap_pipeline.SKIPPED_STATUS, genwrap_pipeline.SKIPPED_STATUS])
+        self.assertEqual(self.ran, [0])
+        self.assertEqual(ingester.num_failed[10], 1)
+        self.assertFalse(ingester.completed[10])
+        # later groups are still ingested so every failure is reported
+        self.assertIn('b', self.ingested)
+
+    def test_failed_common_skips_all(self):
+        groups = OrderedDict([(None, ['bad bias']), (10, ['a']), (12, ['b'])])
+        results, _ = self.run_groups(groups, [[10], [12]])
+        self.assertEqual([res[0] for res in results], [genwrap_pipeline.SKIPPED_STATUS] * 2)
+        self.assertEqual(self.ran, [])
+
+    def test_ingest_exception_skips_rest(self):
+        def ingestfunc(repocmd):
+            if repocmd == 'b':
+                raise OSError('disk full')
+            return 0
+        groups = OrderedDict([(None, []), (10, ['a']), (12, ['b'])])
+        results, ingester = genwrap_pipeline.run_pipelined(groups, ['t0', 't1'], [[10], [12]], 2,
+                                                           ingestfunc, self.runfunc)
+        self.assertEqual([res[0] for res in results], [0, genwrap_pipeline.SKIPPED_STATUS])
+        self.assertIsInstance(ingester.error, OSError)
+
+
+if __name__ == '__main__':
+    unittest.main()
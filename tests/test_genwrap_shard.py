@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Tests of splitting command line selections into shards and running them.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from desdmfw_lsst_plugins import genwrap_shard
+
+# records its start and end time, exits with the given code
+SHARD_SCRIPT = """import sys, time
+start = time.time()
+time.sleep(float(sys.argv[2]))
+with open(sys.argv[1], 'w') as outfh:
+    outfh.write('%r %r' % (start, time.time()))
+print('shard output %s' % sys.argv[1])
+sys.exit(int(sys.argv[3]))
+"""
+
+
+class TestSplit(unittest.TestCase):
+    def test_split_by_count(self):
+        frags = ['f%s' % i for i in range(7)]
+        groups = genwrap_shard.split_by_count(frags, 3)
+        self.assertEqual([len(grp) for grp in groups], [3, 2, 2])
+        self.assertEqual([frag for grp in groups for frag in grp], frags)
+        self.assertEqual(genwrap_shard.split_by_count(frags[:2], 5), [['f0'], ['f1']])
+        self.assertEqual(genwrap_shard.split_by_count(frags, 0), [frags])
+
+    def test_split_by_visit(self):
+        frags = ['a1', 'b1', 'a2', 'c1', 'b2', 'd1']
+        visits = [10, 12, 10, 14, 12, 16]
+        groups, visit_groups = genwrap_shard.split_by_visit(frags, visits)
+        self.assertEqual(visit_groups, [[10], [12], [14], [16]])
+        self.assertEqual(groups, [['a1', 'a2'], ['b1', 'b2'], ['c1'], ['d1']])
+
+        groups, visit_groups = genwrap_shard.split_by_visit(frags, visits, 2)
+        self.assertEqual(visit_groups, [[10, 12], [14, 16]])
+        self.assertEqual(groups, [['a1', 'a2', 'b1', 'b2'], ['c1', 'd1']])
+
+    def test_aggregate_status(self):
+        self.assertEqual(genwrap_shard.aggregate_status([0, 0, 0]), 0)
+        self.assertEqual(genwrap_shard.aggregate_status([0, 3, -9]), 3)
+        self.assertEqual(genwrap_shard.aggregate_status([]), 0)
+
+
+class TestRunShards(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, 'shard.py')
+        with open(self.script, 'w') as scriptfh:
+            scriptfh.write(SHARD_SCRIPT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def cmdline(self, i, secs=0.2, exitcode=0):
+        return '%s %s %s %s %s' % (sys.executable, self.script, self.outfile(i), secs, exitcode)
+
+    def outfile(self, i):
+        return os.path.join(self.tmpdir, 'times%s' % i)
+
+    def times(self, i):
+        with open(self.outfile(i)) as timesfh:
+            return [float(val) for val in timesfh.read().split()]
+
+    def test_results_in_order(self):
+        cmdlines = [self.cmdline(0, 0.3), self.cmdline(1, 0.0, 2), self.cmdline(2, 0.1)]
+        results = genwrap_shard.run_shards(cmdlines, 3, os.path.join(self.tmpdir, 'shard'), warmup=False)
+        self.assertEqual([res[0] for res in results], [0, 2, 0])
+        self.assertEqual(genwrap_shard.aggregate_status([res[0] for res in results]), 2)
+        self.assertEqual(results[1][2], genwrap_shard.shard_logfile(os.path.join(self.tmpdir, 'shard'), 1))
+        with open(results[1][2]) as logfh:
+            self.assertIn('shard output %s' % self.outfile(1), logfh.read())
+
+        summary = genwrap_shard.shard_summary(results, [['a'], ['b', 'c'], ['d']])
+        self.assertEqual(list(summary.keys()), ['shard000', 'shard001', 'shard002'])
+        self.assertEqual(summary['shard001']['status'], 2)
+        self.assertEqual(summary['shard001']['num_selects'], 2)
+
+    def test_warmup_runs_first_alone(self):
+        cmdlines = [self.cmdline(i) for i in range(3)]
+        genwrap_shard.run_shards(cmdlines, 3, os.path.join(self.tmpdir, 'shard'), warmup=True)
+        first_end = self.times(0)[1]
+        for i in (1, 2):
+            self.assertGreaterEqual(self.times(i)[0], first_end)
+
+
+if __name__ == '__main__':
+    unittest.main()
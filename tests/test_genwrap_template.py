@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""Tests that compiled templates give the same results as replace_vars_single.
+"""
+
+import unittest
+
+from intgutils import intgdefs
+import intgutils.replace_funcs as repfunc
+
+from desdmfw_lsst_plugins import genwrap_template
+
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self.wcl = {'prefix': 'HSC',
+                    'outname': '${prefix}_${ccd}',
+                    'band': 'i'}
+        self.cache = genwrap_template.TemplateCache(self.wcl)
+
+    def uncompiled(self, pattern, searchobj=None):
+        opts = {intgdefs.REPLACE_VARS: True, 'expand': True, 'keepvars': False}
+        if searchobj is not None:
+            opts['searchobj'] = searchobj
+        return repfunc.replace_vars_single(pattern, self.wcl, opts)
+
+    def check(self, pattern, searchobj=None):
+        self.assertEqual(self.cache.replace(pattern, searchobj), self.uncompiled(pattern, searchobj))
+        return self.cache.replace(pattern, searchobj)
+
+    def test_static_and_searchobj(self):
+        self.assertEqual(self.check('--id visit=${visit} filter=${band}', {'visit': 903334}),
+                         '--id visit=903334 filter=i')
+        self.assertEqual(self.check('${prefix}-${band}'), 'HSC-i')
+
+    def test_static_value_with_reference(self):
+        # outname refers to ccd, which only the searchobj has
+        self.assertEqual(self.check('${outname}.fits', {'ccd': 50}), 'HSC_50.fits')
+        self.assertEqual(self.check('${outname}.fits', {'ccd': 51}), 'HSC_51.fits')
+
+    def test_special_searchobj_value(self):
+        self.assertEqual(self.check('${a}', {'a': '${prefix}'}), 'HSC')
+
+
+if __name__ == '__main__':
+    unittest.main()
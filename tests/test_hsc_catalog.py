@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""Tests of the header catalog skipping unchanged files and queries.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from desdmfw_lsst_plugins import hsc_catalog
+
+
+def fake_extract(fullname, keywords=None):
+    """Row derived from the filename (raw_<visit>_<ccd>_<filter>.fits) instead of the header.
+    """
+    filename = os.path.basename(fullname)
+    if not filename.startswith('raw_'):
+        return None, 'unclassified'
+    (visit, ccd, filt) = filename.split('.')[0].split('_')[1:]
+    stat = os.stat(fullname)
+    return {'fullname': fullname, 'filename': filename, 'class': 'raw', 'mtime': stat.st_mtime,
+            'filesize': stat.st_size, 'visit': int(visit), 'ccd': int(ccd), 'filter': filt,
+            'keywords': '{"EXPTIME": 30.0}'}, None
+
+
+class TestHeaderCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.catalog = hsc_catalog.HeaderCatalog(os.path.join(self.tmpdir, 'db', 'catalog.db'))
+        self.extract_calls = []
+
+        def extract(fullname, keywords=None):
+            self.extract_calls.append(fullname)
+            return fake_extract(fullname, keywords)
+
+        # threads so the patched extract is used
+        patches = [mock.patch.object(hsc_catalog, 'ProcessPoolExecutor', ThreadPoolExecutor),
+                   mock.patch.object(hsc_catalog, 'extract', extract)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, filename, contents='x'):
+        fullname = os.path.join(self.tmpdir, filename)
+        with open(fullname, 'w') as outfh:
+            outfh.write(contents)
+        return fullname
+
+    def test_only_stale_files_read(self):
+        raws = [self.write_file('raw_903334_%s_HSC-R.fits' % ccd) for ccd in (10, 11)]
+        other = self.write_file('other.fits')
+        self.assertEqual(self.catalog.stale(raws + [other]), raws + [other])
+
+        (nrows, errors) = self.catalog.update(raws + [other], nworkers=2)
+        self.assertEqual(nrows, 2)
+        self.assertEqual(list(errors.keys()), [other])
+        self.assertEqual(self.catalog.stale(raws), [])
+
+        # nothing changed, no headers read
+        self.extract_calls = []
+        self.assertEqual(self.catalog.update(raws)[0], 0)
+        self.assertEqual(self.extract_calls, [])
+
+        # size change and mtime change make a file stale, missing files are not
+        self.write_file(os.path.basename(raws[0]), 'xx')
+        os.utime(raws[1], (1000000000, 1000000000))
+        self.assertEqual(self.catalog.stale(raws + [os.path.join(self.tmpdir, 'missing.fits')]), raws)
+        self.catalog.update(raws)
+        self.assertEqual(sorted(self.extract_calls), sorted(raws))
+        self.assertEqual(self.catalog.stale(raws), [])
+
+    def test_prune(self):
+        raws = [self.write_file('raw_903334_%s_HSC-R.fits' % ccd) for ccd in (10, 11, 12)]
+        self.catalog.update(raws)
+        os.remove(raws[2])
+        self.catalog.update(raws[1:], prune=True)
+        self.assertEqual(self.catalog.fullnames(), [raws[1]])
+
+    def test_query(self):
+        raws = [self.write_file('raw_%s_%s_%s.fits' % entry)
+                for entry in [(903334, 10, 'HSC-R'), (903334, 11, 'HSC-R'), (903336, 10, 'HSC-I')]]
+        self.catalog.update(raws)
+
+        self.assertEqual(self.catalog.fullnames(filter='HSC-R'), raws[:2])
+        self.assertEqual(self.catalog.fullnames(visit=(903335, None)), raws[2:])
+        self.assertEqual(self.catalog.fullnames(ccd=[11, 12]), [raws[1]])
+        rows = self.catalog.query(columns=['visit', 'keywords'], order=['visit', 'ccd'], ccd=10)
+        self.assertEqual([row['visit'] for row in rows], [903334, 903336])
+        self.assertEqual(rows[0]['keywords'], {'EXPTIME': 30.0})
+        self.assertEqual(dict(self.catalog.counts()), {'raw': 3})
+        self.assertRaises(ValueError, self.catalog.query, bogus=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
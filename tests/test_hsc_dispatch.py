@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Tests of routing classified files to their plugin in batches.
+"""
+
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+from desdmfw_lsst_plugins import hsc_dispatch
+from desdmfw_lsst_plugins import hsc_pairs
+
+HEADERS = {'raw': {'EXP-ID': 'HSCA90333400', 'FRAMEID': 'HSCA90333412'},
+           'calib': {'CALIB_ID': 'bias'}}
+
+
+class FakePlugin(hsc_pairs.PairBatchMixin):
+    """Plugin recording gather_pairs calls and batched index writes.
+    """
+    instances = []
+
+    def __init__(self, filetype, dbh, config):
+        self.filetype = filetype
+        self.calls = []
+        self.writes = []
+        FakePlugin.instances.append(self)
+
+    def gather_pairs(self, listfullnames, do_update=False, update_info=None, headers=None,
+                     fingerprints=None):
+        self.calls.append((list(listfullnames), dict(headers)))
+        return hsc_pairs.PairBatchMixin.gather_pairs(self, listfullnames, do_update, update_info,
+                                                     headers, fingerprints)
+
+    def perform_metadata_tasks(self, fullname, do_update, update_info, primary_hdr=None, fprint=None):
+        if 'bad' in fullname:
+            raise ValueError('cannot read %s' % fullname)
+        self._batch_add('visits', fullname)
+        return OrderedDict([('filename', hsc_pairs.split_fullname(fullname)[0]),
+                            ('compression', hsc_pairs.split_fullname(fullname)[1]),
+                            ('read_header', primary_hdr is not None)])
+
+    def _write_batch(self, kind, entries):
+        self.writes.append((kind, list(entries)))
+
+
+def fake_read_header_fingerprint(fullname):
+    kind = 'calib' if 'bias' in fullname else 'raw'
+    return HEADERS[kind], 'fp-%s' % fullname
+
+
+class TestDispatcher(unittest.TestCase):
+    def setUp(self):
+        FakePlugin.instances = []
+        patcher = mock.patch.object(hsc_dispatch, 'read_header_fingerprint', fake_read_header_fingerprint)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        classnames = dict((fclass, '%s.FakePlugin' % __name__) for fclass in hsc_dispatch.CLASSES)
+        self.dispatcher = hsc_dispatch.Dispatcher({}, {'raw': 'raw_hsc', 'calib': 'cal_hsc'},
+                                                  classnames=classnames)
+
+    def plugin(self, fclass):
+        return self.dispatcher.plugins[fclass]
+
+    def test_one_batch_per_class(self):
+        fullnames = ['/a/HSCA90333412.fits', '/b/HSCA90333412.fits.fz', '/a/HSCA90333414.fits.fz',
+                     '/a/HSCA90333416.fits', '/c/bias-1.fits']
+        results, errors, skipped = self.dispatcher.process(fullnames)
+        self.assertEqual(errors, {})
+        self.assertEqual(skipped, [])
+        self.assertEqual(list(results.keys()), fullnames)
+        self.assertEqual(results['/c/bias-1.fits'][:2], ('calib', 'cal_hsc'))
+
+        raw = self.plugin('raw')
+        self.assertEqual(len(raw.calls), 1)
+        self.assertEqual(raw.calls[0][0], fullnames[:4])
+        # pre-read headers are passed for the pair sources only
+        self.assertEqual(sorted(raw.calls[0][1]), ['/a/HSCA90333412.fits', '/a/HSCA90333414.fits.fz',
+                                                   '/a/HSCA90333416.fits'])
+        self.assertEqual(len(raw.writes), 1)
+        self.assertEqual(len(raw.writes[0][1]), 3)
+        self.assertTrue(results['/b/HSCA90333412.fits.fz'][2]['read_header'])
+        self.assertEqual(results['/b/HSCA90333412.fits.fz'][2]['compression'], '.fz')
+        self.assertEqual(len(self.dispatcher.pair_report), 4)
+
+    def test_failure_reported_per_group(self):
+        fullnames = ['/a/HSCA90333412.fits', '/a/HSCA90333414-bad.fits', '/b/HSCA90333414-bad.fits.fz',
+                     '/a/HSCA90333416.fits']
+        results, errors, _ = self.dispatcher.process(fullnames)
+        self.assertEqual(list(results.keys()), ['/a/HSCA90333412.fits', '/a/HSCA90333416.fits'])
+        self.assertEqual(sorted(errors.keys()), ['/a/HSCA90333414-bad.fits', '/b/HSCA90333414-bad.fits.fz'])
+        self.assertIn('ValueError', errors['/a/HSCA90333414-bad.fits'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""Tests of the combined existence check using the SQLite database stand-in.
+"""
+
+import unittest
+
+from desdmfw_lsst_plugins import hsc_existence
+
+
+class TestExistence(unittest.TestCase):
+    def setUp(self):
+        self.dbh = hsc_existence.SqliteDbh()
+        self.dbh.create_tables()
+        self.dbh.insert_filenames(hsc_existence.TABLE_IMAGE, ['HSCA90333412.fits', 'calexp-0903334-050.fits'])
+        self.dbh.insert_filenames(hsc_existence.TABLE_CALIBRATION, ['BIAS-2016-01-01-050.fits'])
+
+    def tearDown(self):
+        self.dbh.close()
+
+    def test_check_tables(self):
+        fullnames = ['/raw/HSCA90333412.fits', '/mirror/HSCA90333412.fits.fz',
+                     '/raw/HSCA90333414.fits.fz',
+                     '/calib/BIAS-2016-01-01-050.fits.fz', '/calib/FLAT-2016-01-01-050.fits']
+        results = hsc_existence.check_tables(self.dbh, fullnames)
+        self.assertEqual(list(results.keys()), fullnames)
+        self.assertEqual(results['/raw/HSCA90333412.fits'], [hsc_existence.TABLE_IMAGE])
+        self.assertEqual(results['/mirror/HSCA90333412.fits.fz'], [hsc_existence.TABLE_IMAGE])
+        self.assertEqual(results['/raw/HSCA90333414.fits.fz'], [])
+        self.assertEqual(results['/calib/BIAS-2016-01-01-050.fits.fz'], [hsc_existence.TABLE_CALIBRATION])
+        self.assertEqual(results['/calib/FLAT-2016-01-01-050.fits'], [])
+        # empty, load, query, empty
+        self.assertEqual(self.dbh.round_trips, 4)
+
+    def test_check_classes(self):
+        byclass = {'raw': ['/raw/HSCA90333412.fits.fz', '/raw/HSCA90333414.fits'],
+                   'img': ['/out/calexp-0903334-050.fits.fz'],
+                   'calib': ['/calib/BIAS-2016-01-01-050.fits', '/calib/HSCA90333412.fits']}
+        ingested = hsc_existence.check_classes(self.dbh, byclass)
+        self.assertEqual(ingested, {'/raw/HSCA90333412.fits.fz': True,
+                                    '/raw/HSCA90333414.fits': False,
+                                    '/out/calexp-0903334-050.fits.fz': True,
+                                    '/calib/BIAS-2016-01-01-050.fits': True,
+                                    # in image, not calibration
+                                    '/calib/HSCA90333412.fits': False})
+        self.assertEqual(self.dbh.round_trips, 4)
+
+    def test_empty(self):
+        self.assertEqual(hsc_existence.check_tables(self.dbh, []), {})
+        self.assertEqual(self.dbh.round_trips, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
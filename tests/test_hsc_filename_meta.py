@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""Tests of deriving HSC raw visit and ccd from the filename.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desdmfw_lsst_plugins import hsc_filename_meta
+
+
+# same as FtMgmtHSCRaw.translate_visit for old scheme EXP-IDs
+def translate_visit(letter, expnum):
+    return expnum - (expnum % 2) + 1000000 * (ord(letter) - ord('A'))
+
+
+class TestFilenameMeta(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mapfile = os.path.join(self.tmpdir, 'ccdmap.txt')
+        with open(self.mapfile, 'w') as mapfh:
+            mapfh.write('# parity*100 + frame index, ccd\n12 50\n112 99   # odd exposure\n\n')
+        self.ccdmap = hsc_filename_meta.read_ccd_map(self.mapfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_ccd_map(self):
+        self.assertEqual(self.ccdmap, {12: 50, 112: 99})
+
+    def test_parse_frame(self):
+        self.assertEqual(hsc_filename_meta.parse_frame('/raw/HSCA90333412.fits.fz'),
+                         ('HSCA90333412', 'A', 903334, 12))
+        self.assertIsNone(hsc_filename_meta.parse_frame('calexp-0903334-050.fits'))
+        self.assertIsNone(hsc_filename_meta.parse_frame('HSCA90333412.fits.gz'))
+
+    def test_derive_values(self):
+        self.assertEqual(hsc_filename_meta.derive_values('HSCA90333412.fits', self.ccdmap, 999999),
+                         {'visit': translate_visit('A', 903334), 'ccd': 50, 'frameid': 'HSCA90333412'})
+        # odd exposure numbers belong to the previous visit
+        derived = hsc_filename_meta.derive_values('HSCB90333512.fits.fz', self.ccdmap, 999999)
+        self.assertEqual(derived['visit'], translate_visit('B', 903335))
+        self.assertEqual(derived['visit'], 1903334)
+        self.assertEqual(derived['ccd'], 99)
+
+    def test_not_derivable(self):
+        # frame index not in the map
+        self.assertIsNone(hsc_filename_meta.derive_values('HSCA90333413.fits', self.ccdmap, 999999))
+        # after the HSCE EXP-ID scheme started
+        self.assertIsNone(hsc_filename_meta.derive_values('HSCA90333412.fits', self.ccdmap, 903333))
+
+    def test_can_derive(self):
+        metadefs = {'hdus': {'primary': {'req': {'h': {'ccd': 'x'}, 'c': {'visit': 'x'}},
+                                         'opt': {'f': {'filename': 'x'}}}}}
+        self.assertEqual(hsc_filename_meta.requested_keys(metadefs), set(['ccd', 'visit']))
+        self.assertTrue(hsc_filename_meta.can_derive(metadefs))
+        metadefs['hdus']['primary']['opt']['h'] = {'EXPTIME': 'x'}
+        self.assertFalse(hsc_filename_meta.can_derive(metadefs))
+
+
+if __name__ == '__main__':
+    unittest.main()
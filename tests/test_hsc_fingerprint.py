@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+"""Tests of header fingerprints and finding new or changed files.
+"""
+
+import importlib.util
+import os
+import shutil
+import tempfile
+import unittest
+
+from desdmfw_lsst_plugins import hsc_fingerprint
+
+HAVE_ASTROPY = importlib.util.find_spec('astropy') is not None
+
+
+def card(keyword, value):
+    if isinstance(value, str):
+        value = "'%-8s'" % value
+    elif isinstance(value, bool):
+        value = 'T' if value else 'F'
+    return ('%-8s= %20s' % (keyword, value)).ljust(80)
+
+
+def header_bytes(cards):
+    header = ''.join(card(key, val) for (key, val) in cards) + 'END'.ljust(80)
+    return header.ljust((len(header) + 2879) // 2880 * 2880).encode('ascii')
+
+
+def write_fits(fullname, keywords, data=b'\x01' * 80):
+    """Write a primary header with keywords or, for .fz names, an empty primary plus binary table.
+    """
+    with open(fullname, 'wb') as outfh:
+        if fullname.endswith('.fz'):
+            outfh.write(header_bytes([('SIMPLE', True), ('BITPIX', 8), ('NAXIS', 0), ('EXTEND', True),
+                                      ('ORIGIN', 'fpack')]))
+            outfh.write(header_bytes([('XTENSION', 'BINTABLE'), ('BITPIX', 8), ('NAXIS', 2),
+                                      ('NAXIS1', 8), ('NAXIS2', len(data) // 8), ('PCOUNT', 0),
+                                      ('GCOUNT', 1), ('ZIMAGE', True)] + keywords))
+        else:
+            outfh.write(header_bytes([('SIMPLE', True), ('BITPIX', 8), ('NAXIS', 1),
+                                      ('NAXIS1', len(data))] + keywords))
+        outfh.write(data.ljust((len(data) + 2879) // 2880 * 2880, b'\0'))
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.keywords = [('EXP-ID', 'HSCA90333400'), ('DET-ID', 50)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_headers_only(self):
+        write_fits(self.path('a.fits'), self.keywords)
+        write_fits(self.path('b.fits'), self.keywords, data=b'\x02' * 80)
+        write_fits(self.path('c.fits'), [('EXP-ID', 'HSCA90333400'), ('DET-ID', 51)])
+        fprints = hsc_fingerprint.fingerprint_files([self.path(name) for name in ('a.fits', 'b.fits', 'c.fits')])
+        # data is not part of the fingerprint, header cards are
+        self.assertEqual(fprints[0], fprints[1])
+        self.assertNotEqual(fprints[0], fprints[2])
+
+    def test_compressed_reads_image_header(self):
+        write_fits(self.path('a.fits.fz'), self.keywords, data=b'\x01' * 4000)
+        headers, fprint = hsc_fingerprint.read_headers(self.path('a.fits.fz'))
+        self.assertEqual(len(headers), 2)
+        self.assertIn(b'DET-ID', headers[1])
+        write_fits(self.path('b.fits.fz'), [('EXP-ID', 'HSCA90333400'), ('DET-ID', 51)], data=b'\x01' * 4000)
+        self.assertNotEqual(fprint, hsc_fingerprint.fingerprint(self.path('b.fits.fz')))
+
+    def test_truncated(self):
+        with open(self.path('bad.fits'), 'wb') as outfh:
+            outfh.write(b'SIMPLE  =                    T'.ljust(800))
+        self.assertRaises(ValueError, hsc_fingerprint.fingerprint, self.path('bad.fits'))
+
+    def test_diff(self):
+        names = [self.path('f%s.fits' % i) for i in range(4)]
+        for fullname in names:
+            write_fits(fullname, self.keywords + [('FRAMEID', os.path.basename(fullname)[:8])])
+        store = hsc_fingerprint.FingerprintStore(self.path('store/fprints.sqlite3'))
+        store.put_many([(fullname, fprint, {'file': fullname})
+                        for (fullname, fprint) in zip(names[:3], hsc_fingerprint.fingerprint_files(names[:3]))])
+
+        write_fits(names[1], self.keywords + [('FRAMEID', 'changed')])
+        changed = hsc_fingerprint.diff(names, store, nworkers=2)
+        self.assertEqual(list(changed.keys()), [names[1], names[3]])
+        self.assertEqual(changed[names[1]][0], hsc_fingerprint.STATUS_CHANGED)
+        self.assertEqual(changed[names[3]][0], hsc_fingerprint.STATUS_NEW)
+        self.assertEqual(changed[names[3]][1], hsc_fingerprint.fingerprint(names[3]))
+
+        # files are keyed by filename, so moved files are not new
+        shutil.move(names[0], self.path('f0.fits.moved'))
+        os.makedirs(self.path('other'))
+        write_fits(self.path('other/f0.fits'), self.keywords + [('FRAMEID', 'f0.fits')])
+        self.assertEqual(hsc_fingerprint.diff([self.path('other/f0.fits')], store), {})
+        self.assertEqual(store.get_metadata(self.path('other/f0.fits')), {'file': names[0]})
+        self.assertIsNone(store.get_metadata(names[3]))
+        store.close()
+
+    @unittest.skipUnless(HAVE_ASTROPY, 'needs astropy')
+    def test_metadata_header_merges_primary(self):
+        write_fits(self.path('a.fits.fz'), [('DET-ID', 50)])
+        hdr = hsc_fingerprint.read_metadata_header(self.path('a.fits.fz'))
+        self.assertEqual(hdr['DET-ID'], 50)
+        self.assertEqual(hdr['ORIGIN'], 'fpack')
+        self.assertEqual(hdr['XTENSION'], 'BINTABLE')
+
+
+if __name__ == '__main__':
+    unittest.main()
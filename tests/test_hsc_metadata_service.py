@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""Tests of the metadata service (one machine, fake plugin class).
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import OrderedDict
+
+from desdmfw_lsst_plugins import hsc_metadata_service as mdsvc
+
+
+class FakePlugin(object):
+    """Plugin recording which threads use each instance.
+    """
+    instances = []
+    lock = threading.Lock()
+
+    def __init__(self, filetype, dbh, config):
+        self.filetype = filetype
+        self.threads = set()
+        self.init_thread = threading.current_thread().ident
+        with FakePlugin.lock:
+            FakePlugin.instances.append(self)
+
+    def perform_metadata_tasks(self, fullname, do_update, update_info):
+        self.threads.add(threading.current_thread().ident)
+        time.sleep(0.001)
+        if 'bad' in fullname:
+            raise ValueError('cannot read %s' % fullname)
+        return OrderedDict([('fullname', fullname), ('filetype', self.filetype)])
+
+
+class TestMetadataService(unittest.TestCase):
+    def setUp(self):
+        FakePlugin.instances = []
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'mdsvc.sock')
+        self.service = mdsvc.MetadataService(self.socket_path, {},
+                                             {'raw_hsc': '%s.FakePlugin' % __name__},
+                                             workers=4, idle_timeout=0)
+        self.thread = threading.Thread(target=self.service.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = mdsvc.MetadataClient(self.socket_path, timeout=30)
+        for _ in range(100):
+            if self.client.is_running():
+                break
+            time.sleep(0.05)
+
+    def tearDown(self):
+        if self.client.is_running():
+            self.client.shutdown()
+        self.thread.join(10)
+        shutil.rmtree(self.tmpdir)
+
+    def test_ping(self):
+        self.assertTrue(self.client.is_running())
+
+    def test_results_in_order(self):
+        fullnames = ['/data/f%04d.fits' % i for i in range(200)]
+        results = self.client.get_metadata('raw_hsc', fullnames)
+        self.assertEqual(list(results.keys()), fullnames)
+        for fullname, metadata in results.items():
+            self.assertEqual(metadata, {'fullname': fullname, 'filetype': 'raw_hsc'})
+
+    def test_errors_per_file(self):
+        fullnames = ['/data/a.fits', '/data/bad.fits', '/data/c.fits']
+        gathered = list(self.client.iter_metadata('raw_hsc', fullnames))
+        self.assertEqual([fullname for (fullname, _, _) in gathered], fullnames)
+        self.assertIsNone(gathered[0][2])
+        self.assertIn('cannot read /data/bad.fits', gathered[1][2])
+        self.assertIsNone(gathered[2][2])
+        self.assertRaises(RuntimeError, self.client.get_metadata, 'raw_hsc', fullnames)
+
+    def test_plugin_per_thread(self):
+        fullnames = ['/data/f%04d.fits' % i for i in range(400)]
+        clients = [threading.Thread(target=self.client.get_metadata, args=('raw_hsc', fullnames))
+                   for _ in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join(30)
+        self.assertTrue(FakePlugin.instances)
+        self.assertLessEqual(len(FakePlugin.instances), 4)
+        for plugin in FakePlugin.instances:
+            self.assertEqual(len(plugin.threads), 1)
+
+    def test_unknown_class(self):
+        self.assertRaises(RuntimeError, self.client.get_metadata, 'raw_hsc', ['/data/a.fits'],
+                          'nosuchmodule.NoClass')
+
+    def test_shutdown(self):
+        self.client.shutdown()
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+class TestPreload(unittest.TestCase):
+    def setUp(self):
+        FakePlugin.instances = []
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'mdsvc.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_plugins_built_in_every_worker(self):
+        service = mdsvc.MetadataService(self.socket_path, {}, {'raw_hsc': '%s.FakePlugin' % __name__},
+                                        workers=3, idle_timeout=0)
+        service.preload(['raw_hsc'])
+        self.assertEqual(len(FakePlugin.instances), 3)
+        self.assertEqual(len(set(plugin.init_thread for plugin in FakePlugin.instances)), 3)
+        self.assertNotIn(threading.current_thread().ident,
+                         [plugin.init_thread for plugin in FakePlugin.instances])
+
+        thread = threading.Thread(target=service.serve)
+        thread.daemon = True
+        thread.start()
+        client = mdsvc.MetadataClient(self.socket_path, timeout=30)
+        for _ in range(100):
+            if client.is_running():
+                break
+            time.sleep(0.05)
+        fullnames = ['/data/f%04d.fits' % i for i in range(300)]
+        self.assertEqual(list(client.get_metadata('raw_hsc', fullnames).keys()), fullnames)
+        # requests only used the preloaded instances
+        self.assertEqual(len(FakePlugin.instances), 3)
+        client.shutdown()
+        thread.join(10)
+
+    def test_preload_error(self):
+        service = mdsvc.MetadataService(self.socket_path, {}, {'raw_hsc': 'nosuchmodule.NoClass'},
+                                        workers=2, idle_timeout=0)
+        self.assertRaises(ImportError, service.preload, ['raw_hsc'])
+        service.pool.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Tests of the visit completeness index.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from desdmfw_lsst_plugins import hsc_visit_index
+
+
+class TestBits(unittest.TestCase):
+    def test_round_trip(self):
+        ccds = [0, 5, 49, 103, 111]
+        self.assertEqual(hsc_visit_index.bits_to_ccds(hsc_visit_index.ccds_to_bits(ccds)), ccds)
+        self.assertEqual(hsc_visit_index.bits_to_ccds(0), [])
+
+    def test_blob(self):
+        bits = hsc_visit_index.ccds_to_bits([0, 111])
+        blob = hsc_visit_index._to_blob(bits)
+        self.assertEqual(len(blob), hsc_visit_index.BITMAP_BYTES)
+        self.assertEqual(hsc_visit_index._from_blob(blob), bits)
+
+    def test_parse_ccd_range(self):
+        self.assertEqual(hsc_visit_index.parse_ccd_range('0-3,9'), [0, 1, 2, 3, 9])
+
+
+class TestVisitIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpdir, 'idx', 'visits.sqlite3')
+        self.index = hsc_visit_index.VisitIndex(self.dbfile, expected_ccds=range(4))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_completeness(self):
+        self.index.add_many([(100, 0, '2016-03-08', 'HSC-I'), (100, 1, None, None), (102, 0, None, None)])
+        self.assertFalse(self.index.is_complete(100))
+        self.index.add_many([(100, 2, None, None), (100, 3, None, None), (100, 3, None, None)])
+        self.assertTrue(self.index.is_complete(100))
+
+        status = self.index.status([100, 102, 104])
+        self.assertEqual(list(status.keys()), [100, 102, 104])
+        self.assertEqual(status[100]['nccds'], 4)
+        # dateobs and filter of earlier entries are kept
+        self.assertEqual((status[100]['dateobs'], status[100]['filter']), ('2016-03-08', 'HSC-I'))
+        self.assertEqual(status[102]['missing'], [1, 2, 3])
+        self.assertIsNone(status[104])
+
+    def test_visits_by_date(self):
+        self.index.add_many([(100, 0, '2016-03-08', 'HSC-I'), (102, 0, '2016-03-09T01:02:03', 'HSC-R'),
+                             (104, 0, '2016-03-10', 'HSC-R')] +
+                            [(104, ccd, None, None) for ccd in range(1, 4)])
+        self.assertEqual([info['visit'] for info in self.index.visits('2016-03-09', '2016-03-10')],
+                         [102, 104])
+        self.assertEqual([info['visit'] for info in self.index.incomplete_visits(date_end='2016-03-09')],
+                         [100, 102])
+        self.assertEqual([info['visit'] for info in self.index.incomplete_visits()], [100, 102])
+
+    def test_concurrent_writers(self):
+        def add(ccd):
+            index = hsc_visit_index.VisitIndex(self.dbfile, expected_ccds=range(4))
+            for visit in range(100, 140, 2):
+                index.add(visit, ccd)
+            index.close()
+
+        threads = [threading.Thread(target=add, args=(ccd,)) for ccd in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.index.incomplete_visits(), [])
+        self.assertEqual(len(self.index.visits()), 20)
+
+    def test_index_from_config(self):
+        self.assertIsNone(hsc_visit_index.index_from_config({}))
+        index = hsc_visit_index.index_from_config({'hsc_visit_index': self.dbfile, 'hsc_visit_ccds': '0-1'})
+        index.add_many([(100, 0, None, None), (100, 1, None, None)])
+        self.assertTrue(index.is_complete(100))
+        index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""Tests of debouncing and micro-batching of watched files.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from desdmfw_lsst_plugins import hsc_watch
+
+
+class TestWatchIngest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.batches = []
+        self.fail = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def handler(self, fullnames):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('database down')
+        self.batches.append(list(fullnames))
+
+    def make_file(self, name, data=b'x'):
+        fullname = os.path.join(self.tmpdir, name)
+        with open(fullname, 'wb') as outfh:
+            outfh.write(data)
+        return fullname
+
+    def make_watch(self, **kwargs):
+        args = dict(settle=2.0, batch_files=3, batch_wait=5.0, mode=hsc_watch.MODE_POLL)
+        args.update(kwargs)
+        return hsc_watch.WatchIngest([self.tmpdir], self.handler, **args)
+
+    def test_settle_and_batch(self):
+        watch = self.make_watch()
+        names = [self.make_file('HSCA%08d.fits' % i) for i in range(4)]
+        self.make_file('.hidden.fits')
+        watch.notice(names, now=100.0)
+        watch.settled(now=101.0)
+        self.assertEqual(watch.flush(now=101.0), 0)
+
+        watch.settled(now=102.0)
+        # full batch goes at once, the remainder waits for batch_wait
+        self.assertEqual(watch.flush(now=102.0), 3)
+        self.assertEqual(self.batches, [names[:3]])
+        self.assertEqual(watch.flush(now=106.0), 0)
+        self.assertEqual(watch.flush(now=107.0), 1)
+        self.assertEqual(self.batches[1], names[3:])
+
+        # unchanged files aren't handed over again, rewritten ones are
+        watch.notice(names, now=110.0)
+        self.assertEqual(len(watch.pending), 0)
+        self.make_file(os.path.basename(names[0]), b'xyz')
+        watch.notice(names, now=111.0)
+        self.assertEqual(list(watch.pending.keys()), [names[0]])
+
+    def test_changing_file_not_settled(self):
+        watch = self.make_watch()
+        fullname = self.make_file('HSCA00000001.fits')
+        watch.notice([fullname], now=100.0)
+        self.make_file('HSCA00000001.fits', b'more data')
+        watch.settled(now=102.0)
+        self.assertEqual(len(watch.batch), 0)
+        watch.settled(now=104.0)
+        self.assertEqual(list(watch.batch.keys()), [fullname])
+
+    def test_failed_batch_retried(self):
+        watch = self.make_watch(max_retries=2)
+        fullname = self.make_file('HSCA00000001.fits')
+        self.fail = 1
+        watch.notice([fullname], now=100.0)
+        watch.settled(now=102.0)
+        self.assertEqual(watch.flush(force=True, now=102.0), 0)
+        self.assertEqual(watch.nerrors, 1)
+        self.assertNotIn(fullname, watch.done)
+        self.assertIn(fullname, watch.pending)
+
+        watch.settled(now=104.0)
+        self.assertEqual(watch.flush(force=True, now=104.0), 1)
+        self.assertEqual(self.batches, [[fullname]])
+        self.assertIn(fullname, watch.done)
+
+    def test_give_up_after_retries(self):
+        watch = self.make_watch(max_retries=1)
+        fullname = self.make_file('HSCA00000001.fits')
+        self.fail = 5
+        watch.notice([fullname], now=100.0)
+        for now in (102.0, 104.0):
+            watch.settled(now=now)
+            watch.flush(force=True, now=now)
+        self.assertEqual(watch.nerrors, 2)
+        self.assertIn(fullname, watch.done)
+        self.assertEqual(len(watch.pending), 0)
+
+    def test_done_bounded(self):
+        watch = self.make_watch(batch_files=10, max_done=5)
+        names = [self.make_file('HSCA%08d.fits' % i) for i in range(8)]
+        watch.notice(names, now=100.0)
+        watch.settled(now=102.0)
+        watch.flush(force=True, now=102.0)
+        self.assertEqual(list(watch.done.keys()), names[3:])
+
+    def test_run_polling(self):
+        watch = self.make_watch(settle=0.0, batch_wait=0.0, interval=0.05)
+        fullname = self.make_file('HSCA00000001.fits.fz')
+        watch.run(duration=1.0, max_files=1)
+        self.assertEqual(self.batches, [[fullname]])
+
+
+if __name__ == '__main__':
+    unittest.main()